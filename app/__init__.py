@@ -1,9 +1,11 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy.exc import SQLAlchemyError
 from config import Config
+from app.routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate(compare_type=True)
 
 
@@ -14,15 +16,54 @@ def create_app(config=Config):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from app import profiler
+    profiler.init_app(app)
+
     with app.app_context():
         
-        from app.api import BP as bp_api
+        from app.api import BP as bp_api, API
         app.register_blueprint(bp_api, url_prefix="/api/")
+
+        from app import database, routing
+        database.init_app(app, API)
+        routing.init_app(app)
         
+        from app.tag_index import TAG_INDEX
+        try:
+            TAG_INDEX.load()
+        except SQLAlchemyError as e:
+            # e.g. before the migrations ran, the index then loads on first use
+            db.session.rollback()
+            app.logger.warning("Tag index not loaded at startup: %s", e)
+
         from app.apidocs import BP as bp_apidocs
         app.register_blueprint(bp_apidocs, url_prefix="/apidocs")
 
+        from app.metrics import BP as bp_metrics, REGISTRY
+        REGISTRY.multiproc_dir = app.config["METRICS_MULTIPROC_DIR"]
+        REGISTRY.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+        app.register_blueprint(bp_metrics)
+
+        from app.cli import (
+            advice_pool_cli,
+            data_cli,
+            partitions_cli,
+            personas_cli,
+            pool_cli,
+            rollups_cli,
+            trending_cli,
+            users_cli,
+        )
+        app.cli.add_command(trending_cli)
+        app.cli.add_command(data_cli)
+        app.cli.add_command(pool_cli)
+        app.cli.add_command(advice_pool_cli)
+        app.cli.add_command(users_cli)
+        app.cli.add_command(partitions_cli)
+        app.cli.add_command(rollups_cli)
+        app.cli.add_command(personas_cli)
+
     return app
 
 
-from app import models
+from app import models, search
@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+
+class AdmissionController:
+    """
+    Bounds the number of concurrent executions of an expensive code path in this worker.
+
+    A request is admitted if fewer than <PREFIX>_MAX_CONCURRENCY are running, otherwise it waits
+    in a queue of at most <PREFIX>_MAX_QUEUE requests for up to <PREFIX>_QUEUE_TIMEOUT seconds.
+    A client may hold at most <PREFIX>_MAX_CONCURRENCY_PER_USER running or queued requests.
+    Excess requests are shed right away: 429 for a client over its share, 503 when the queue is
+    full or the wait deadline passes, both with a Retry-After header.
+    """
+
+    def __init__(self, name, config_prefix):
+        self.name = name
+        self.config_prefix = config_prefix
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._per_key = defaultdict(int)
+        self._admitted_total = 0
+        self._rejected_total = defaultdict(int)
+
+    def _setting(self, name):
+        return current_app.config[f"{self.config_prefix}_{name}"]
+
+    def _reject(self, reason, exception_class, description):
+        self._rejected_total[reason] += 1
+        retry_after = self._setting("RETRY_AFTER")
+        current_app.logger.warning(
+            "%s admission rejected (%s): in_flight=%d queued=%d",
+            self.name,
+            reason,
+            self._in_flight,
+            self._waiting,
+        )
+        raise exception_class(description=description, retry_after=retry_after)
+
+    @contextmanager
+    def admit(self, key):
+        """
+        Context manager that holds a concurrency slot for key while its block runs.
+
+        :param key: identifies the client for the per user limit
+        :type key: str
+        :raises werkzeug.exceptions.TooManyRequests: key already holds its share of slots
+        :raises werkzeug.exceptions.ServiceUnavailable: queue full or wait deadline passed
+        """
+
+        max_concurrency = self._setting("MAX_CONCURRENCY")
+        with self._condition:
+            if self._per_key[key] >= self._setting("MAX_CONCURRENCY_PER_USER"):
+                self._reject(
+                    "per_user",
+                    TooManyRequests,
+                    "Too many concurrent generation requests. Please retry later.",
+                )
+            self._per_key[key] += 1
+            try:
+                if self._in_flight >= max_concurrency or self._waiting:
+                    if self._waiting >= self._setting("MAX_QUEUE"):
+                        self._reject(
+                            "queue_full",
+                            ServiceUnavailable,
+                            "Generation is at capacity. Please retry later.",
+                        )
+                    deadline = time.monotonic() + self._setting("QUEUE_TIMEOUT")
+                    self._waiting += 1
+                    try:
+                        while self._in_flight >= max_concurrency:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                self._reject(
+                                    "queue_timeout",
+                                    ServiceUnavailable,
+                                    "Generation is at capacity. Please retry later.",
+                                )
+                            self._condition.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            except Exception:
+                self._release_key(key)
+                raise
+            self._in_flight += 1
+            self._admitted_total += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._release_key(key)
+                self._condition.notify()
+
+    def _release_key(self, key):
+        self._per_key[key] -= 1
+        if not self._per_key[key]:
+            del self._per_key[key]
+
+    def limit(self, key_func):
+        """
+        Decorator that runs a view inside admit(key_func()).
+
+        :param key_func: returns the client key of the current request
+        :type key_func: function
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.admit(key_func()):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of the controller state and counters.
+
+        :return: in_flight, queue_depth, admitted_total and rejected_total by reason
+        :rtype: dict
+        """
+
+        with self._condition:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "admitted_total": self._admitted_total,
+                "rejected_total": dict(self._rejected_total),
+            }
+
+
+class ModelPools:
+    """
+    Bounds the concurrent upstream calls of each model in this worker, one pool per model.
+
+    A call to a model with MODEL_POOL_MAX_CONCURRENCY calls running (or its MODEL_POOL_LIMITS
+    override) waits up to MODEL_POOL_QUEUE_TIMEOUT seconds for one to finish, then is shed with
+    a 503. A slow model only fills its own pool, calls to the other models keep their slots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, model) -> dict:
+        with self._lock:
+            pool = self._pools.get(model)
+            if pool is None:
+                config = current_app.config
+                limit = config["MODEL_POOL_LIMITS"].get(model, config["MODEL_POOL_MAX_CONCURRENCY"])
+                pool = self._pools[model] = {
+                    "limit": limit,
+                    "slots": threading.BoundedSemaphore(limit),
+                    "in_flight": 0,
+                    "waiting": 0,
+                    "rejected_total": 0,
+                }
+            return pool
+
+    @contextmanager
+    def acquire(self, model):
+        """
+        Context manager that holds a slot of the pool of model while its block runs.
+
+        :param model: model called in the block
+        :type model: str
+        :raises werkzeug.exceptions.ServiceUnavailable: no slot freed up in time
+        """
+
+        pool = self._pool(model)
+        with self._lock:
+            pool["waiting"] += 1
+        acquired = pool["slots"].acquire(timeout=current_app.config["MODEL_POOL_QUEUE_TIMEOUT"])
+        with self._lock:
+            pool["waiting"] -= 1
+            if acquired:
+                pool["in_flight"] += 1
+            else:
+                pool["rejected_total"] += 1
+        if not acquired:
+            current_app.logger.warning("Model pool of %s is at capacity (%d)", model, pool["limit"])
+            raise ServiceUnavailable(
+                description="Generation is at capacity. Please retry later.",
+                retry_after=current_app.config["GENERATION_RETRY_AFTER"],
+            )
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                pool["in_flight"] -= 1
+            pool["slots"].release()
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of every pool.
+
+        :return: {model: {"limit", "in_flight", "waiting", "rejected_total"}}
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                model: {key: value for key, value in pool.items() if key != "slots"}
+                for model, pool in self._pools.items()
+            }
+
+
+def client_key() -> str:
+    """
+    Identifies the client of the current request by its authenticated user, or by its address
+    when the request carries no valid credentials. The credentials are verified here when the
+    view does not require authentication, so a made-up username cannot get a share of its own.
+
+    :return: "user:<user_id>" or "addr:<remote address>"
+    :rtype: str
+    """
+
+    if "user" not in g and request.authorization and request.authorization.username:
+        # imported here, app.api.auth imports this module through app.utils
+        from app.api.auth import verify_password
+
+        verify_password(request.authorization.username, request.authorization.password)
+    user = g.get("user")
+    if user is not None:
+        return f"user:{user.user_id}"
+    return f"addr:{request.remote_addr}"
+
+
+GENERATION_ADMISSION = AdmissionController("generation", "GENERATION")
+MODEL_POOLS = ModelPools()
@@ -0,0 +1,256 @@
+"""
+Engagement analytics over a time window, computed with NumPy and pandas.
+
+compute_analytics() fetches every view, like and comment of the window with one UNION ALL
+query, streamed into integer NumPy columns (kind, user, advice, persona, time, day), and the
+tags of the advice viewed in the window. All metrics are then vectorized operations on those
+columns instead of one SQL query each:
+
+- conversion: share of (user, advice) views followed by a like of the same user, no earlier
+  than their first view, overall, per persona and per tag;
+- retention: share of the users first active on day d who are active again k days later,
+  pooled over every first day d of the window;
+- percentiles of views and likes per advice and of events per user.
+
+Results are cached per worker and window for ANALYTICS_CACHE_TTL seconds by ANALYTICS_CACHE.
+"""
+import datetime as dt
+import threading
+import time
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import Integer, cast, func, literal, select, union_all
+from app import db
+from app.models import Advice, EntityComment, EntityLike, EntityTag, EntityView
+
+ANALYTICS_WINDOWS = {
+    "7d": dt.timedelta(days=7),
+    "30d": dt.timedelta(days=30),
+    "90d": dt.timedelta(days=90),
+}
+
+# Values of the kind column
+VIEW, LIKE, COMMENT = 0, 1, 2
+EVENT_MODELS = {VIEW: EntityView, LIKE: EntityLike, COMMENT: EntityComment}
+
+PERCENTILES = [50, 90, 99]
+
+SECONDS_PER_DAY = 86400
+
+
+def _epoch(column):
+    """SQL expression of a timestamp column as integer seconds since 1970-01-01 UTC"""
+    if db.engine.dialect.name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column)), Integer)
+    # SQLite stores the UTC datetime as text
+    return cast(func.strftime("%s", column), Integer)
+
+
+def _fetch_columns(statement, batch_size) -> np.ndarray:
+    """Streams the integer rows of statement into a 2D array, batch_size rows at a time"""
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    chunks = [np.array(rows, dtype=np.int64) for rows in result.partitions()]
+    width = len(result.keys())
+    if not chunks:
+        return np.empty((0, width), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def fetch_events(start, end, batch_size=100000) -> pd.DataFrame:
+    """
+    Fetches the views, likes and comments made between start and end in one query.
+
+    :param start: window start
+    :type start: datetime.datetime
+    :param end: window end
+    :type end: datetime.datetime
+    :param batch_size: rows fetched per round trip
+    :type batch_size: int
+    :return: frame of int64 columns kind, user_id, entity_id, persona_id, time, in seconds
+        since 1970-01-01 UTC, and day, the number of days since start
+    :rtype: pandas.DataFrame
+    """
+
+    branches = []
+    for kind, model in EVENT_MODELS.items():
+        branches.append(
+            select(
+                literal(kind),
+                model.user_id,
+                model.entity_id,
+                func.coalesce(Advice.persona_id, 0),
+                _epoch(model.created_on),
+            )
+            .join(Advice, Advice.entity_id == model.entity_id)
+            .where(
+                model.created_on >= start,
+                model.created_on < end,
+                model.user_id.isnot(None),
+            )
+        )
+    columns = _fetch_columns(union_all(*branches), batch_size)
+    events = pd.DataFrame(
+        columns[:, :5], columns=["kind", "user_id", "entity_id", "persona_id", "time"]
+    )
+    day = (columns[:, 4] - int(start.timestamp())) // SECONDS_PER_DAY
+    events["day"] = np.minimum(day, (end - start).days - 1)
+    return events
+
+
+def _liked(views, likes) -> np.ndarray:
+    """Whether the user of each view liked the advice at the time of the view or later"""
+    # (user_id, entity_id) packed in one int64, a user likes an advice at most once
+    view_keys = (views["user_id"].to_numpy() << 32) | views["entity_id"].to_numpy()
+    like_keys = (likes["user_id"].to_numpy() << 32) | likes["entity_id"].to_numpy()
+    if not len(like_keys):
+        return np.zeros(len(view_keys), dtype=bool)
+    order = np.argsort(like_keys)
+    like_keys, like_times = like_keys[order], likes["time"].to_numpy()[order]
+    position = np.minimum(np.searchsorted(like_keys, view_keys), len(like_keys) - 1)
+    return (like_keys[position] == view_keys) & (like_times[position] >= views["time"].to_numpy())
+
+
+def _conversion(frame, by) -> list:
+    """Views, liked views and conversion of frame grouped by the column by"""
+    grouped = frame.groupby(by)["liked"].agg(["size", "sum"]).reset_index()
+    return [
+        {by: int(key), "views": int(views), "likes": int(likes), "conversion": likes / views}
+        for key, views, likes in grouped.itertuples(index=False)
+    ]
+
+
+def _percentiles(counts) -> dict:
+    if not len(counts):
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    values = np.percentile(counts, PERCENTILES)
+    return {f"p{p}": float(value) for p, value in zip(PERCENTILES, values)}
+
+
+def _retention(events, days) -> list:
+    """Share of users active k days after their first activity, for k = 0 .. days - 1"""
+    if events.empty:
+        return [0.0] * days
+    user_days = np.unique(events["user_id"].to_numpy() * days + events["day"].to_numpy())
+    users, day = np.divmod(user_days, days)
+    # user_days is sorted, so the first row of each user is its first active day
+    first_rows = np.r_[0, np.flatnonzero(np.diff(users)) + 1]
+    first_day = np.repeat(day[first_rows], np.diff(np.r_[first_rows, len(users)]))
+    active = np.bincount(day - first_day, minlength=days)
+    # users whose first day leaves room for an offset of k inside the window
+    observable = np.cumsum(np.bincount(days - 1 - day[first_rows], minlength=days)[::-1])[::-1]
+    return (active / np.maximum(observable, 1)).round(4).tolist()
+
+
+def compute_analytics(time_window, now=None, batch_size=100000) -> dict:
+    """
+    Computes conversion, retention and percentiles of the engagement of time_window.
+
+    :param time_window: key of ANALYTICS_WINDOWS
+    :type time_window: str
+    :param now: end of the window. Defaults to now.
+    :type now: datetime.datetime
+    :param batch_size: event rows fetched per round trip
+    :type batch_size: int
+    :return: {"window", "start", "end", "totals", "personas", "tags", "retention",
+        "percentiles"}
+    :rtype: dict
+    """
+
+    end = now or dt.datetime.now(tz=dt.timezone.utc)
+    start = end - ANALYTICS_WINDOWS[time_window]
+    days = ANALYTICS_WINDOWS[time_window].days
+    events = fetch_events(start, end, batch_size=batch_size)
+    viewed = (
+        select(EntityView.entity_id)
+        .where(EntityView.created_on >= start, EntityView.created_on < end)
+        .distinct()
+    )
+    tags = pd.DataFrame(
+        _fetch_columns(
+            select(EntityTag.entity_id, EntityTag.tag_id).where(EntityTag.entity_id.in_(viewed)),
+            batch_size,
+        ),
+        columns=["entity_id", "tag_id"],
+    )
+    db.session.commit()
+
+    kind = events["kind"].to_numpy()
+    # first view of each (user, advice)
+    views = (
+        events[kind == VIEW]
+        .sort_values("time", kind="stable")
+        .drop_duplicates(["user_id", "entity_id"])
+    )
+    likes = events[kind == LIKE]
+    views = views.assign(liked=_liked(views, likes))
+
+    total_views = len(views)
+    total_liked = int(views["liked"].sum())
+    return {
+        "window": time_window,
+        "start": start,
+        "end": end,
+        "totals": {
+            "views": total_views,
+            "likes": len(likes),
+            "comments": int((kind == COMMENT).sum()),
+            "users": int(events["user_id"].nunique()),
+            "conversion": total_liked / total_views if total_views else 0.0,
+        },
+        "personas": _conversion(views, "persona_id"),
+        "tags": _conversion(views.merge(tags, on="entity_id"), "tag_id"),
+        "retention": _retention(events, days),
+        "percentiles": {
+            "views_per_advice": _percentiles(views["entity_id"].value_counts().to_numpy()),
+            "likes_per_advice": _percentiles(likes["entity_id"].value_counts().to_numpy()),
+            "events_per_user": _percentiles(events["user_id"].value_counts().to_numpy()),
+        },
+    }
+
+
+class AnalyticsCache:
+    """
+    Per-worker cache of compute_analytics() results by window. Entries expire after
+    ANALYTICS_CACHE_TTL seconds; concurrent misses on the same window compute it once.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._window_locks = {window: threading.Lock() for window in ANALYTICS_WINDOWS}
+
+    def get(self, time_window) -> dict:
+        """
+        Returns the analytics of time_window, computing them on a miss.
+
+        :param time_window: key of ANALYTICS_WINDOWS
+        :type time_window: str
+        :return: result of compute_analytics
+        :rtype: dict
+        """
+
+        config = current_app.config
+        with self._window_locks[time_window]:
+            with self._lock:
+                entry = self._entries.get(time_window)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            result = compute_analytics(time_window, batch_size=config["ANALYTICS_BATCH_SIZE"])
+            with self._lock:
+                self._entries[time_window] = (
+                    time.monotonic() + config["ANALYTICS_CACHE_TTL"],
+                    result,
+                )
+            return result
+
+    def invalidate(self, time_window=None) -> None:
+        """Drops the cached analytics of time_window, or of every window"""
+        with self._lock:
+            if time_window is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(time_window, None)
+
+
+ANALYTICS_CACHE = AnalyticsCache()
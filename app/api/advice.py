@@ -1,6 +1,7 @@
-import os
+import json
+import zlib
 import openai
-from flask import request, current_app
+from flask import request, current_app, url_for, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields
 from flask_restx.errors import abort
 from app import db
@@ -21,15 +22,28 @@ from app.utils import (
     commit_to_db,
     get_adviceslip_by_id,
     create_from_entity,
+    parse_id_list,
 )
+from app.admission import GENERATION_ADMISSION, client_key
+from app.analytics import ANALYTICS_CACHE, ANALYTICS_WINDOWS, PERCENTILES
+from app.feed import SEEN_CACHE
+from app.generation import REFILLER, choose_adviceslip, claim_pooled_advice, render_advice
+from app.metrics.instruments import ADVICE_POOL_CLAIMS
+from app.rollups import get_daily_stats, record_rollup
+from app.search import search_advice
+from app.tag_index import TAG_INDEX, tag_filters
+from app.trending import TRENDING_WINDOWS, get_trending, record_engagement
 import datetime as dt
 from random import choice
+from sqlalchemy import func
 import requests
 
 LIST_OF_ADVICESLIPS_FROM_SOURCE = list(range(1, 225))
+MAX_BULK_DELETE = 1000
+MAX_STATS_DAYS = 366
+DEFAULT_STATS_DAYS = 30
 
 NS = Namespace("advice", description="Advice related operations")
-OPENAI_MODEL = os.getenv("OPENAI_FINETUNED_MODEL")
 
 advice_model = NS.model(
     "Advice",
@@ -88,6 +102,20 @@ generate_advice_model = NS.model(
     },
 )
 
+advice_ids_model = NS.model(
+    "AdviceIds",
+    {
+        "entity_ids": fields.List(
+            fields.Integer,
+            required=True,
+            description="entity_ids of the advice",
+            example=[1, 2, 3],
+            min_items=1,
+            max_items=MAX_BULK_DELETE,
+        ),
+    },
+)
+
 userid_entityid_model = NS.model(
     "AdviceView",
     {
@@ -163,6 +191,251 @@ persona_model = NS.model(
     },
 )
 
+advice_search_model = NS.model(
+    "AdviceSearchResults",
+    {
+        "items": fields.List(
+            fields.Nested(
+                NS.clone(
+                    "AdviceSearchHit",
+                    advice_model,
+                    {"rank": fields.Float(description="Relevance score")},
+                ),
+                skip_none=True,
+            )
+        ),
+        "_meta": fields.Nested(
+            {
+                "per_page": fields.Integer(),
+                "next_cursor": fields.String(),
+            }
+        ),
+        "_links": fields.Nested(
+            {
+                "self": fields.String(),
+                "next": fields.String(),
+            }
+        ),
+    },
+)
+
+trending_model = NS.model(
+    "TrendingAdvice",
+    {
+        "window": fields.String(description="Trending window", example="24h"),
+        "items": fields.List(
+            fields.Nested(
+                NS.clone(
+                    "TrendingAdviceItem",
+                    advice_model,
+                    {
+                        "score": fields.Float(
+                            description="Time-decayed engagement score"
+                        )
+                    },
+                ),
+                skip_none=True,
+            )
+        ),
+    },
+)
+
+daily_stats_model = NS.model(
+    "DailyStats",
+    {
+        "start": fields.Date(),
+        "end": fields.Date(),
+        "persona_id": fields.Integer(),
+        "tag_id": fields.Integer(),
+        "items": fields.List(
+            fields.Nested(
+                NS.model(
+                    "DailyStatsItem",
+                    {
+                        "day": fields.Date(),
+                        "advice": fields.Integer(description="Advice created"),
+                        "views": fields.Integer(),
+                        "likes": fields.Integer(),
+                        "comments": fields.Integer(),
+                    },
+                )
+            )
+        ),
+    },
+)
+
+conversion_fields = {
+    "views": fields.Integer(description="Distinct (user, advice) views"),
+    "likes": fields.Integer(description="Views followed by a like"),
+    "conversion": fields.Float(description="likes / views"),
+}
+percentiles_model = NS.model(
+    "Percentiles", {f"p{p}": fields.Float() for p in PERCENTILES}
+)
+analytics_model = NS.model(
+    "EngagementAnalytics",
+    {
+        "window": fields.String(example="7d"),
+        "start": fields.DateTime(),
+        "end": fields.DateTime(),
+        "totals": fields.Nested(
+            NS.model(
+                "EngagementTotals",
+                {
+                    "views": fields.Integer(description="Distinct (user, advice) views"),
+                    "likes": fields.Integer(),
+                    "comments": fields.Integer(),
+                    "users": fields.Integer(description="Users with any engagement"),
+                    "conversion": fields.Float(description="Share of views followed by a like"),
+                },
+            )
+        ),
+        "personas": fields.List(
+            fields.Nested(
+                NS.model(
+                    "PersonaConversion", {"persona_id": fields.Integer(), **conversion_fields}
+                )
+            )
+        ),
+        "tags": fields.List(
+            fields.Nested(
+                NS.model("TagConversion", {"tag_id": fields.Integer(), **conversion_fields})
+            )
+        ),
+        "retention": fields.List(
+            fields.Float(),
+            description="Share of users active again k days after their first activity, by k",
+        ),
+        "percentiles": fields.Nested(
+            NS.model(
+                "EngagementPercentiles",
+                {
+                    "views_per_advice": fields.Nested(percentiles_model),
+                    "likes_per_advice": fields.Nested(percentiles_model),
+                    "events_per_user": fields.Nested(percentiles_model),
+                },
+            )
+        ),
+    },
+)
+
+advice_filter_params = {
+    "date": "Date of interest. Required format: YYYY-MM-DD",
+    "filter_by_persona_id": "persona_id to filter results by.",
+    "viewed_by_user_id": "user_id who has viewed the advice.",
+    "tagged_with_tag_id": "filter by tag_id. Add viewed_by_user_id if you want only the advice tagged by a specific user_id",
+    "tags_all": "Comma separated tag_ids. Only advice with all of these tags.",
+    "tags_any": "Comma separated tag_ids. Only advice with at least one of these tags.",
+    "tags_none": "Comma separated tag_ids. Only advice with none of these tags.",
+}
+
+
+def advice_filters_from_args(args) -> tuple:
+    """
+    Builds the SQLAlchemy filters shared by the advice listing and export endpoints.
+    View filters are expressed as subqueries so the matching ids are never loaded into memory.
+    Tag filters are resolved with the in-memory tag index first, see app/tag_index.py.
+
+    :param args: request query arguments
+    :type args: werkzeug.datastructures.MultiDict
+    :return: list of filters to apply on an Advice query and the requested date (or None)
+    :rtype: list, str
+    """
+
+    args_filters = []
+
+    date = args.get("date")
+    if date:
+        if not validate_date_format(date):
+            abort(400, "Invalid date format.")
+        datetime = dt.datetime.strptime(date, "%Y-%m-%d")
+        args_filters.extend(
+            [
+                Advice.created_on >= datetime.date(),
+                Advice.created_on < datetime + dt.timedelta(days=1),
+            ]
+        )
+    else:
+        date = None
+
+    filter_by_persona_id = args.get("filter_by_persona_id", None, type=int)
+    if filter_by_persona_id:
+        args_filters.append(Advice.persona_id == filter_by_persona_id)
+
+    viewed_by_user_id = args.get("viewed_by_user_id", None, type=int)
+    if viewed_by_user_id:
+        args_filters.append(
+            Advice.entity_id.in_(
+                db.session.query(EntityView.entity_id).filter_by(
+                    user_id=viewed_by_user_id
+                )
+            )
+        )
+
+    try:
+        tags_all = parse_id_list(args.get("tags_all"))
+        tags_any = parse_id_list(args.get("tags_any"))
+        tags_none = parse_id_list(args.get("tags_none"))
+    except ValueError:
+        abort(400, "tags_all, tags_any and tags_none must be comma separated integers.")
+
+    tagged_with_tag_id = args.get("tagged_with_tag_id", None, type=int)
+    if tagged_with_tag_id:
+        # read from entity_tag, not the tag index, so tags of other workers show at once
+        tagged = db.session.query(EntityTag.entity_id).filter_by(tag_id=tagged_with_tag_id)
+        if viewed_by_user_id:
+            tagged = tagged.filter_by(user_id=viewed_by_user_id)
+        args_filters.append(Advice.entity_id.in_(tagged))
+    args_filters.extend(tag_filters(tags_all, tags_any, tags_none))
+
+    return args_filters, date
+
+
+def advice_export_query(args_filters) -> "sqlalchemy.orm.Query":
+    """
+    Builds a column-only query of advice rows with their like, view and comment counts.
+    Engagement counts are aggregated once per table and outer joined, instead of counted per row.
+
+    :param args_filters: filters returned by advice_filters_from_args()
+    :type args_filters: list
+    :return: query ordered by entity_id that streams results in batches of EXPORT_YIELD_PER rows
+    :rtype: sqlalchemy.orm.Query
+    """
+
+    counts = []
+    for model in (EntityLike, EntityView, EntityComment):
+        counts.append(
+            db.session.query(
+                model.entity_id.label("entity_id"),
+                func.count().label("total"),
+            )
+            .group_by(model.entity_id)
+            .subquery()
+        )
+    likes, views, comments = counts
+
+    query = (
+        db.session.query(
+            Advice.entity_id,
+            Advice.persona_id,
+            Persona.name.label("persona"),
+            Advice.content,
+            Advice.adviceslip_id,
+            Advice.created_on,
+            func.coalesce(likes.c.total, 0).label("likes"),
+            func.coalesce(views.c.total, 0).label("views"),
+            func.coalesce(comments.c.total, 0).label("comments"),
+        )
+        .outerjoin(Persona, Advice.persona_id == Persona.persona_id)
+        .outerjoin(likes, likes.c.entity_id == Advice.entity_id)
+        .outerjoin(views, views.c.entity_id == Advice.entity_id)
+        .outerjoin(comments, comments.c.entity_id == Advice.entity_id)
+        .filter(*args_filters)
+        .order_by(Advice.entity_id)
+        .yield_per(current_app.config["EXPORT_YIELD_PER"])
+    )
+    return query
+
 
 @NS.route("/")
 @NS.response(400, "Invalid Request.")
@@ -172,73 +445,15 @@ class AdviceDate(Resource):
     @NS.marshal_with(advice_collection_model, as_list=True, skip_none=True, code=200)
     @NS.doc(
         params={
-            "date": "Date of interest. Required format: YYYY-MM-DD",
+            **advice_filter_params,
             "page": "Page requested for pagination purposes.",
             "per_page": f"Number of users per page for pagination purposes. Defaults to {current_app.config['PAGINATION_ITEMS_PER_PAGE']}",
-            "filter_by_persona_id": "persona_id to filter results by.",
-            "viewed_by_user_id": "user_id who has viewed the advice.",
-            "tagged_with_tag_id": "filter by tag_id. Add viewed_by_user_id if you want only the advice tagged by a specific user_id",
         }
     )
     def get(self):
         """Get advice"""
 
-        args_filters = []
-
-        if request.args.get("date"):
-            date = request.args.get("date")
-            if not validate_date_format(date):
-                abort(400, "Invalid date format.")
-            datetime = dt.datetime.strptime(date, "%Y-%m-%d")
-            args_filters.extend(
-                [
-                    Advice.created_on >= datetime.date(),
-                    Advice.created_on < datetime + dt.timedelta(days=1),
-                ]
-            )
-        else:
-            date = None
-
-        filter_by_persona_id = request.args.get("filter_by_persona_id", None, type=int)
-        if filter_by_persona_id:
-            args_filters.append(Advice.persona_id == filter_by_persona_id)
-
-        viewed_by_user_id = request.args.get("viewed_by_user_id", None, type=int)
-        if viewed_by_user_id:
-            advice_ids = [
-                uid[0]
-                for uid in EntityView.query.filter_by(user_id=viewed_by_user_id)
-                .with_entities(EntityView.entity_id)
-                .distinct()
-                .all()
-            ]
-            args_filters.append(Advice.entity_id.in_(advice_ids))
-
-        tagged_with_tag_id = request.args.get("tagged_with_tag_id", None, type=int)
-        if tagged_with_tag_id:
-            if viewed_by_user_id:
-                print("Here")
-                advice_ids = [
-                    uid[0]
-                    for uid in EntityTag.query.filter_by(
-                        tag_id=tagged_with_tag_id, user_id=viewed_by_user_id
-                    )
-                    .with_entities(EntityTag.entity_id)
-                    .distinct()
-                    .all()
-                ]
-
-            else:
-                advice_ids = [
-                    uid[0]
-                    for uid in EntityTag.query.filter_by(tag_id=tagged_with_tag_id)
-                    .with_entities(EntityTag.entity_id)
-                    .distinct()
-                    .all()
-                ]
-            print(advice_ids)
-
-            args_filters.append(Advice.entity_id.in_(advice_ids))
+        args_filters, date = advice_filters_from_args(request.args)
 
         query = Advice.query.filter(*args_filters)
 
@@ -260,6 +475,8 @@ class AdviceDate(Resource):
     @NS.response(409, "Cannot source new advice from Adviceslip.")
     @NS.response(500, "Internal Server Error")
     @NS.response(502, "Bad Gateway")
+    @NS.response(429, "Too many concurrent generation requests from this client.")
+    @NS.response(503, "Generation is at capacity.")
     @NS.expect(generate_advice_model, validate=True)
     def post(self):
         """Create generate and add new advice to database"""
@@ -268,6 +485,20 @@ class AdviceDate(Resource):
         persona_id = request.json.get("persona_id", DEFAULT_PERSONA_ID)
         get_new_advice = request.json.get("get_new_advice", DEFAULT_GET_NEW_ADVICE)
 
+        # Serve pre-generated advice of the persona if there is any
+        if not get_new_advice and current_app.config["ADVICE_POOL_SIZE"]:
+            claimed = claim_pooled_advice(persona_id)
+            ADVICE_POOL_CLAIMS.inc("hit" if claimed else "miss")
+            if claimed:
+                adviceslip_id, content = claimed
+                return self._save_advice(persona_id, adviceslip_id, content)
+
+        return self._generate(persona_id, get_new_advice)
+
+    @GENERATION_ADMISSION.limit(client_key)
+    def _generate(self, persona_id, get_new_advice):
+        """Sources an adviceslip and generates the persona's advice from it with OpenAI"""
+
         # Source adviceslip from adviceslip api or from database
         if get_new_advice:
             pass
@@ -293,6 +524,9 @@ class AdviceDate(Resource):
                 )
             new_slip_id = choice(missing_slips)
 
+            # End the read transaction so its connection goes back to the pool during the call
+            db.session.commit()
+
             # Get new advice from adviceslip_id
             got_advice, content = get_adviceslip_by_id(new_slip_id)
             if got_advice:
@@ -306,6 +540,8 @@ class AdviceDate(Resource):
                     ),
                 )
                 db.session.add_all([entity, advice])
+                db.session.flush()
+                record_rollup(advice.entity_id, "advice", occurred_on=advice.created_on)
 
                 added_advice, msg = commit_to_db(db)
                 if not added_advice:
@@ -316,65 +552,281 @@ class AdviceDate(Resource):
 
         else:
             # search for advice not given by persona
-            adviceslips_by_persona = [
-                a.adviceslip_id
-                for a in Advice.query.filter_by(persona_id=persona_id)
-                .with_entities(Advice.adviceslip_id)
-                .distinct()
-            ]
-            all_unique_adviceslips_in_db = [
-                slip.adviceslip_id
-                for slip in Advice.query.with_entities(Advice.adviceslip_id).distinct()
-            ]
+            new_slip_id = choose_adviceslip(persona_id)
+            if new_slip_id is None:
+                abort(
+                    409,
+                    "There is no advice to source from yet. Please try again and make the get_new_advice parameter True.",
+                )
 
-            advice_slip_not_given_by_persona = [
-                slip
-                for slip in all_unique_adviceslips_in_db
-                if slip not in adviceslips_by_persona
-            ]
+        # generate persona voice using openai api. render_advice releases the connection while
+        # waiting on OpenAI, the new advice is inserted in a short transaction afterwards.
+        try:
+            content = render_advice(new_slip_id, persona_id)
+        except openai.error.OpenAIError as e:
+            abort(502, f"Could not generate advice. OpenAI: {type(e).__name__}")
 
-            if advice_slip_not_given_by_persona:
-                # select a new adviceslip_id from those not given by persona yet.
-                new_slip_id = choice(advice_slip_not_given_by_persona)
-            else:
-                # otherwise get an existing adviceslip_id
-                new_slip_id = choice(all_unique_adviceslips_in_db)
-
-        # generate persona voice using openai api
-        content = (
-            Advice.query.with_entities(Advice.content)
-            .filter_by(adviceslip_id=new_slip_id)
-            .first()
-            .content
-        )
-        response_obj = openai.Completion.create(
-            model=OPENAI_MODEL,
-            prompt=content + ":::",
-            temperature=0.2,
-            stop=[":::"],
-            max_tokens=1024,
-        )
+        return self._save_advice(persona_id, new_slip_id, content)
+
+    @NS.response(200, "Advice deleted.")
+    @NS.expect(advice_ids_model, validate=True)
+    @NS.doc(security="Basic Auth")
+    @auth.login_required
+    def delete(self):
+        """
+        Delete many advice in one statement. Their likes, views, comments and tags are
+        removed by the database (ON DELETE CASCADE).
+        """
+
+        entity_ids = request.json.get("entity_ids")
+        deleted = db.session.execute(
+            db.delete(Entity).where(
+                Entity.entity_id.in_(entity_ids), Entity.type == "advice"
+            ),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        commited_to_db, msg = commit_to_db(db)
+        if commited_to_db:
+            return {"deleted": deleted}, 200
+        else:
+            abort(500, f"Server Error: {msg}")
 
-        content = response_obj["choices"][0]["text"]
+    def _save_advice(self, persona_id, adviceslip_id, content):
+        """Adds the advice to the database and schedules a refill of the persona's pool"""
 
         # add new advice to database
         entity, advice = create_from_entity(
             "advice",
             **dict(
-                adviceslip_id=new_slip_id,
+                adviceslip_id=adviceslip_id,
                 persona_id=persona_id,
                 content=content,
             ),
         )
         db.session.add_all([entity, advice])
+        db.session.flush()
+        record_rollup(advice.entity_id, "advice", occurred_on=advice.created_on)
 
         added_advice, msg = commit_to_db(db)
         if not added_advice:
             abort(500, msg)
         else:
+            REFILLER.trigger(persona_id)
             return advice.content, 201
 
 
+@NS.route("/export")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+class AdviceExport(Resource):
+    @NS.response(200, "Successful request. Body is newline delimited JSON.")
+    @NS.produces(["application/x-ndjson"])
+    @NS.doc(
+        params={
+            **advice_filter_params,
+            "compress": "Set to gzip to receive a gzip encoded stream.",
+        }
+    )
+    def get(self):
+        """Export advice with engagement counts as a stream of NDJSON lines"""
+
+        args_filters, _ = advice_filters_from_args(request.args)
+        compress = request.args.get("compress")
+        if compress not in (None, "gzip"):
+            abort(400, "Invalid compress value. Only gzip is supported.")
+
+        query = advice_export_query(args_filters)
+        batch_size = current_app.config["EXPORT_YIELD_PER"]
+
+        def generate():
+            compressor = (
+                zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+            )
+            lines = []
+            for row in query:
+                row = row._asdict()
+                row["created_on"] = (
+                    row["created_on"].isoformat() if row["created_on"] else None
+                )
+                lines.append(json.dumps(row))
+                if len(lines) >= batch_size:
+                    chunk = ("\n".join(lines) + "\n").encode()
+                    lines = []
+                    yield compressor.compress(chunk) if compressor else chunk
+            if lines:
+                chunk = ("\n".join(lines) + "\n").encode()
+                yield compressor.compress(chunk) if compressor else chunk
+            if compressor:
+                yield compressor.flush()
+
+        headers = {"Content-Disposition": "attachment; filename=advice.ndjson"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        return Response(
+            stream_with_context(generate()),
+            mimetype="application/x-ndjson",
+            headers=headers,
+        )
+
+
+@NS.route("/search")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+@NS.response(501, "Search is not available for this database.")
+class AdviceSearch(Resource):
+    @NS.response(200, "Successful request.")
+    @NS.marshal_with(advice_search_model, skip_none=True, code=200)
+    @NS.doc(
+        params={
+            "q": "Text to search for in advice and its comments.",
+            "filter_by_persona_id": "persona_id to filter results by.",
+            "tagged_with_tag_id": "filter by tag_id.",
+            "cursor": "next_cursor returned by the previous page.",
+            "per_page": f"Number of results per page. Defaults to {current_app.config['PAGINATION_ITEMS_PER_PAGE']}",
+        }
+    )
+    def get(self):
+        """Search advice by content and comments, most relevant first"""
+
+        search_text = request.args.get("q", "").strip()
+        if not search_text:
+            abort(400, "The q parameter is required.")
+
+        persona_id = request.args.get("filter_by_persona_id", None, type=int)
+        tag_id = request.args.get("tagged_with_tag_id", None, type=int)
+        cursor = request.args.get("cursor")
+        per_page = request.args.get(
+            "per_page", current_app.config["PAGINATION_ITEMS_PER_PAGE"], type=int
+        )
+
+        try:
+            results, next_cursor = search_advice(
+                search_text,
+                persona_id=persona_id,
+                tag_id=tag_id,
+                after=cursor,
+                limit=per_page,
+            )
+        except ValueError:
+            abort(400, "Invalid cursor.")
+        except NotImplementedError as e:
+            abort(501, str(e))
+
+        link_args = dict(
+            q=search_text,
+            filter_by_persona_id=persona_id,
+            tagged_with_tag_id=tag_id,
+            per_page=per_page,
+        )
+        data = {
+            "items": [dict(advice.to_dict(), rank=rank) for advice, rank in results],
+            "_meta": {"per_page": per_page, "next_cursor": next_cursor},
+            "_links": {
+                "self": url_for("api.advice_advice_search", cursor=cursor, **link_args),
+                "next": url_for(
+                    "api.advice_advice_search", cursor=next_cursor, **link_args
+                )
+                if next_cursor
+                else None,
+            },
+        }
+        return data, 200
+
+
+@NS.route("/trending")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+class AdviceTrending(Resource):
+    @NS.response(200, "Successful request.")
+    @NS.marshal_with(trending_model, skip_none=True, code=200)
+    @NS.doc(
+        params={
+            "window": f"Trending window, one of {', '.join(TRENDING_WINDOWS)}. Defaults to 24h",
+            "limit": "Number of advice to return (max 100). Defaults to 10",
+        }
+    )
+    def get(self):
+        """Get the most engaged advice, weighting recent views, likes and comments higher"""
+
+        time_window = request.args.get("window", "24h")
+        if time_window not in TRENDING_WINDOWS:
+            abort(400, f"Invalid window. Use one of {', '.join(TRENDING_WINDOWS)}.")
+        limit = request.args.get("limit", 10, type=int)
+        if not 0 < limit <= 100:
+            abort(400, "limit must be between 1 and 100.")
+
+        items = [
+            dict(advice.to_dict(), score=score)
+            for advice, score in get_trending(time_window, limit=limit)
+        ]
+        return {"window": time_window, "items": items}, 200
+
+
+@NS.route("/stats")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+class AdviceStats(Resource):
+    @NS.response(200, "Successful request.")
+    @NS.marshal_with(daily_stats_model, skip_none=True, code=200)
+    @NS.doc(
+        params={
+            "start": f"First day, YYYY-MM-DD. Defaults to {DEFAULT_STATS_DAYS} days before end.",
+            "end": "Last day, YYYY-MM-DD, included. Defaults to today (UTC).",
+            "persona_id": "Only count this persona's advice.",
+            "tag_id": "Only count advice with this tag.",
+        }
+    )
+    def get(self):
+        """Get advice created, views, likes and comments per day, from the daily rollups"""
+
+        days = {}
+        for arg in ("start", "end"):
+            value = request.args.get(arg)
+            if value is not None and not validate_date_format(value):
+                abort(400, f"Invalid {arg} date format.")
+            days[arg] = dt.date.fromisoformat(value) if value else None
+        end = days["end"] or dt.datetime.now(tz=dt.timezone.utc).date()
+        start = days["start"] or end - dt.timedelta(days=DEFAULT_STATS_DAYS - 1)
+        if start > end:
+            abort(400, "start must not be after end.")
+        if (end - start).days >= MAX_STATS_DAYS:
+            abort(400, f"At most {MAX_STATS_DAYS} days can be requested at once.")
+
+        persona_id = request.args.get("persona_id", None, type=int)
+        tag_id = request.args.get("tag_id", None, type=int)
+        items = get_daily_stats(start, end, persona_id=persona_id, tag_id=tag_id)
+        return {
+            "start": start,
+            "end": end,
+            "persona_id": persona_id,
+            "tag_id": tag_id,
+            "items": items,
+        }, 200
+
+
+@NS.route("/analytics")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+class AdviceAnalytics(Resource):
+    @NS.response(200, "Successful request.")
+    @NS.marshal_with(analytics_model, code=200)
+    @NS.doc(
+        params={
+            "window": f"Analytics window, one of {', '.join(ANALYTICS_WINDOWS)}. Defaults to 7d",
+        }
+    )
+    def get(self):
+        """
+        Get view to like conversion per persona and tag, retention and engagement percentiles.
+        Results are cached per window for ANALYTICS_CACHE_TTL seconds.
+        """
+
+        time_window = request.args.get("window", "7d")
+        if time_window not in ANALYTICS_WINDOWS:
+            abort(400, f"Invalid window. Use one of {', '.join(ANALYTICS_WINDOWS)}.")
+        return ANALYTICS_CACHE.get(time_window), 200
+
+
 @NS.route("/<int:entity_id>")
 @NS.response(201, "Successful request.")
 @NS.response(400, "Invalid Request.")
@@ -441,12 +893,18 @@ class Views(Resource):
                 if EntityView.query.filter_by(entity=advice.entity, user=user).first():
                     abort(409, "This view was previously documented.")
                 else:
-                    view_entity = EntityView(entity=advice.entity, user=user)
+                    viewed_on = dt.datetime.now(tz=dt.timezone.utc)
+                    view_entity = EntityView(
+                        entity=advice.entity, user=user, created_on=viewed_on
+                    )
                     db.session.add(view_entity)
+                    record_engagement(entity_id, "view", occurred_on=viewed_on)
+                    record_rollup(entity_id, "view", occurred_on=viewed_on)
                     added_advice, msg = commit_to_db(db)
                     if not added_advice:
                         abort(500, msg)
                     else:
+                        SEEN_CACHE.mark_seen(user_id, entity_id)
                         return f"User <{user_id}> viewed advice <{entity_id}>", 201
 
 
@@ -478,8 +936,13 @@ class Like(Resource):
                         409, f"User <{user_id}> has already liked advice <{entity_id}>"
                     )
                 else:
-                    like_entity = EntityLike(entity=advice.entity, user=user)
+                    liked_on = dt.datetime.now(tz=dt.timezone.utc)
+                    like_entity = EntityLike(
+                        entity=advice.entity, user=user, created_on=liked_on
+                    )
                     db.session.add(like_entity)
+                    record_engagement(entity_id, "like", occurred_on=liked_on)
+                    record_rollup(entity_id, "like", occurred_on=liked_on)
                     added_advice, msg = commit_to_db(db)
                     if not added_advice:
                         abort(500, msg)
@@ -497,8 +960,13 @@ class Like(Resource):
         user = User.query.filter_by(user_id=user_id).first()
 
         like = EntityLike.query.filter_by(entity=advice.entity, user=user)
+        liked = like.first()
 
-        if like:
+        if liked:
+            record_engagement(
+                entity_id, "like", occurred_on=liked.created_on, undo=True
+            )
+            record_rollup(entity_id, "like", occurred_on=liked.created_on, undo=True)
             like.delete()
         else:
             abort(404, f"User <{user_id}> has not liked advice <{entity_id}")
@@ -528,8 +996,13 @@ class Comment(Resource):
         if user_id and entity_id and content:
             advice = Advice.query.filter_by(entity_id=entity_id).first()
             user = User.query.filter_by(user_id=user_id).first()
-            comment = EntityComment(entity=advice.entity, user=user, content=content)
+            commented_on = dt.datetime.now(tz=dt.timezone.utc)
+            comment = EntityComment(
+                entity=advice.entity, user=user, content=content, created_on=commented_on
+            )
             db.session.add(comment)
+            record_engagement(entity_id, "comment", occurred_on=commented_on)
+            record_rollup(entity_id, "comment", occurred_on=commented_on)
             commited_to_db, msg = commit_to_db(db)
             if commited_to_db:
                 return f"User <{user_id}> commented on <{entity_id}>", 200
@@ -545,7 +1018,17 @@ class Comment(Resource):
         comment = EntityComment.query.filter_by(
             comment_id=comment_id, entity_id=entity_id
         )
-        if comment.first():
+        existing_comment = comment.first()
+        if existing_comment:
+            record_engagement(
+                entity_id,
+                "comment",
+                occurred_on=existing_comment.created_on,
+                undo=True,
+            )
+            record_rollup(
+                entity_id, "comment", occurred_on=existing_comment.created_on, undo=True
+            )
             comment.delete()
         else:
             abort(
@@ -582,8 +1065,12 @@ class AdviceTag(Resource):
             if tag:
                 entity_tag = EntityTag(entity=advice.entity, tag=tag, user=user)
                 db.session.add(entity_tag)
+                record_rollup(
+                    entity_id, "advice", occurred_on=advice.created_on, tag_id=tag_id
+                )
                 commited_to_db, msg = commit_to_db(db)
                 if commited_to_db:
+                    TAG_INDEX.add(tag_id, entity_id)
                     return (
                         f"User <{user_id}> added tag <{tag_id}> to entity <{entity_id}>",
                         200,
@@ -601,11 +1088,21 @@ class AdviceTag(Resource):
         entity_id = request.json.get("entity_id")
         entity_tag = EntityTag.query.filter_by(tag_id=tag_id, entity_id=entity_id)
         if entity_tag.first():
+            advice = Advice.query.filter_by(entity_id=entity_id).first()
+            if advice:
+                record_rollup(
+                    entity_id,
+                    "advice",
+                    occurred_on=advice.created_on,
+                    undo=True,
+                    tag_id=tag_id,
+                )
             entity_tag.delete()
         else:
             abort(404, f"tag <{tag_id}> on entity <{entity_id}> does not exist. ")
         commited_to_db, msg = commit_to_db(db)
         if commited_to_db:
+            TAG_INDEX.discard(tag_id, entity_id)
             return f"tag <{tag_id}> deleted from entity <{entity_id}>", 200
         else:
             abort(500, f"Server Error: {msg}")
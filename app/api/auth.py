@@ -2,7 +2,9 @@ from flask import g
 from flask_restx import Namespace, Resource, fields
 from flask_restx.errors import abort
 from flask_httpauth import HTTPBasicAuth
+from sqlalchemy.orm import joinedload
 from app.models import User
+from app.roles import user_role_names
 from app.utils import create_flaskrestx_parser
 
 authorizations = {
@@ -28,6 +30,7 @@ def verify_password(username_or_token, password) -> bool:
     },
 
     This function is required by the flask-HTTPAuth library.
+    The roles of the user are loaded with it, so role checks need no further queries.
 
     :param username_or_token: Token in case of token authentication, Username otherwise.
     :type username: str
@@ -46,7 +49,11 @@ def verify_password(username_or_token, password) -> bool:
 
     # Otherwise, authenticate with username and password
     else:
-        user = User.query.filter(User.username == username_or_token).first()
+        user = (
+            User.query.options(joinedload(User.role_association))
+            .filter(User.username == username_or_token)
+            .first()
+        )
         if user and user.check_password(password):
             g.user = user
             return True
@@ -55,6 +62,24 @@ def verify_password(username_or_token, password) -> bool:
             return False
 
 
+@auth.get_user_roles
+def get_user_roles(user) -> list:
+    """
+    Decorator to get the roles of the authenticated user, used by
+    auth.login_required(role="admin"). Roles are preloaded into g.user by verify_password
+    and resolved with the role registry, without queries.
+
+    This function is required by the flask-HTTPAuth library to check roles.
+
+    :param user: username or token the user authenticated with (the user is in g.user)
+    :type user: str
+    :return: role names of the user
+    :rtype: list
+    """
+
+    return user_role_names(g.user)
+
+
 @auth.error_handler
 def auth_error(status) -> int:
     """
@@ -1,12 +1,21 @@
-from flask import g, request, current_app
+import io
+from itertools import islice
+from flask import g, request, current_app, url_for
 from flask_restx import Namespace, Resource, fields
 from flask_restx.errors import abort
-from app.models import User
+from app.models import User, UserImport
 from app.utils import (
+    EMAIL_PATTERN,
+    PASSWORD_PATTERN,
+    USERNAME_PATTERN,
     create_flaskrestx_parser,
     commit_to_db,
-    user_attr_unique_notempty_check,
+    parse_id_list,
+    user_attr_notempty_check,
+    user_conflict_check,
 )
+from app.feed import default_feed_seed, unseen_feed
+from app.user_import import IMPORT_RUNNER, read_user_rows
 from app import db
 from app.api.auth import auth
 
@@ -66,6 +75,45 @@ user_collection_model = NS.model(
     },
 )
 
+feed_model = NS.model(
+    "UserFeed",
+    {
+        "items": fields.List(
+            fields.Nested(
+                NS.model(
+                    "FeedAdvice",
+                    {
+                        "entity_id": fields.Integer(description="Entity Id", example=1),
+                        "persona_id": fields.Integer(description="Persona Id", example=1),
+                        "persona": fields.String(
+                            description="Persona that gave advice", example="Unknown"
+                        ),
+                        "content": fields.String(
+                            description="Advice Text", example="Write good endpoints"
+                        ),
+                        "created_on": fields.DateTime(),
+                        "adviceslip_id": fields.Integer(),
+                    },
+                ),
+                skip_none=True,
+            )
+        ),
+        "_meta": fields.Nested(
+            {
+                "per_page": fields.Integer(),
+                "seed": fields.Integer(),
+                "next_cursor": fields.Integer(),
+            }
+        ),
+        "_links": fields.Nested(
+            {
+                "self": fields.String(),
+                "next": fields.String(),
+            }
+        ),
+    },
+)
+
 user_registration = NS.model(
     "UserRegistration",
     {
@@ -75,14 +123,14 @@ user_registration = NS.model(
             example="jane_doe",
             min_length=3,
             max_length=16,
-            pattern="^[A-Za-z][A-Za-z0-9_-]{2,15}$",
+            pattern=USERNAME_PATTERN,
         ),
         "email": fields.String(
             required=True,
             description=email_description,
             example="jane.doe@gmail.com",
             min_length=3,
-            pattern="^[a-zA-Z0-9.!#$%&’*+\/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*$",
+            pattern=EMAIL_PATTERN,
         ),
         "password": fields.String(
             required=True,
@@ -90,7 +138,7 @@ user_registration = NS.model(
             example="a234567!",
             min_length=8,
             max_length=20,
-            pattern="^(?=.*[A-Za-z])(?=.*\d)(?=.*[@$!%*#?&])[A-Za-z\d@$!%*#?&]{8,20}$",
+            pattern=PASSWORD_PATTERN,
         ),
     },
 )
@@ -104,14 +152,14 @@ user_update = NS.model(
             example="jane_doe",
             min_length=3,
             max_length=16,
-            pattern="^[A-Za-z][A-Za-z0-9_-]{2,15}$",
+            pattern=USERNAME_PATTERN,
         ),
         "email": fields.String(
             required=False,
             description=email_description,
             example="jane.doe@gmail.com",
             min_length=3,
-            pattern="^[a-zA-Z0-9.!#$%&’*+\/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*$",
+            pattern=EMAIL_PATTERN,
         ),
         "password": fields.String(
             required=False,
@@ -119,7 +167,7 @@ user_update = NS.model(
             example="a234567!",
             min_length=8,
             max_length=20,
-            pattern="^(?=.*[A-Za-z])(?=.*\d)(?=.*[@$!%*#?&])[A-Za-z\d@$!%*#?&]{8,20}$",
+            pattern=PASSWORD_PATTERN,
         ),
     },
 )
@@ -159,7 +207,7 @@ class Users(Resource):
         """Create new user."""
 
         args = parser_user_registration.parse_args()
-        valid_input, status_code, msg = user_attr_unique_notempty_check(args)
+        valid_input, status_code, msg = user_attr_notempty_check(args)
 
         if not valid_input:
             abort(status_code, msg)
@@ -169,13 +217,109 @@ class Users(Resource):
             email = args["email"]
             user = User(username=username, email=email, password=password)
             db.session.add(user)
+            # The unique indexes on username and email decide conflicts in the INSERT itself.
             committed_to_db, msg = commit_to_db(db)
             if committed_to_db:
                 return user.to_dict(include_emails=False), 201
             else:
+                no_conflict, status_code, conflict_msg = user_conflict_check(msg, args)
+                if not no_conflict:
+                    abort(status_code, conflict_msg)
                 abort(500, f"Server Error: {msg}")
 
 
+user_import_model = NS.model(
+    "UserImport",
+    {
+        "import_id": fields.Integer(description="Import job id"),
+        "status": fields.String(description="queued, running, finished or failed"),
+        "rows_read": fields.Integer(description="Rows handled so far"),
+        "created": fields.Integer(description="Users created"),
+        "failed": fields.Integer(description="Rows skipped, known once finished"),
+        "truncated": fields.Boolean(
+            description="True if rows past USER_IMPORT_MAX_ROWS were not read"
+        ),
+        "message": fields.String(description="Error of a failed job"),
+        "created_on": fields.DateTime(),
+        "updated_on": fields.DateTime(),
+        "finished_on": fields.DateTime(),
+        "_links": fields.Nested(
+            NS.model("UserImportLinks", {"self": fields.String()}), skip_none=True
+        ),
+        "errors": fields.List(
+            fields.Nested(
+                NS.model(
+                    "UserImportError",
+                    {
+                        "line": fields.Integer(description="Line of the row in the body"),
+                        "username": fields.String(),
+                        "errors": fields.List(fields.String()),
+                    },
+                ),
+                skip_none=True,
+            )
+        ),
+    },
+)
+
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+@NS.route("/import")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+class UsersImport(Resource):
+    @NS.response(202, "Import queued. Its report is at _links.self, also the Location header.")
+    @NS.response(415, "Unsupported body format.")
+    @NS.response(500, "Error: Could not commit changes to the database")
+    @NS.marshal_with(user_import_model, skip_none=True, code=202)
+    @NS.doc(
+        security="Basic Auth",
+        description="Body: CSV with a username,email,password header (text/csv) or one JSON "
+        "object per line (application/x-ndjson). Rows are created in batches in the "
+        "background; invalid rows are skipped and reported with their line number.",
+    )
+    @auth.login_required
+    def post(self):
+        """Create many users from CSV or NDJSON, in the background."""
+        format = IMPORT_CONTENT_TYPES.get(request.mimetype)
+        if format is None:
+            abort(415, f"Send text/csv or application/x-ndjson, not {request.mimetype}.")
+
+        file = io.TextIOWrapper(request.stream, encoding="utf-8-sig")
+        rows = read_user_rows(file, format)
+        batch = list(islice(rows, current_app.config["USER_IMPORT_MAX_ROWS"]))
+        job = UserImport(user_id=g.user.user_id, truncated=next(rows, None) is not None)
+        db.session.add(job)
+        committed, msg = commit_to_db(db)
+        if not committed:
+            abort(500, f"Server Error: {msg}")
+
+        IMPORT_RUNNER.submit(job.import_id, batch)
+        data = job.to_dict()
+        return data, 202, {"Location": data["_links"]["self"]}
+
+
+@NS.route("/import/<int:import_id>")
+@NS.response(401, "Unauthorized.")
+@NS.response(404, "Import not found")
+class UsersImportStatus(Resource):
+    @NS.response(200, "Import status. Rows that could not be imported are listed in errors.")
+    @NS.marshal_with(user_import_model, skip_none=True, code=200)
+    @NS.doc(security="Basic Auth")
+    @auth.login_required
+    def get(self, import_id):
+        """Get the progress and report of a user import"""
+        job = db.session.get(UserImport, import_id)
+        if job is None or job.user_id != g.user.user_id:
+            abort(404, "Import not found")
+        return job.to_dict(), 200
+
+
 @NS.route("/<string:username>")
 @NS.response(400, "Invalid Request.")
 @NS.response(401, "Unauthorized.")
@@ -206,6 +350,7 @@ class SingleUser(Resource):
             abort(404, "User not found")
 
     @NS.response(200, "Success: User information updated")
+    @NS.response(409, "Username or Email already exists")
     @NS.response(500, "Error: Could not commit changes to the database")
     @NS.expect(user_update, validate=True)
     @NS.doc(security="Basic Auth")
@@ -224,9 +369,7 @@ class SingleUser(Resource):
                 msg="You are not authorized to make changes to this user",
             )
         else:
-            valid_input, status_code, msg = user_attr_unique_notempty_check(
-                args, user_to_update=current_user
-            )
+            valid_input, status_code, msg = user_attr_notempty_check(args)
             if not valid_input:
                 abort(status_code, msg)
             else:
@@ -239,16 +382,22 @@ class SingleUser(Resource):
                     g.user = db.session.get(User, current_user.user_id)
                     return current_user.to_dict(include_emails=True), 200
                 else:
+                    no_conflict, status_code, conflict_msg = user_conflict_check(msg, args)
+                    if not no_conflict:
+                        abort(status_code, conflict_msg)
                     abort(500, f"Server Error: {msg}")
 
     @NS.response(200, "Success: User deleted")
     @NS.doc(security="Basic Auth")
     @auth.login_required
     def delete(self, user_id):
-        """Delete user by id"""
+        """
+        Delete user by id. The account disappears at once; its views, likes, comments and
+        tags are purged later by `flask users purge`.
+        """
         current_user = g.user
         if user_id == current_user.user_id:
-            User.query.filter_by(user_id=current_user.user_id).delete()
+            current_user.soft_delete()
             added_to_db, msg = commit_to_db(db)
             if added_to_db:
                 g.user = None
@@ -257,3 +406,66 @@ class SingleUser(Resource):
                 abort(500, f"Server Error: {msg}")
         else:
             abort(401, "Unauthorized. Only the current user can be deleted.")
+
+
+@NS.route("/<int:user_id>/feed")
+@NS.response(400, "Invalid Request.")
+@NS.response(401, "Unauthorized.")
+@NS.response(404, "User not found")
+class UserFeed(Resource):
+    @NS.response(200, "Successful request.")
+    @NS.marshal_with(feed_model, skip_none=True, code=200)
+    @NS.doc(
+        params={
+            "persona_ids": "Comma separated persona_ids to restrict the feed to.",
+            "tag_ids": "Comma separated tag_ids, advice with any of them is included.",
+            "seed": "Shuffle seed. Keep it constant while paging. Defaults to a per user seed.",
+            "cursor": "next_cursor returned by the previous page.",
+            "per_page": f"Number of advice per page. Defaults to {current_app.config['PAGINATION_ITEMS_PER_PAGE']}",
+        }
+    )
+    def get(self, user_id):
+        """Get advice the user has not viewed yet, in a stable random order"""
+
+        if not db.session.get(User, user_id):
+            abort(404, "User not found")
+
+        try:
+            persona_ids = parse_id_list(request.args.get("persona_ids"))
+            tag_ids = parse_id_list(request.args.get("tag_ids"))
+        except ValueError:
+            abort(400, "persona_ids and tag_ids must be comma separated integers.")
+
+        seed = request.args.get("seed", default_feed_seed(user_id), type=int)
+        cursor = request.args.get("cursor", None, type=int)
+        per_page = request.args.get(
+            "per_page", current_app.config["PAGINATION_ITEMS_PER_PAGE"], type=int
+        )
+
+        items, next_cursor = unseen_feed(
+            user_id,
+            seed,
+            after=cursor,
+            limit=per_page,
+            persona_ids=persona_ids,
+            tag_ids=tag_ids,
+        )
+
+        link_args = dict(
+            user_id=user_id,
+            persona_ids=request.args.get("persona_ids"),
+            tag_ids=request.args.get("tag_ids"),
+            seed=seed,
+            per_page=per_page,
+        )
+        data = {
+            "items": [advice.to_dict() for advice in items],
+            "_meta": {"per_page": per_page, "seed": seed, "next_cursor": next_cursor},
+            "_links": {
+                "self": url_for("api.users_user_feed", cursor=cursor, **link_args),
+                "next": url_for("api.users_user_feed", cursor=next_cursor, **link_args)
+                if next_cursor is not None
+                else None,
+            },
+        }
+        return data, 200
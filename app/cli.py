@@ -0,0 +1,409 @@
+import datetime as dt
+import gzip
+import io
+import json
+import sys
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.database import check_pooling
+from app.dataset import generate_dataset
+from app.generation import refill_pool
+from app.models import AdvicePool, Persona, UserPurge
+from app.partitions import create_partitions, detach_partitions, partition_status
+from app.personas import PERSONA_SETTINGS, SETTING_DEFAULTS
+from app.purge import purge_deleted_users
+from app.rollups import fold_rollups, rebuild_rollups
+from app.user_import import IMPORT_FORMATS, import_users, read_user_rows
+from app.snapshot import SnapshotError, export_snapshot, import_snapshot
+from app.trending import compact_trending, rebuild_trending
+from app.utils import commit_to_db
+
+trending_cli = AppGroup("trending", help="Maintain the trending advice rankings.")
+
+
+@trending_cli.command("compact")
+def trending_compact():
+    """Rebase scores and drop advice without recent engagement. Run periodically (e.g. hourly)."""
+    for time_window, outcome in compact_trending().items():
+        click.echo(
+            f"{time_window}: rebased={outcome['rebased']} deleted={outcome['deleted']}"
+        )
+
+
+@trending_cli.command("rebuild")
+@click.option("--batch-size", default=10000, show_default=True)
+def trending_rebuild(batch_size):
+    """Recompute the rankings from raw views, likes and comments."""
+    for time_window, ranked in rebuild_trending(batch_size=batch_size).items():
+        click.echo(f"{time_window}: {ranked} advice ranked")
+
+
+rollups_cli = AppGroup("rollups", help="Maintain the daily advice and engagement rollups.")
+
+
+@rollups_cli.command("rebuild")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), help="Defaults to the oldest advice.")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), help="Defaults to today (UTC).")
+@click.option("--days", type=int, help="Rebuild the last DAYS days, e.g. nightly. Overrides --start.")
+def rollups_rebuild(start, end, days):
+    """Recompute the daily rollups of a range of days from the raw rows."""
+    end = end.date() if end else dt.datetime.now(tz=dt.timezone.utc).date()
+    start = start.date() if start else None
+    if days:
+        start = end - dt.timedelta(days=days - 1)
+    written = rebuild_rollups(start=start, end=end)
+    click.echo(f"{written} rollup rows written")
+
+
+@rollups_cli.command("fold")
+def rollups_fold():
+    """Add the counts recorded since the last run to the daily rollups, e.g. every minute."""
+    folded = fold_rollups()
+    click.echo(f"{folded} rollup deltas folded")
+
+
+pool_cli = AppGroup("pool", help="Check the database connection pool.")
+
+
+@pool_cli.command("check")
+@click.option("--endpoint", default="api.advice_advice_main", show_default=True)
+@click.option("--concurrency", type=int, help="Defaults to pool size + max overflow.")
+def pool_check(endpoint, concurrency):
+    """Validate statement timeouts and pool capacity, e.g. through pgbouncer."""
+    failed = False
+    for check, passed, detail in check_pooling(current_app, endpoint, concurrency):
+        failed = failed or not passed
+        click.echo(f"[{'ok' if passed else 'FAIL'}] {check}: {detail}")
+    if failed:
+        raise SystemExit(1)
+
+
+advice_pool_cli = AppGroup("advice-pool", help="Maintain the pool of pre-generated advice.")
+
+
+@advice_pool_cli.command("fill")
+@click.option("--persona-id", type=int, multiple=True, help="Defaults to every persona.")
+@click.option("--size", type=int, help="Advice per persona. Defaults to ADVICE_POOL_SIZE.")
+def advice_pool_fill(persona_id, size):
+    """Generate advice until each persona's pool is full, e.g. after a deploy."""
+    persona_ids = persona_id or [p.persona_id for p in Persona.query.order_by(Persona.persona_id)]
+    for persona_id in persona_ids:
+        click.echo(f"persona {persona_id}: {refill_pool(persona_id, size=size)} advice generated")
+
+
+@advice_pool_cli.command("status")
+def advice_pool_status():
+    """Show the number of pooled advice per persona."""
+    depths = dict(
+        AdvicePool.query.with_entities(AdvicePool.persona_id, db.func.count())
+        .group_by(AdvicePool.persona_id)
+        .all()
+    )
+    for persona in Persona.query.order_by(Persona.persona_id):
+        click.echo(f"{persona.persona_id} {persona.name}: {depths.get(persona.persona_id, 0)}")
+
+
+personas_cli = AppGroup("personas", help="Manage the generation settings of the personas.")
+
+
+@personas_cli.command("list")
+def personas_list():
+    """Show the generation settings of every persona, defaults included."""
+    for persona in Persona.query.order_by(Persona.persona_id):
+        settings = PERSONA_SETTINGS.get(persona.persona_id)
+        click.echo(
+            f"{persona.persona_id} {persona.name}: "
+            + " ".join(
+                f"{setting}={settings[setting]!r}"
+                + ("" if getattr(persona, setting) is not None else " (default)")
+                for setting in SETTING_DEFAULTS
+            )
+        )
+
+
+@personas_cli.command("set")
+@click.argument("persona_id", type=int)
+@click.option("--model", help="OpenAI model, e.g. a fine-tuned model of the persona.")
+@click.option("--temperature", type=float)
+@click.option("--max-tokens", type=int)
+@click.option(
+    "--prompt-suffix", help="Separator the model was fine-tuned with, also the stop sequence."
+)
+@click.option(
+    "--default",
+    "defaults",
+    type=click.Choice(list(SETTING_DEFAULTS)),
+    multiple=True,
+    help="Go back to the default of the config for this setting.",
+)
+def personas_set(persona_id, defaults, **settings):
+    """Change the generation settings of a persona."""
+    persona = db.session.get(Persona, persona_id)
+    if persona is None:
+        raise click.ClickException(f"Persona {persona_id} does not exist.")
+    for setting, value in settings.items():
+        if value is not None:
+            setattr(persona, setting, value)
+    for setting in defaults:
+        setattr(persona, setting, None)
+    committed, msg = commit_to_db(db)
+    if not committed:
+        raise click.ClickException(msg)
+    click.echo(f"Persona {persona_id} updated.")
+
+
+data_cli = AppGroup("data", help="Generate, export and import datasets.")
+
+
+@data_cli.command("generate")
+@click.option("--users", default=1000, show_default=True)
+@click.option("--advice", default=10000, show_default=True)
+@click.option("--personas", default=5, show_default=True)
+@click.option("--tags", default=20, show_default=True)
+@click.option("--views-per-user", default=50.0, show_default=True, help="Mean views per user.")
+@click.option("--like-rate", default=0.2, show_default=True, help="Share of views liked.")
+@click.option("--comment-rate", default=0.02, show_default=True, help="Share of views commented.")
+@click.option("--tags-per-advice", default=1.5, show_default=True)
+@click.option("--zipf", "exponent", default=1.1, show_default=True, help="Zipf exponent of popularity.")
+@click.option("--days", default=365, show_default=True, help="Spread rows over this many past days.")
+@click.option("--password", default="Passw0rd!", show_default=True)
+@click.option("--distinct-passwords", is_flag=True, help="Hash one password per user, in parallel.")
+@click.option("--processes", type=int, help="Hashing processes. Defaults to the number of CPUs.")
+@click.option("--batch-size", default=50000, show_default=True)
+@click.option("--seed", type=int)
+def data_generate(**options):
+    """Append a synthetic dataset with Zipfian engagement, for scale testing."""
+    start = time.monotonic()
+
+    def progress(table, loaded):
+        click.echo(f"\r{table}: {loaded} rows ({time.monotonic() - start:.0f}s)", nl=False)
+
+    counts = generate_dataset(progress=progress, **options)
+    click.echo()
+    for table, loaded in counts.items():
+        click.echo(f"{table}: {loaded}")
+    click.echo(f"Done in {time.monotonic() - start:.1f}s. Run `flask trending rebuild` to rank it.")
+
+
+def _open_snapshot(path, mode, compresslevel=6):
+    """Opens a gzip compressed snapshot as a text file. "-" is stdin or stdout."""
+    if path == "-":
+        raw = sys.stdout.buffer if mode == "w" else sys.stdin.buffer
+        stream = gzip.GzipFile(fileobj=raw, mode=f"{mode}b", compresslevel=compresslevel)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    if mode == "w":
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel)
+    return gzip.open(path, "rt", encoding="utf-8")
+
+
+def _progress(start):
+    def progress(table, rows):
+        click.echo(f"\r{table}: {rows} rows ({time.monotonic() - start:.0f}s)", nl=False, err=True)
+
+    return progress
+
+
+@data_cli.command("export")
+@click.argument("path", default="-")
+@click.option("--batch-size", default=10000, show_default=True)
+@click.option("--compresslevel", default=6, show_default=True, help="gzip level, 1 is fastest.")
+def data_export(path, batch_size, compresslevel):
+    """Write all tables to PATH as gzip compressed NDJSON ("-" for stdout)."""
+    start = time.monotonic()
+    with _open_snapshot(path, "w", compresslevel) as file:
+        counts = export_snapshot(file, batch_size=batch_size, progress=_progress(start))
+    click.echo(err=True)
+    click.echo(
+        f"Exported {sum(counts.values())} rows from {len(counts)} tables "
+        f"in {time.monotonic() - start:.1f}s.",
+        err=True,
+    )
+
+
+@data_cli.command("import")
+@click.argument("path", default="-")
+@click.option("--truncate", is_flag=True, help="Empty the tables before loading.")
+@click.option(
+    "--disable-triggers",
+    is_flag=True,
+    help="Postgres: skip foreign key checks while loading (requires superuser).",
+)
+@click.option("--batch-size", default=10000, show_default=True)
+def data_import(path, truncate, disable_triggers, batch_size):
+    """Load a snapshot written by `flask data export` from PATH ("-" for stdin)."""
+    start = time.monotonic()
+    try:
+        with _open_snapshot(path, "r") as file:
+            counts = import_snapshot(
+                file,
+                truncate=truncate,
+                disable_triggers=disable_triggers,
+                batch_size=batch_size,
+                progress=_progress(start),
+            )
+    except SnapshotError as e:
+        raise click.ClickException(str(e))
+    except IntegrityError as e:
+        raise click.ClickException(
+            f"{e.orig}. Nothing was imported; use --truncate to replace the existing rows."
+        )
+    click.echo(err=True)
+    click.echo(
+        f"Imported {sum(counts.values())} rows into {len(counts)} tables "
+        f"in {time.monotonic() - start:.1f}s.",
+        err=True,
+    )
+
+
+users_cli = AppGroup("users", help="Maintain user accounts.")
+
+
+@users_cli.command("purge")
+@click.option(
+    "--batch-size", type=int, help="Rows per transaction. Defaults to USER_PURGE_BATCH_SIZE."
+)
+@click.option("--pause", type=float, help="Seconds between batches. Defaults to USER_PURGE_PAUSE.")
+@click.option("--limit", type=int, help="Purge at most this many users.")
+def users_purge(batch_size, pause, limit):
+    """Delete the data of deleted users in batches. Safe to interrupt and rerun."""
+    start = time.monotonic()
+
+    def progress(user_id, step, rows):
+        click.echo(
+            f"\ruser {user_id} {step}: {rows} rows ({time.monotonic() - start:.0f}s)", nl=False
+        )
+
+    purged = purge_deleted_users(
+        batch_size=batch_size, pause=pause, limit=limit, progress=progress
+    )
+    if purged:
+        click.echo()
+    click.echo(
+        f"Purged {len(purged)} users, {sum(purged.values())} rows "
+        f"in {time.monotonic() - start:.1f}s."
+    )
+
+
+@users_cli.command("purge-status")
+def users_purge_status():
+    """Show purges in progress."""
+    jobs = UserPurge.query.filter(UserPurge.finished_on.is_(None)).order_by(UserPurge.started_on)
+    for job in jobs:
+        click.echo(
+            f"user {job.user_id}: step={job.step} rows={job.rows_deleted} "
+            f"started={job.started_on} updated={job.updated_on}"
+        )
+
+
+@users_cli.command("import")
+@click.argument("path", default="-")
+@click.option(
+    "--format", type=click.Choice(IMPORT_FORMATS), help="Defaults to the file extension."
+)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--processes", type=int, help="Hashing processes. Defaults to the number of CPUs.")
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the rejected rows to this file as NDJSON.",
+)
+def users_import(path, format, batch_size, processes, report):
+    """Create users from a CSV (username,email,password) or NDJSON file ("-" for stdin)."""
+    if format is None:
+        format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+    start = time.monotonic()
+
+    def progress(read, created):
+        click.echo(
+            f"\r{read} rows read, {created} users created ({time.monotonic() - start:.0f}s)",
+            nl=False,
+            err=True,
+        )
+
+    with click.open_file(path, encoding="utf-8-sig") as file:
+        result = import_users(
+            read_user_rows(file, format),
+            batch_size=batch_size,
+            processes=processes,
+            progress=progress,
+        )
+    click.echo(err=True)
+    if report:
+        with open(report, "w", encoding="utf-8") as file:
+            for error in result["errors"]:
+                file.write(json.dumps(error) + "\n")
+    else:
+        for error in result["errors"][:20]:
+            click.echo(f"line {error['line']}: {'; '.join(error['errors'])}", err=True)
+    click.echo(
+        f"Created {result['created']} users, rejected {result['failed']} rows "
+        f"in {time.monotonic() - start:.1f}s.",
+        err=True,
+    )
+
+
+partitions_cli = AppGroup(
+    "partitions", help="Maintain the monthly partitions of advice (Postgres)."
+)
+
+
+@partitions_cli.command("create")
+@click.option(
+    "--months-ahead",
+    type=int,
+    help="Months to create in advance. Defaults to PARTITION_MONTHS_AHEAD.",
+)
+def partitions_create(months_ahead):
+    """Create the partitions of the coming months. Run daily."""
+    if months_ahead is None:
+        months_ahead = current_app.config["PARTITION_MONTHS_AHEAD"]
+    with db.engine.begin() as connection:
+        created = create_partitions(connection, months_ahead=months_ahead)
+    if not created:
+        click.echo("No partitioned tables.")
+    for table, partitions in created.items():
+        for name, moved in partitions.items():
+            click.echo(f"{table}: created {name}, {moved} rows moved from {table}_default")
+
+
+@partitions_cli.command("detach")
+@click.option(
+    "--retention-months",
+    type=int,
+    help="Full months to keep. Defaults to PARTITION_RETENTION_MONTHS.",
+)
+@click.option("--archive-schema", help="Defaults to PARTITION_ARCHIVE_SCHEMA.")
+def partitions_detach(retention_months, archive_schema):
+    """Detach the partitions past the retention period into the archive schema."""
+    config = current_app.config
+    if retention_months is None:
+        retention_months = config["PARTITION_RETENTION_MONTHS"]
+    if not retention_months:
+        click.echo("Retention is disabled, nothing to detach.")
+        return None
+    with db.engine.begin() as connection:
+        detached = detach_partitions(
+            connection,
+            retention_months,
+            archive_schema=archive_schema or config["PARTITION_ARCHIVE_SCHEMA"],
+        )
+    if not detached:
+        click.echo("No partitioned tables.")
+    for table, names in detached.items():
+        click.echo(f"{table}: detached {', '.join(names) or 'nothing'}")
+
+
+@partitions_cli.command("status")
+def partitions_status():
+    """Show the partitions and their estimated rows."""
+    with db.engine.connect() as connection:
+        status = partition_status(connection)
+    if not status:
+        click.echo("No partitioned tables.")
+    for table, partitions in status.items():
+        for name, rows in partitions.items():
+            click.echo(f"{table}: {name} ~{rows} rows")
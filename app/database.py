@@ -0,0 +1,189 @@
+"""
+Engine tuning: pool metrics, per-request Postgres statement timeouts and SQLite foreign keys.
+
+Pool sizing, pre-ping and recycle come from SQLALCHEMY_ENGINE_OPTIONS in config.py. The
+statement timeout is applied with SET LOCAL at the start of every transaction opened while
+handling a request, so it only lasts for that transaction. Unlike a session level SET or a
+connect time option, this is safe behind pgbouncer in transaction pooling mode, where
+consecutive transactions of one client connection may run on different server connections.
+"""
+import threading
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from app import db
+from app.metrics.instruments import DB_POOL_TIMEOUTS, instrument_engine
+
+
+def statement_timeout_ms() -> int:
+    """
+    Returns the statement timeout of the current request in milliseconds: its endpoint's entry
+    in DB_STATEMENT_TIMEOUTS, else DB_STATEMENT_TIMEOUT_MS. 0 (no timeout) outside requests, so
+    CLI jobs such as imports are not cut short.
+
+    :rtype: int
+    """
+
+    if not has_request_context():
+        return 0
+    config = current_app.config
+    return config["DB_STATEMENT_TIMEOUTS"].get(
+        request.endpoint, config["DB_STATEMENT_TIMEOUT_MS"]
+    )
+
+
+def _set_statement_timeout(conn):
+    timeout = statement_timeout_ms()
+    if not timeout:
+        return None
+    # The begin event fires before the DBAPI transaction starts; psycopg2 opens it implicitly
+    # with this statement, so SET LOCAL is scoped to the transaction being begun.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"SET LOCAL statement_timeout = {int(timeout)}")
+    finally:
+        cursor.close()
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE rules, unless enabled per connection.
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA foreign_keys = ON")
+    finally:
+        cursor.close()
+
+
+def is_statement_timeout(error) -> bool:
+    """True if error is a statement cancelled by statement_timeout (SQLSTATE 57014)"""
+    return getattr(getattr(error, "orig", None), "pgcode", None) == "57014"
+
+
+def init_app(app, api) -> None:
+    """
+    Instruments the pools of every engine, applies statement timeouts on Postgres engines,
+    enforces foreign keys on SQLite engines so ON DELETE rules apply, and answers pool
+    exhaustion and statement timeouts with 503 and a Retry-After header instead of a 500.
+    Must run inside an app context, after db.init_app.
+
+    :param app: Flask app
+    :type app: flask.Flask
+    :param api: flask-restx Api whose errors are handled
+    :type api: flask_restx.Api
+    """
+
+    for bind_key, engine in db.engines.items():
+        instrument_engine(bind_key or "default", engine)
+        if engine.dialect.name == "postgresql":
+            event.listen(engine, "begin", _set_statement_timeout)
+        elif engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _enable_sqlite_foreign_keys)
+            # Connections opened before the listener, e.g. by queries run at import time.
+            engine.dispose()
+
+    @api.errorhandler(PoolTimeoutError)
+    def pool_timeout(error):
+        DB_POOL_TIMEOUTS.inc(request.endpoint or "unmatched")
+        current_app.logger.warning("Database pool exhausted on %s", request.path)
+        return (
+            {"message": "The service is busy. Please retry later."},
+            503,
+            {"Retry-After": str(current_app.config["DB_RETRY_AFTER"])},
+        )
+
+    @api.errorhandler(OperationalError)
+    def operational_error(error):
+        if not is_statement_timeout(error):
+            return {"message": "Internal Server Error"}, 500
+        current_app.logger.warning(
+            "Statement timeout (%sms) on %s", statement_timeout_ms(), request.path
+        )
+        return (
+            {"message": "The request took too long. Please retry later."},
+            503,
+            {"Retry-After": str(current_app.config["DB_RETRY_AFTER"])},
+        )
+
+
+def check_pooling(app, endpoint="api.advice_advice_main", concurrency=None) -> list:
+    """
+    Checks that the engine behaves under pgbouncer style transaction pooling: the statement
+    timeout of a request applies inside its transaction and does not leak into the next
+    transaction on the same connection, and the pool can hold concurrency connections at once.
+    Run it against the pgbouncer address to validate a deployment.
+
+    :param app: Flask app
+    :type app: flask.Flask
+    :param endpoint: endpoint whose statement timeout is checked
+    :type endpoint: str
+    :param concurrency: connections to hold at once. Defaults to pool_size + max_overflow.
+    :type concurrency: int
+    :return: (check, passed, detail) tuples
+    :rtype: list
+    """
+
+    results = []
+    engine = db.engine
+    if engine.dialect.name != "postgresql":
+        return [("dialect", True, f"{engine.dialect.name}: no statement timeouts to check")]
+
+    # pg_settings reports milliseconds, SHOW rounds to the largest unit ("5s").
+    show = db.text("SELECT setting FROM pg_settings WHERE name = 'statement_timeout'")
+    expected = app.config["DB_STATEMENT_TIMEOUTS"].get(
+        endpoint, app.config["DB_STATEMENT_TIMEOUT_MS"]
+    )
+    with engine.connect() as connection:
+        with connection.begin():
+            baseline = connection.execute(show).scalar()
+        # A request transaction, then a plain one on the same connection.
+        with app.test_request_context():
+            request.url_rule = next(
+                rule for rule in app.url_map.iter_rules() if rule.endpoint == endpoint
+            )
+            with connection.begin():
+                inside = connection.execute(show).scalar()
+        with connection.begin():
+            after = connection.execute(show).scalar()
+    results.append(
+        ("timeout applied", inside == (str(expected) if expected else baseline),
+         f"{endpoint}: expected {expected}ms, got {inside}ms")
+    )
+    results.append(
+        ("timeout scoped to transaction", after == baseline,
+         f"next transaction: {after}ms, server default: {baseline}ms")
+    )
+
+    pool = engine.pool
+    if concurrency is None:
+        concurrency = getattr(pool, "size", lambda: 1)() + max(
+            getattr(pool, "_max_overflow", 0), 0
+        )
+    barrier = threading.Barrier(concurrency + 1, timeout=30)
+    errors = []
+
+    def hold():
+        try:
+            with engine.connect() as connection:
+                connection.execute(db.text("SELECT 1"))
+                barrier.wait()
+                barrier.wait()
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+
+    threads = [threading.Thread(target=hold) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+        status = pool.status()
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        status = pool.status()
+    for thread in threads:
+        thread.join()
+    results.append(
+        ("pool capacity", not errors,
+         f"{concurrency} concurrent connections: {errors[0] if errors else status}")
+    )
+    return results
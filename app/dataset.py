@@ -0,0 +1,285 @@
+"""
+Synthetic dataset generator for scale testing.
+
+Engagement follows Zipf's law on both sides: a few advice rows collect most views, likes,
+comments and tags, and a few users do most of the viewing. Likes and comments are drawn from
+the views, so a user only engages with advice they have seen. Rows are generated with numpy in
+chunks of users and loaded with bulk_insert (COPY on Postgres), so memory stays bounded by the
+chunk size whatever the total.
+"""
+import datetime as dt
+import numpy as np
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import (
+    Advice,
+    Entity,
+    EntityComment,
+    EntityLike,
+    EntityTag,
+    EntityView,
+    Persona,
+    Tag,
+    User,
+)
+from app.utils import bulk_insert, hash_passwords, reset_sequences
+
+ADVICESLIP_IDS = 224
+WORDS = (
+    "always", "never", "kindness", "patience", "money", "friends", "sleep", "coffee", "code",
+    "mistakes", "tomorrow", "today", "listen", "smile", "plan", "rest", "learn", "forgive",
+    "walk", "read", "save", "share", "ask", "wait", "laugh", "trust", "build", "change",
+)
+PERSONA_NAMES = ("Yoda", "Pirate", "Shakespeare", "Coach", "Grandma", "Robot", "Cowboy")
+TAG_NAMES = ("life", "work", "love", "money", "health", "family", "funny", "wise")
+
+
+def zipf_weights(n, exponent) -> np.ndarray:
+    """Probabilities of ranks 1..n under a Zipf distribution with the given exponent"""
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** exponent
+    return weights / weights.sum()
+
+
+def zipf_sample(rng, n, exponent, size, cdf=None) -> np.ndarray:
+    """
+    Draws size ranks in [0, n) from a Zipf distribution by inverting its cumulative weights.
+    Pass cdf (from np.cumsum(zipf_weights(n, exponent))) to reuse it across calls.
+    """
+    if cdf is None:
+        cdf = np.cumsum(zipf_weights(n, exponent))
+    return np.minimum(np.searchsorted(cdf, rng.random(size) * cdf[-1]), n - 1)
+
+
+def _next_id(column) -> int:
+    return (db.session.query(db.func.max(column)).scalar() or 0) + 1
+
+
+def _load(table, columns, rows, batch_size) -> int:
+    """Loads rows in batches of batch_size, committing each batch"""
+    loaded = 0
+    for start in range(0, len(rows), batch_size):
+        connection = db.session.connection()
+        loaded += bulk_insert(connection, table, columns, rows[start : start + batch_size])
+        db.session.commit()
+    return loaded
+
+
+def generate_dataset(
+    users=1000,
+    advice=10000,
+    personas=5,
+    tags=20,
+    views_per_user=50,
+    like_rate=0.2,
+    comment_rate=0.02,
+    tags_per_advice=1.5,
+    exponent=1.1,
+    days=365,
+    password="Passw0rd!",
+    distinct_passwords=False,
+    processes=None,
+    batch_size=50000,
+    seed=None,
+    progress=None,
+) -> dict:
+    """
+    Appends a synthetic dataset to the database. Ids continue after the existing rows.
+
+    :param users: number of users
+    :type users: int
+    :param advice: number of advice rows
+    :type advice: int
+    :param personas: number of personas
+    :type personas: int
+    :param tags: number of tags
+    :type tags: int
+    :param views_per_user: mean number of views drawn per user. Repeated draws of the same
+        advice by a user collapse into one view, so a steep exponent yields fewer rows.
+    :type views_per_user: float
+    :param like_rate: share of views that are also liked
+    :type like_rate: float
+    :param comment_rate: share of views that are also commented
+    :type comment_rate: float
+    :param tags_per_advice: mean number of tags per advice
+    :type tags_per_advice: float
+    :param exponent: Zipf exponent of advice popularity and user activity
+    :type exponent: float
+    :param days: advice and engagement are spread over this many past days
+    :type days: int
+    :param password: password of every user, hashed once unless distinct_passwords
+    :type password: str
+    :param distinct_passwords: give every user its own password "<password><user_id>", hashed in
+        parallel worker processes. Realistic, but PBKDF2 makes it the slowest step by far.
+    :type distinct_passwords: bool
+    :param processes: number of hashing processes. Defaults to the number of CPUs.
+    :type processes: int
+    :param batch_size: rows per insert statement, and users per generation chunk / 10
+    :type batch_size: int
+    :param seed: random seed
+    :type seed: int
+    :param progress: called with (table name, rows loaded so far)
+    :type progress: function
+    :return: number of rows loaded per table
+    :rtype: dict
+    """
+
+    rng = np.random.default_rng(seed)
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    span = days * 86400
+    counts = {}
+
+    def load(model, columns, rows):
+        counts[model.__tablename__] = counts.get(model.__tablename__, 0) + _load(
+            model.__table__, columns, rows, batch_size
+        )
+        if progress:
+            progress(model.__tablename__, counts[model.__tablename__])
+
+    def timestamps(seconds_ago):
+        return [now - dt.timedelta(seconds=s) for s in seconds_ago.tolist()]
+
+    # Personas and tags
+    first_persona = _next_id(Persona.persona_id)
+    persona_ids = np.arange(first_persona, first_persona + personas)
+    load(
+        Persona,
+        ["persona_id", "name", "created_on"],
+        [
+            (int(i), f"{PERSONA_NAMES[i % len(PERSONA_NAMES)]} {i}", now)
+            for i in persona_ids
+        ],
+    )
+    first_tag = _next_id(Tag.tag_id)
+    tag_ids = np.arange(first_tag, first_tag + tags)
+    load(
+        Tag,
+        ["tag_id", "name", "description", "created_on"],
+        [(int(i), f"{TAG_NAMES[i % len(TAG_NAMES)]}-{i}", None, now) for i in tag_ids],
+    )
+
+    # Users
+    first_user = _next_id(User.user_id)
+    user_ids = np.arange(first_user, first_user + users)
+    if distinct_passwords:
+        hashes = hash_passwords([f"{password}{i}" for i in user_ids], processes=processes)
+    else:
+        hashes = [generate_password_hash(password)] * users
+    user_created = timestamps(rng.uniform(0, span, users))
+    load(
+        User,
+        ["user_id", "username", "email", "password_hash", "created_on"],
+        [
+            (int(i), f"user{i}", f"user{i}@example.com", hashes[n], user_created[n])
+            for n, i in enumerate(user_ids)
+        ],
+    )
+
+    # Advice: popular personas give more advice too.
+    first_entity = max(_next_id(Entity.entity_id), _next_id(Advice.entity_id))
+    entity_ids = np.arange(first_entity, first_entity + advice)
+    advice_age = rng.uniform(0, span, advice)
+    advice_created = timestamps(advice_age)
+    advice_persona = persona_ids[zipf_sample(rng, personas, exponent, advice)]
+    slip_ids = rng.integers(1, ADVICESLIP_IDS + 1, advice)
+    words = rng.integers(0, len(WORDS), (advice, 6))
+    for start in range(0, advice, batch_size):
+        stop = min(start + batch_size, advice)
+        load(
+            Entity,
+            ["entity_id", "type", "created_on"],
+            [(int(entity_ids[n]), "advice", advice_created[n]) for n in range(start, stop)],
+        )
+        load(
+            Advice,
+            ["entity_id", "persona_id", "content", "adviceslip_id", "created_on"],
+            [
+                (
+                    int(entity_ids[n]),
+                    int(advice_persona[n]),
+                    " ".join(WORDS[w] for w in words[n]).capitalize() + ".",
+                    int(slip_ids[n]),
+                    advice_created[n],
+                )
+                for n in range(start, stop)
+            ],
+        )
+
+    # Tags: popular tags are applied more often, each (tag, advice) at most once.
+    tag_counts = np.minimum(rng.poisson(tags_per_advice, advice), tags)
+    tagged_entity = np.repeat(np.arange(advice), tag_counts)
+    tagged_tag = zipf_sample(rng, tags, exponent, tagged_entity.size)
+    keys = np.unique(tagged_entity.astype(np.int64) * tags + tagged_tag)
+    tag_users = user_ids[rng.integers(0, users, keys.size)].tolist() if users else []
+    tag_age = (advice_age[keys // tags] * rng.random(keys.size)).tolist()
+    tag_rows = [
+        (
+            int(tag_ids[key % tags]),
+            int(entity_ids[key // tags]),
+            tag_users[n] if users else None,
+            now - dt.timedelta(seconds=tag_age[n]),
+        )
+        for n, key in enumerate(keys.tolist())
+    ]
+    load(EntityTag, ["tag_id", "entity_id", "user_id", "created_on"], tag_rows)
+    del tag_rows, keys
+
+    # Views, likes and comments, by chunks of users. Advice popularity ranks are shuffled so the
+    # most viewed advice is not simply the oldest id.
+    advice_cdf = np.cumsum(zipf_weights(advice, exponent))
+    advice_by_rank = rng.permutation(advice)
+    user_activity = zipf_weights(users, exponent)[rng.permutation(users)]
+    views_per = (
+        rng.multinomial(int(views_per_user * users), user_activity)
+        if users and advice
+        else np.zeros(users, dtype=np.int64)
+    )
+    first_comment = _next_id(EntityComment.comment_id)
+    chunk = max(1, batch_size // 10)
+
+    for start in range(0, users, chunk):
+        stop = min(start + chunk, users)
+        viewer = np.repeat(np.arange(start, stop), np.minimum(views_per[start:stop], advice))
+        viewed = advice_by_rank[zipf_sample(rng, advice, exponent, viewer.size, advice_cdf)]
+        # A user views an advice at most once.
+        keys = np.unique(viewer.astype(np.int64) * advice + viewed)
+        viewer, viewed = keys // advice, keys % advice
+        view_users = user_ids[viewer].tolist()
+        view_entities = entity_ids[viewed].tolist()
+        view_created = timestamps(advice_age[viewed] * rng.random(keys.size))
+        load(
+            EntityView,
+            ["user_id", "entity_id", "created_on"],
+            list(zip(view_users, view_entities, view_created)),
+        )
+
+        liked = np.flatnonzero(rng.random(keys.size) < like_rate).tolist()
+        load(
+            EntityLike,
+            ["user_id", "entity_id", "created_on"],
+            [(view_users[n], view_entities[n], view_created[n]) for n in liked],
+        )
+
+        commented = np.flatnonzero(rng.random(keys.size) < comment_rate).tolist()
+        comment_words = rng.integers(0, len(WORDS), (len(commented), 4)).tolist()
+        load(
+            EntityComment,
+            ["comment_id", "entity_id", "user_id", "content", "created_on"],
+            [
+                (
+                    first_comment + c,
+                    view_entities[n],
+                    view_users[n],
+                    " ".join(WORDS[w] for w in comment_words[c]).capitalize() + "!",
+                    view_created[n],
+                )
+                for c, n in enumerate(commented)
+            ],
+        )
+        first_comment += len(commented)
+
+    reset_sequences(
+        db.session.connection(),
+        [Persona.__table__, Tag.__table__, User.__table__, Entity.__table__, EntityComment.__table__],
+    )
+    db.session.commit()
+    return counts
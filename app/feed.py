@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from flask import current_app
+from sqlalchemy import BigInteger, cast, exists
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Advice, EntityTag, EntityView
+
+# (entity_id * multiplier + seed) mod a prime is a bijection on [0, modulus) for any non-zero
+# multiplier, so every seed gives a different, stable shuffle of the advice with no repeats.
+FEED_SHUFFLE_MODULUS = 2147483647  # 2**31 - 1, covers every Integer entity_id
+FEED_SHUFFLE_GOLDEN = 1327217885  # ~ modulus / golden ratio, spreads consecutive ids apart
+
+TOO_LARGE = object()
+
+
+class SeenSetCache:
+    """
+    Per-worker LRU cache of the advice each user has viewed, stored as sorted uint32 arrays of
+    entity ids, so an entry costs 4 bytes per view whatever the largest entity id.
+    Users who viewed more than FEED_SEEN_CACHE_MAX_ITEMS are remembered as TOO_LARGE and served
+    with a SQL anti-join. Entries expire after FEED_SEEN_CACHE_TTL seconds so views written by
+    other workers are eventually picked up.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Returns the entity ids of the advice viewed by user_id, loading them on a miss.
+
+        :param user_id: user id
+        :type user_id: int
+        :return: sorted array of entity ids, or TOO_LARGE if the user viewed too much advice to
+            cache
+        :rtype: numpy.ndarray or object
+        """
+
+        config = current_app.config
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        viewed = [
+            row.entity_id
+            for row in db.session.query(EntityView.entity_id)
+            .filter_by(user_id=user_id)
+            .limit(config["FEED_SEEN_CACHE_MAX_ITEMS"] + 1)
+        ]
+        if len(viewed) > config["FEED_SEEN_CACHE_MAX_ITEMS"]:
+            seen = TOO_LARGE
+        else:
+            seen = np.unique(np.array(viewed, dtype=np.uint32))
+
+        with self._lock:
+            self._entries[user_id] = (now + config["FEED_SEEN_CACHE_TTL"], seen)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > config["FEED_SEEN_CACHE_MAX_USERS"]:
+                self._entries.popitem(last=False)
+        return seen
+
+    def mark_seen(self, user_id, entity_id) -> None:
+        """Adds a new view to a cached seen-set. Call after the view is committed."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[1] is not TOO_LARGE:
+                seen = entry[1]
+                position = np.searchsorted(seen, entity_id)
+                if position < len(seen) and seen[position] == entity_id:
+                    return None
+                if len(seen) >= current_app.config["FEED_SEEN_CACHE_MAX_ITEMS"]:
+                    seen = TOO_LARGE
+                else:
+                    # a new array, so callers still using the previous one are unaffected
+                    seen = np.insert(seen, position, entity_id)
+                self._entries[user_id] = (entry[0], seen)
+
+    def invalidate(self, user_id) -> None:
+        """Drops the cached seen-set of user_id"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+SEEN_CACHE = SeenSetCache()
+
+
+def default_feed_seed(user_id) -> int:
+    """Returns the shuffle seed used when the client does not provide one"""
+    return (user_id * 2654435761) % FEED_SHUFFLE_MODULUS
+
+
+def unseen_feed(user_id, seed, after=None, limit=10, persona_ids=None, tag_ids=None) -> tuple:
+    """
+    Pages through advice user_id has not viewed, in a stable pseudo-random order given by seed.
+    Pages are keyset paginated on the shuffle key, so advice never repeats across pages.
+
+    Viewed advice is excluded in the same query with a NOT EXISTS anti-join on entity_view's
+    (user_id, entity_id) primary key, so every page is one query however much the user has
+    seen. The anti-join is skipped when the cached seen-set of the user is empty.
+
+    :param user_id: user to build the feed for
+    :type user_id: int
+    :param seed: shuffle seed
+    :type seed: int
+    :param after: next_cursor of the previous page
+    :type after: int
+    :param limit: page size
+    :type limit: int
+    :param persona_ids: only include advice from these personas
+    :type persona_ids: list
+    :param tag_ids: only include advice with any of these tags
+    :type tag_ids: list
+    :return: list of Advice and the cursor for the next page (None on the last page)
+    :rtype: list, int
+    """
+
+    seed = seed % FEED_SHUFFLE_MODULUS
+    multiplier = (seed * FEED_SHUFFLE_GOLDEN) % (FEED_SHUFFLE_MODULUS - 1) + 1
+    feed_key = (
+        cast(Advice.entity_id, BigInteger) * multiplier + seed
+    ) % FEED_SHUFFLE_MODULUS
+
+    query = db.session.query(Advice, feed_key.label("feed_key")).options(
+        joinedload(Advice.persona)
+    )
+    if persona_ids:
+        query = query.filter(Advice.persona_id.in_(persona_ids))
+    if tag_ids:
+        query = query.filter(
+            Advice.entity_id.in_(
+                db.session.query(EntityTag.entity_id).filter(
+                    EntityTag.tag_id.in_(tag_ids)
+                )
+            )
+        )
+    seen = SEEN_CACHE.get(user_id)
+    if seen is TOO_LARGE or len(seen):
+        query = query.filter(
+            ~exists().where(
+                EntityView.user_id == user_id,
+                EntityView.entity_id == Advice.entity_id,
+            )
+        )
+    if after is not None:
+        query = query.filter(feed_key > after)
+    rows = query.order_by(feed_key).limit(limit + 1).all()
+
+    next_cursor = rows[limit - 1][1] if len(rows) > limit else None
+    return [advice for advice, _ in rows[:limit]], next_cursor
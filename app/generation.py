@@ -0,0 +1,254 @@
+"""
+Persona advice generation and the pool of pre-generated advice.
+
+Generating advice means rewriting an Advice Slip in a persona's voice with OpenAI, which takes
+seconds. Most requests just want some new advice from persona X, so up to ADVICE_POOL_SIZE
+advice per persona are generated ahead of time into advice_pool. A request claims one of them
+(FOR UPDATE SKIP LOCKED on Postgres, so concurrent requests never wait on each other's rows)
+and a background thread of the worker tops the persona's pool back up. Requests only generate
+live when the pool of their persona is empty.
+"""
+import threading
+import time
+from random import choice
+import openai
+from flask import current_app
+from sqlalchemy import select
+from werkzeug.exceptions import ServiceUnavailable
+from app import db
+from app.admission import MODEL_POOLS
+from app.metrics.instruments import (
+    ADVICE_POOL_REFILLS,
+    GENERATION_LATENCY,
+    GENERATION_TOKENS,
+    timed_upstream,
+)
+from app.models import Advice, AdvicePool
+from app.personas import PERSONA_SETTINGS
+from app.utils import commit_to_db
+
+# Attempts to claim a pooled advice on databases without SKIP LOCKED, where a concurrent
+# request may delete the candidate row first.
+CLAIM_ATTEMPTS = 3
+
+
+def choose_adviceslip(persona_id, exclude=()) -> int:
+    """
+    Chooses an adviceslip_id among those in the database, preferring slips the persona has
+    not given yet.
+
+    :param persona_id: persona that will give the advice
+    :type persona_id: int
+    :param exclude: adviceslip_ids to avoid if possible, e.g. those already in the pool
+    :type exclude: iterable
+    :return: adviceslip_id, or None if the database has no advice yet
+    :rtype: int
+    """
+
+    adviceslips_by_persona = {
+        a.adviceslip_id
+        for a in Advice.query.filter_by(persona_id=persona_id)
+        .with_entities(Advice.adviceslip_id)
+        .distinct()
+    }
+    all_unique_adviceslips_in_db = [
+        slip.adviceslip_id
+        for slip in Advice.query.with_entities(Advice.adviceslip_id).distinct()
+    ]
+    if not all_unique_adviceslips_in_db:
+        return None
+
+    exclude = set(exclude)
+    for candidates in (
+        [s for s in all_unique_adviceslips_in_db if s not in adviceslips_by_persona | exclude],
+        [s for s in all_unique_adviceslips_in_db if s not in exclude],
+    ):
+        if candidates:
+            return choice(candidates)
+    return choice(all_unique_adviceslips_in_db)
+
+
+def render_advice(adviceslip_id, persona_id) -> str:
+    """
+    Rewrites the advice of adviceslip_id in the voice of persona_id, with the persona's model
+    and generation settings. Commits the session first, so no connection is held while waiting
+    on OpenAI, and waits for a slot of the model's pool (see ModelPools).
+
+    :param adviceslip_id: adviceslip whose content is rewritten
+    :type adviceslip_id: int
+    :param persona_id: persona giving the advice
+    :type persona_id: int
+    :raises openai.error.OpenAIError: the completion failed
+    :raises werkzeug.exceptions.ServiceUnavailable: the model's pool stayed full
+    :return: generated advice
+    :rtype: str
+    """
+
+    settings = PERSONA_SETTINGS.get(persona_id)
+    content = (
+        Advice.query.with_entities(Advice.content)
+        .filter_by(adviceslip_id=adviceslip_id)
+        .first()
+        .content
+    )
+    db.session.commit()
+    labels = (settings["name"], settings["model"] or "none")
+    with MODEL_POOLS.acquire(settings["model"]), timed_upstream("openai"):
+        start = time.perf_counter()
+        try:
+            response_obj = openai.Completion.create(
+                model=settings["model"],
+                prompt=content + settings["prompt_suffix"],
+                temperature=settings["temperature"],
+                stop=[settings["prompt_suffix"]],
+                max_tokens=settings["max_tokens"],
+                api_base=current_app.config["OPENAI_API_BASE"],
+                request_timeout=current_app.config["OPENAI_REQUEST_TIMEOUT"],
+            )
+        finally:
+            GENERATION_LATENCY.observe(time.perf_counter() - start, *labels)
+    usage = response_obj.get("usage") or {}
+    for token_type in ("prompt", "completion"):
+        GENERATION_TOKENS.inc(*labels, token_type, amount=usage.get(f"{token_type}_tokens", 0))
+    return response_obj["choices"][0]["text"]
+
+
+def claim_pooled_advice(persona_id) -> tuple:
+    """
+    Removes the oldest pooled advice of persona_id in the current transaction. It goes back to
+    the pool if the transaction rolls back.
+
+    :param persona_id: persona of the advice
+    :type persona_id: int
+    :return: (adviceslip_id, content), or None if the pool of the persona is empty
+    :rtype: tuple
+    """
+
+    table = AdvicePool.__table__
+    candidate = (
+        select(table.c.pool_id)
+        .where(table.c.persona_id == persona_id)
+        .order_by(table.c.pool_id)
+        .limit(1)
+    )
+    if db.engine.dialect.name == "postgresql":
+        row = db.session.execute(
+            table.delete()
+            .where(table.c.pool_id == candidate.with_for_update(skip_locked=True).scalar_subquery())
+            .returning(table.c.adviceslip_id, table.c.content)
+        ).first()
+        return tuple(row) if row else None
+
+    for _ in range(CLAIM_ATTEMPTS):
+        row = db.session.execute(
+            select(table.c.pool_id, table.c.adviceslip_id, table.c.content).where(
+                table.c.pool_id == candidate.scalar_subquery()
+            )
+        ).first()
+        if row is None:
+            return None
+        deleted = db.session.execute(table.delete().where(table.c.pool_id == row.pool_id))
+        if deleted.rowcount == 1:
+            return row.adviceslip_id, row.content
+    return None
+
+
+def refill_pool(persona_id, size=None) -> int:
+    """
+    Generates advice for persona_id until its pool holds size advice. Stops at the first failed
+    generation, the next trigger retries.
+
+    :param persona_id: persona whose pool is refilled
+    :type persona_id: int
+    :param size: target number of pooled advice. Defaults to ADVICE_POOL_SIZE.
+    :type size: int
+    :return: number of advice generated
+    :rtype: int
+    """
+
+    if size is None:
+        size = current_app.config["ADVICE_POOL_SIZE"]
+    generated = 0
+    while True:
+        pooled = [
+            p.adviceslip_id
+            for p in AdvicePool.query.filter_by(persona_id=persona_id).with_entities(
+                AdvicePool.adviceslip_id
+            )
+        ]
+        if len(pooled) >= size:
+            break
+        adviceslip_id = choose_adviceslip(persona_id, exclude=pooled)
+        if adviceslip_id is None:
+            break
+        try:
+            content = render_advice(adviceslip_id, persona_id)
+        except (openai.error.OpenAIError, ServiceUnavailable) as e:
+            ADVICE_POOL_REFILLS.inc("failed")
+            current_app.logger.warning(
+                "Advice pool refill of persona %s failed: %s", persona_id, e
+            )
+            break
+        db.session.add(
+            AdvicePool(persona_id=persona_id, adviceslip_id=adviceslip_id, content=content)
+        )
+        added, msg = commit_to_db(db)
+        if not added:
+            ADVICE_POOL_REFILLS.inc("failed")
+            current_app.logger.warning(
+                "Advice pool refill of persona %s failed: %s", persona_id, msg
+            )
+            break
+        ADVICE_POOL_REFILLS.inc("generated")
+        generated += 1
+    return generated
+
+
+class PoolRefiller:
+    """
+    Background thread of a worker that refills the pools of the personas it is triggered for,
+    one persona at a time. Triggers for a persona already waiting are merged. Workers refill
+    independently, so concurrent workers may overshoot ADVICE_POOL_SIZE by a few advice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = set()
+        self._thread = None
+
+    def trigger(self, persona_id) -> None:
+        """
+        Schedules a refill of the pool of persona_id. Starts the thread on first use.
+
+        :param persona_id: persona whose pool is refilled
+        :type persona_id: int
+        """
+
+        app = current_app._get_current_object()
+        if not app.config["ADVICE_POOL_SIZE"] or not app.config["ADVICE_POOL_REFILL_ENABLED"]:
+            return None
+        with self._lock:
+            self._pending.add(persona_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, args=(app,), name="advice-pool-refiller", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self, app):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                pending, self._pending = self._pending, set()
+            for persona_id in pending:
+                with app.app_context():
+                    try:
+                        refill_pool(persona_id)
+                    except Exception:
+                        app.logger.exception("Advice pool refill of persona %s failed", persona_id)
+
+
+REFILLER = PoolRefiller()
@@ -0,0 +1,7 @@
+from flask import Blueprint
+from app.metrics.registry import Registry
+
+BP = Blueprint('metrics', __name__)
+REGISTRY = Registry()
+
+from app.metrics import instruments, routes
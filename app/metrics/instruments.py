@@ -0,0 +1,339 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from app import db
+from app.admission import GENERATION_ADMISSION, MODEL_POOLS
+from app.metrics import BP as bp_metrics, REGISTRY
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Request latency by flask-restx resource endpoint, method and status code.",
+    ["endpoint", "method", "status"],
+)
+DB_QUERY_LATENCY = REGISTRY.histogram(
+    "db_query_duration_seconds",
+    "SQL statement latency by statement type. _count is the number of statements.",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "db_query_errors_total",
+    "SQL statements that raised an error, by statement type.",
+    ["operation"],
+)
+DB_STATEMENT_TIMEOUTS = REGISTRY.counter(
+    "db_statement_timeouts_total",
+    "Statements cancelled by the Postgres statement_timeout, by endpoint.",
+    ["endpoint"],
+)
+DB_POOL_CHECKOUTS = REGISTRY.counter(
+    "db_pool_checkouts_total",
+    "Connections checked out of the pool, by engine.",
+    ["engine"],
+)
+DB_POOL_CONNECTS = REGISTRY.counter(
+    "db_pool_connects_total",
+    "New database connections opened by the pool, by engine.",
+    ["engine"],
+)
+DB_POOL_INVALIDATIONS = REGISTRY.counter(
+    "db_pool_invalidations_total",
+    "Pooled connections discarded as dead (pre-ping, disconnect errors), by engine.",
+    ["engine"],
+)
+DB_POOL_TIMEOUTS = REGISTRY.counter(
+    "db_pool_timeouts_total",
+    "Requests that gave up waiting DB_POOL_TIMEOUT seconds for a connection, by endpoint.",
+    ["endpoint"],
+)
+DB_READ_ROUTING = REGISTRY.counter(
+    "db_read_routing_total",
+    "Read-only requests by the bind that served them (a replica bind or primary).",
+    ["target"],
+)
+DB_CONNECTIONS_HELD_DURING_UPSTREAM = REGISTRY.counter(
+    "db_connections_held_during_upstream_total",
+    "Upstream calls made while the thread held a pooled database connection, by upstream.",
+    ["upstream"],
+)
+ADVICE_POOL_CLAIMS = REGISTRY.counter(
+    "advice_pool_claims_total",
+    "Generation requests by whether a pre-generated advice was served (hit) or not (miss).",
+    ["result"],
+)
+ADVICE_POOL_REFILLS = REGISTRY.counter(
+    "advice_pool_refills_total",
+    "Advice generated in the background for the pool, by result (generated, failed).",
+    ["result"],
+)
+GENERATION_LATENCY = REGISTRY.histogram(
+    "generation_duration_seconds",
+    "Latency of advice generation calls to OpenAI, by persona and model.",
+    ["persona", "model"],
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+GENERATION_TOKENS = REGISTRY.counter(
+    "generation_tokens_total",
+    "OpenAI tokens used by advice generation, by persona, model and type (prompt, completion).",
+    ["persona", "model", "type"],
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to external APIs (openai, adviceslip).",
+    ["upstream"],
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors_total",
+    "Failed calls to external APIs by error type.",
+    ["upstream", "error"],
+)
+
+
+def _pool_usage() -> dict:
+    if not has_app_context():
+        return {}
+    usage = {}
+    for bind_key, engine in db.engines.items():
+        pool = engine.pool
+        name = bind_key or "default"
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, state):
+                usage[(name, state)] = max(getattr(pool, state)(), 0)
+    return usage
+
+
+REGISTRY.callback(
+    "db_pool_connections",
+    "Connections per engine and pool state (size, checkedin, checkedout, overflow).",
+    "gauge",
+    _pool_usage,
+    ["engine", "state"],
+)
+
+
+def _replica_state(field) -> dict:
+    if not has_app_context():
+        return {}
+    router = current_app.extensions.get("replica_router")
+    if router is None:
+        return {}
+    return {
+        (key,): float(state[field])
+        for key, state in router.state.items()
+        if state[field] is not None
+    }
+
+
+REGISTRY.callback(
+    "db_replica_lag_seconds",
+    "Last measured replication lag per replica bind.",
+    "gauge",
+    lambda: _replica_state("lag"),
+    ["bind"],
+)
+REGISTRY.callback(
+    "db_replica_healthy",
+    "1 if the replica bind serves reads, 0 while it lags or fails.",
+    "gauge",
+    lambda: _replica_state("healthy"),
+    ["bind"],
+)
+REGISTRY.callback(
+    "generation_in_flight",
+    "Advice generations currently running.",
+    "gauge",
+    lambda: {(): GENERATION_ADMISSION.stats()["in_flight"]},
+)
+REGISTRY.callback(
+    "generation_queue_depth",
+    "Advice generation requests waiting for a slot.",
+    "gauge",
+    lambda: {(): GENERATION_ADMISSION.stats()["queue_depth"]},
+)
+REGISTRY.callback(
+    "generation_admitted_total",
+    "Advice generation requests admitted.",
+    "counter",
+    lambda: {(): GENERATION_ADMISSION.stats()["admitted_total"]},
+)
+REGISTRY.callback(
+    "generation_rejected_total",
+    "Advice generation requests shed, by reason.",
+    "counter",
+    lambda: {
+        (reason,): total
+        for reason, total in GENERATION_ADMISSION.stats()["rejected_total"].items()
+    },
+    ["reason"],
+)
+
+
+
+def _model_pool_state(field) -> dict:
+    return {(model or "none",): pool[field] for model, pool in MODEL_POOLS.stats().items()}
+
+
+REGISTRY.callback(
+    "model_pool_limit",
+    "Concurrent OpenAI calls allowed per model.",
+    "gauge",
+    lambda: _model_pool_state("limit"),
+    ["model"],
+)
+REGISTRY.callback(
+    "model_pool_in_flight",
+    "OpenAI calls currently running, per model.",
+    "gauge",
+    lambda: _model_pool_state("in_flight"),
+    ["model"],
+)
+REGISTRY.callback(
+    "model_pool_queue_depth",
+    "OpenAI calls waiting for a slot of their model's pool.",
+    "gauge",
+    lambda: _model_pool_state("waiting"),
+    ["model"],
+)
+REGISTRY.callback(
+    "model_pool_rejected_total",
+    "OpenAI calls shed because their model's pool stayed full.",
+    "counter",
+    lambda: _model_pool_state("rejected_total"),
+    ["model"],
+)
+
+
+@contextmanager
+def timed_upstream(upstream):
+    """
+    Context manager that records the latency of a call to an external API and counts the
+    exceptions it raises. Calling an upstream while holding a database connection is reported
+    according to DB_IO_GUARD, see _guard_held_connections.
+
+    :param upstream: name of the external API. Example: openai
+    :type upstream: str
+    """
+
+    _guard_held_connections(upstream)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(upstream, type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream)
+
+
+# id(connection record) -> ident of the thread that checked it out of the pool
+_checked_out = {}
+
+
+@event.listens_for(Pool, "checkout")
+def _track_checkout(dbapi_connection, connection_record, connection_proxy):
+    _checked_out[id(connection_record)] = threading.get_ident()
+
+
+@event.listens_for(Pool, "checkin")
+def _track_checkin(dbapi_connection, connection_record):
+    _checked_out.pop(id(connection_record), None)
+
+
+def held_connections() -> int:
+    """Returns the number of pooled connections checked out by the current thread"""
+    ident = threading.get_ident()
+    return sum(1 for owner in list(_checked_out.values()) if owner == ident)
+
+
+def _guard_held_connections(upstream) -> None:
+    """
+    Reports a connection held across a call to an external API: the connection, and often a
+    transaction, stays reserved for the whole call while the database sits idle. DB_IO_GUARD
+    selects the reaction: "warn" (default) logs and counts it, "raise" fails the request,
+    which is useful in development and benchmarks, "off" disables the check.
+    """
+
+    mode = current_app.config.get("DB_IO_GUARD", "warn") if has_app_context() else "warn"
+    if mode == "off":
+        return None
+    held = held_connections()
+    if not held:
+        return None
+    DB_CONNECTIONS_HELD_DURING_UPSTREAM.inc(upstream)
+    where = f"{request.method} {request.path}" if has_request_context() else "outside a request"
+    message = (
+        f"{held} database connection(s) held while calling {upstream} ({where}). "
+        "Commit or close the session before external I/O."
+    )
+    if mode == "raise":
+        raise RuntimeError(message)
+    if has_app_context():
+        current_app.logger.warning(message)
+
+
+def _operation(statement) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["metrics_query_start"].pop()
+    DB_QUERY_LATENCY.observe(time.perf_counter() - start, _operation(statement))
+
+
+@event.listens_for(Engine, "handle_error")
+def _count_query_error(exception_context):
+    connection = exception_context.connection
+    starts = connection.info.get("metrics_query_start") if connection else None
+    if starts:
+        starts.pop()
+    if exception_context.statement:
+        DB_QUERY_ERRORS.inc(_operation(exception_context.statement))
+    # 57014 query_canceled: statement_timeout expired
+    if getattr(exception_context.original_exception, "pgcode", None) == "57014":
+        DB_STATEMENT_TIMEOUTS.inc(
+            (request.endpoint or "unmatched") if has_request_context() else "none"
+        )
+
+
+def instrument_engine(name, engine) -> None:
+    """
+    Counts the pool events of engine under the engine label name.
+
+    :param name: engine label. Example: default
+    :type name: str
+    :param engine: engine to instrument
+    :type engine: sqlalchemy.engine.Engine
+    """
+
+    event.listen(engine.pool, "connect", lambda *args: DB_POOL_CONNECTS.inc(name))
+    event.listen(engine.pool, "checkout", lambda *args: DB_POOL_CHECKOUTS.inc(name))
+    event.listen(engine.pool, "invalidate", lambda *args: DB_POOL_INVALIDATIONS.inc(name))
+
+
+@bp_metrics.before_app_request
+def _start_request_timer():
+    g.metrics_request_start = time.perf_counter()
+
+
+@bp_metrics.after_app_request
+def _observe_request(response):
+    start = g.pop("metrics_request_start", None)
+    if start is not None:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            request.endpoint or "unmatched",
+            request.method,
+            str(response.status_code),
+        )
+    REGISTRY.maybe_flush()
+    return response
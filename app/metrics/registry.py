@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0
+)
+
+
+def _merge(a, b):
+    """Adds two metric values: floats for counters and gauges, bucket lists for histograms"""
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _ThreadShards:
+    """
+    Per-thread value dictionaries: each thread only ever writes its own shard, so updates on the
+    hot path take no lock. Collection sums the shards, and folds the shards of finished threads
+    into a single retired shard so short lived threads do not accumulate.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def values(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            self._local.values = values
+            return values
+
+    def collect(self) -> dict:
+        with self._lock:
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    for key, value in values.copy().items():
+                        self._retired[key] = (
+                            _merge(self._retired[key], value)
+                            if key in self._retired
+                            else value
+                        )
+            self._shards = alive
+            totals = dict(self._retired)
+            for _, values in alive:
+                for key, value in values.copy().items():
+                    totals[key] = _merge(totals[key], value) if key in totals else value
+        return totals
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _ThreadShards()
+
+    def inc(self, *labels, amount=1.0) -> None:
+        values = self._shards.values()
+        values[labels] = values.get(labels, 0.0) + amount
+
+    def collect(self) -> dict:
+        return self._shards.collect()
+
+
+class Histogram:
+    """Histogram with fixed buckets. Values are [count per bucket..., +Inf count, sum, count]."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._shards = _ThreadShards()
+
+    def observe(self, value, *labels) -> None:
+        values = self._shards.values()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def collect(self) -> dict:
+        return self._shards.collect()
+
+
+class CallbackMetric:
+    """Gauge or counter whose values are read from callback() at collection time"""
+
+    def __init__(self, name, documentation, type, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> dict:
+        return {tuple(labels): float(value) for labels, value in self.callback().items()}
+
+
+class Registry:
+    """
+    Holds the metrics of this process and renders them in the Prometheus text format.
+
+    When multiproc_dir is set, every process periodically writes its values to
+    <multiproc_dir>/<pid>.json and render() sums the files of all processes, so any worker can
+    answer a scrape. Counters and histograms of exited processes keep counting; gauges only
+    count for processes that are still alive. The directory should be emptied on deploy.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.multiproc_dir = None
+        self.flush_interval = 5.0
+        self._next_flush = 0.0
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type, callback, labelnames=()) -> CallbackMetric:
+        return self.register(
+            CallbackMetric(name, documentation, type, callback, labelnames)
+        )
+
+    def snapshot(self) -> dict:
+        """Returns {metric name: {labels: value}} for this process"""
+        return {metric.name: metric.collect() for metric in self.metrics}
+
+    def maybe_flush(self) -> None:
+        """Writes this process' snapshot to multiproc_dir at most every flush_interval seconds"""
+        if not self.multiproc_dir or time.monotonic() < self._next_flush:
+            return None
+        self._next_flush = time.monotonic() + self.flush_interval
+        self.flush()
+
+    def flush(self) -> None:
+        if not self.multiproc_dir:
+            return None
+        data = {
+            name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in self.snapshot().items()
+        }
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _other_processes(self):
+        for file_name in os.listdir(self.multiproc_dir):
+            if not file_name.endswith(".json"):
+                continue
+            pid = int(file_name[: -len(".json")])
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+                alive = True
+            except ProcessLookupError:
+                alive = False
+            except PermissionError:
+                alive = True
+            try:
+                with open(os.path.join(self.multiproc_dir, file_name)) as f:
+                    yield alive, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)"""
+
+        totals = self.snapshot()
+        if self.multiproc_dir:
+            types = {metric.name: metric.type for metric in self.metrics}
+            for alive, data in self._other_processes():
+                for name, values in data.items():
+                    if name not in totals or (types[name] == "gauge" and not alive):
+                        continue
+                    for labels, value in values:
+                        labels = tuple(labels)
+                        current = totals[name].get(labels)
+                        totals[name][labels] = (
+                            value if current is None else _merge(current, value)
+                        )
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in sorted(totals[metric.name].items()):
+                if metric.type == "histogram":
+                    cumulative = 0
+                    bounds = [str(b) for b in metric.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, value):
+                        cumulative += count
+                        label_str = _format_labels(
+                            metric.labelnames, labels, [("le", bound)]
+                        )
+                        lines.append(f"{metric.name}_bucket{label_str} {cumulative}")
+                    label_str = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}_sum{label_str} {value[-2]}")
+                    lines.append(f"{metric.name}_count{label_str} {value[-1]}")
+                else:
+                    label_str = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}{label_str} {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,8 @@
+from flask import Response
+from app.metrics import BP as bp_metrics, REGISTRY
+
+
+@bp_metrics.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
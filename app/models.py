@@ -5,7 +5,9 @@ from itsdangerous import URLSafeTimedSerializer
 from itsdangerous import BadSignature, SignatureExpired
 import datetime as dt
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import func
+from sqlalchemy import event, func
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import joinedload, with_loader_criteria
 
 
 class PaginatedAPIMixin(object):
@@ -64,14 +66,18 @@ class User(PaginatedAPIMixin, db.Model):
     email = db.Column(db.String(120), index=True, unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
+    # Set when the account is deleted. The row is hidden from ORM queries right away and
+    # removed with its dependent rows by `flask users purge`.
+    deleted_on = db.Column(db.DateTime(timezone=True), index=True)
 
     role_association = db.relationship(
         "UserRole",
         back_populates="user",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
     roles = association_proxy("role_association", "role")
 
@@ -80,6 +86,7 @@ class User(PaginatedAPIMixin, db.Model):
         back_populates="user",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
     entities_liked = association_proxy("likes", "entity")
 
@@ -88,22 +95,30 @@ class User(PaginatedAPIMixin, db.Model):
         back_populates="user",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
     entities_viewed = association_proxy("views", "entity")
 
     comments = db.relationship(
-        "EntityComment", back_populates="user", cascade_backrefs=False
+        "EntityComment",
+        back_populates="user",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
     entities_commented = association_proxy("comments", "entity")
 
     comment_likes = db.relationship(
-        "EntityCommentLike", back_populates="user", cascade_backrefs=False
+        "EntityCommentLike",
+        back_populates="user",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
     tags = db.relationship(
         "EntityTag",
         back_populates="user",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
 
     # children = db.relationship("Child", back_populates="user", cascade="all, delete, delete-orphan")
@@ -114,10 +129,12 @@ class User(PaginatedAPIMixin, db.Model):
         self.hash_password(password)
 
     def assign_role(self, role_name):
-        """Assigns role to user based on role name"""
-        valid_role = Role.query.filter_by(name=role_name).first()
-        if valid_role:
-            user_role = UserRole(user=self, role=valid_role)
+        """Assigns role to user based on role name. Use app.roles.assign_roles for many users."""
+        from app.roles import ROLES
+
+        role_id = ROLES.get_id(role_name)
+        if role_id:
+            user_role = UserRole(user=self, role_id=role_id)
             db.session.add(user_role)
             return True
         else:
@@ -130,6 +147,11 @@ class User(PaginatedAPIMixin, db.Model):
         """Returns user id"""
         return self.user_id
 
+    def soft_delete(self) -> None:
+        """Marks the user deleted. The change has to be committed."""
+        self.deleted_on = dt.datetime.now(tz=dt.timezone.utc)
+        return None
+
     def hash_password(self, password) -> None:
         """Hash user provided password and saves it to User Object"""
         self.password_hash = generate_password_hash(password)
@@ -171,7 +193,9 @@ class User(PaginatedAPIMixin, db.Model):
         except BadSignature:
             return None  # invalid token
 
-        user = db.session.get(User, data["id"])
+        user = db.session.get(
+            User, data["id"], options=[joinedload(User.role_association)]
+        )
         return user
 
     def to_dict(self, include_emails=True) -> dict:
@@ -197,6 +221,89 @@ class User(PaginatedAPIMixin, db.Model):
         return data
 
 
+@event.listens_for(db.session, "do_orm_execute")
+def _hide_deleted_users(execute_state):
+    """
+    Adds "deleted_on IS NULL" to every ORM query loading users, including relationship loads.
+    Pass execution_options(include_deleted=True) to see deleted users, e.g. for uniqueness
+    checks or the purge job. Compound selects (UNION) are left alone: they take no options.
+    """
+
+    if (
+        execute_state.is_select
+        and isinstance(execute_state.statement, Select)
+        and not execute_state.is_column_load
+        and not execute_state.execution_options.get("include_deleted", False)
+    ):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(User, User.deleted_on.is_(None), include_aliases=True)
+        )
+
+
+class UserPurge(db.Model):
+    __tablename__ = "user_purge"
+    # No foreign key: the progress row outlives the user it purged.
+    user_id = db.Column(db.Integer, primary_key=True)
+    step = db.Column(db.String(64))
+    rows_deleted = db.Column(db.BigInteger, nullable=False, default=0)
+    started_on = db.Column(
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
+    )
+    updated_on = db.Column(db.DateTime(timezone=True))
+    finished_on = db.Column(db.DateTime(timezone=True))
+
+
+class UserImport(db.Model):
+    __tablename__ = "user_import"
+    # Job of POST /api/users/import, run in the background by the worker that received it.
+    import_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.user_id", ondelete="CASCADE"), index=True
+    )
+    # queued, running, finished or failed
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    truncated = db.Column(db.Boolean, nullable=False, default=False)
+    errors = db.Column(db.JSON)
+    message = db.Column(db.Text)
+    created_on = db.Column(
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
+    )
+    updated_on = db.Column(db.DateTime(timezone=True))
+    finished_on = db.Column(db.DateTime(timezone=True))
+
+    def to_dict(self) -> dict:
+        """
+        Returns UserImport attributes as a Python Dictionary.
+
+        :param self: UserImport object
+        :type self: UserImport
+        :return: UserImport attributes as dictionary.
+        :rtype: dict
+        """
+
+        data = {
+            "import_id": self.import_id,
+            "status": self.status,
+            "rows_read": self.rows_read,
+            "created": self.created,
+            "failed": self.failed,
+            "truncated": self.truncated,
+            "errors": self.errors or [],
+            "message": self.message,
+            "created_on": self.created_on,
+            "updated_on": self.updated_on,
+            "finished_on": self.finished_on,
+            "_links": {
+                "self": url_for("api.users_users_import_status", import_id=self.import_id),
+            },
+        }
+
+        return data
+
+
 class UserRole(db.Model):
     __tablename__ = "user_role"
     user_id = db.Column(
@@ -204,7 +311,7 @@ class UserRole(db.Model):
     )
     role_id = db.Column(db.Integer, db.ForeignKey("role.role_id"), primary_key=True)
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     user = db.relationship(
@@ -221,7 +328,7 @@ class Role(db.Model):
     name = db.Column(db.String(64), nullable=False, unique=True)
     description = db.Column(db.String(255))
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
     user_association = db.relationship(
         "UserRole", back_populates="role", cascade_backrefs=False
@@ -235,21 +342,30 @@ class Entity(db.Model):
     type = db.Column(db.String(64), nullable=False)
 
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     entity_likes = db.relationship(
-        "EntityLike", back_populates="entity", cascade_backrefs=False
+        "EntityLike",
+        back_populates="entity",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
     liked_by = association_proxy("likes", "user")
 
     views = db.relationship(
-        "EntityView", back_populates="entity", cascade_backrefs=False
+        "EntityView",
+        back_populates="entity",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
     viewed_by = association_proxy("views", "user")
 
     comments = db.relationship(
-        "EntityComment", back_populates="entity", cascade_backrefs=False
+        "EntityComment",
+        back_populates="entity",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
     comments_by = association_proxy("comments", "user")
 
@@ -258,6 +374,7 @@ class Entity(db.Model):
         back_populates="entity",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
     tag_names = association_proxy("tags", "tag")
 
@@ -266,6 +383,7 @@ class Entity(db.Model):
         back_populates="entity",
         cascade="all, delete, delete-orphan",
         cascade_backrefs=False,
+        passive_deletes=True,
     )
 
     def likes(self) -> int:
@@ -292,8 +410,12 @@ class Advice(PaginatedAPIMixin, db.Model):
     persona_id = db.Column(db.Integer, db.ForeignKey("persona.persona_id"))
     content = db.Column(db.Text, nullable=False)
     adviceslip_id = db.Column(db.Integer)
+    # Partition key of advice with PARTITIONING_ENABLED, where the primary key of the table
+    # becomes (entity_id, created_on) and a trigger keeps entity_id unique
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=lambda: dt.datetime.now(tz=dt.timezone.utc),
     )
 
     entity = db.relationship("Entity", back_populates="advice", cascade_backrefs=False)
@@ -327,8 +449,13 @@ class Persona(db.Model):
     __tablename__ = "persona"
     persona_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
+    # Generation settings, NULL uses the OPENAI_* default of the config (see app/personas.py)
+    model = db.Column(db.String(100))
+    temperature = db.Column(db.Float)
+    max_tokens = db.Column(db.Integer)
+    prompt_suffix = db.Column(db.String(100))
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     advice = db.relationship("Advice", back_populates="persona", cascade_backrefs=False)
@@ -357,7 +484,7 @@ class Tag(db.Model):
     name = db.Column(db.String(64), nullable=False, unique=True)
     description = db.Column(db.Text)
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     tags = db.relationship(
@@ -378,10 +505,13 @@ class EntityTag(db.Model):
         db.Integer,
         db.ForeignKey("entity.entity_id", ondelete="CASCADE"),
         primary_key=True,
+        index=True,
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.user_id", ondelete="CASCADE"), index=True
     )
-    user_id = db.Column(db.Integer, db.ForeignKey("user.user_id"))
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     tag = db.relationship("Tag", back_populates="tags", cascade_backrefs=False)
@@ -398,9 +528,10 @@ class EntityView(db.Model):
         db.Integer,
         db.ForeignKey("entity.entity_id", ondelete="CASCADE"),
         primary_key=True,
+        index=True,
     )
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     user = db.relationship("User", back_populates="views", cascade_backrefs=False)
@@ -416,9 +547,10 @@ class EntityLike(db.Model):
         db.Integer,
         db.ForeignKey("entity.entity_id", ondelete="CASCADE"),
         primary_key=True,
+        index=True,
     )
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     user = db.relationship("User", back_populates="likes", cascade_backrefs=False)
@@ -434,11 +566,14 @@ class EntityComment(db.Model):
         db.Integer,
         db.ForeignKey("entity.entity_id", ondelete="CASCADE"),
         primary_key=True,
+        index=True,
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.user_id", ondelete="SET NULL"), index=True
     )
-    user_id = db.Column(db.Integer, db.ForeignKey("user.user_id"))
     content = db.Column(db.Text, nullable=False, index=True)
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
 
     user = db.relationship("User", back_populates="comments", cascade_backrefs=False)
@@ -446,7 +581,10 @@ class EntityComment(db.Model):
         "Entity", back_populates="comments", cascade_backrefs=False
     )
     comment_likes = db.relationship(
-        "EntityCommentLike", back_populates="comment", cascade_backrefs=False
+        "EntityCommentLike",
+        back_populates="comment",
+        cascade_backrefs=False,
+        passive_deletes=True,
     )
 
     def likes(self) -> int:
@@ -471,12 +609,16 @@ class EntityCommentLike(db.Model):
     comment_id = db.Column(db.Integer, primary_key=True)
     entity_id = db.Column(db.Integer, primary_key=True)
     created_on = db.Column(
-        db.DateTime(timezone=True), default=dt.datetime.now(tz=dt.timezone.utc)
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
     )
     __table_args__ = (
         db.ForeignKeyConstraint(
             ["comment_id", "entity_id"],
             ["entity_comment.comment_id", "entity_comment.entity_id"],
+            ondelete="CASCADE",
+        ),
+        db.Index(
+            "ix_entity_comment_like_comment_id_entity_id", "comment_id", "entity_id"
         ),
     )
 
@@ -486,3 +628,73 @@ class EntityCommentLike(db.Model):
     comment = db.relationship(
         "EntityComment", back_populates="comment_likes", cascade_backrefs=False
     )
+
+
+class TrendingAdvice(db.Model):
+    __tablename__ = "trending_advice"
+    time_window = db.Column(db.String(8), primary_key=True)
+    entity_id = db.Column(
+        db.Integer,
+        db.ForeignKey("entity.entity_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    score = db.Column(db.Float, nullable=False, default=0)
+    last_event_on = db.Column(db.DateTime(timezone=True))
+    __table_args__ = (
+        db.Index("ix_trending_advice_time_window_score", "time_window", "score"),
+    )
+
+
+class TrendingEpoch(db.Model):
+    __tablename__ = "trending_epoch"
+    time_window = db.Column(db.String(8), primary_key=True)
+    epoch = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+class AdvicePool(db.Model):
+    __tablename__ = "advice_pool"
+    pool_id = db.Column(db.Integer, primary_key=True)
+    persona_id = db.Column(
+        db.Integer,
+        db.ForeignKey("persona.persona_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    adviceslip_id = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_on = db.Column(
+        db.DateTime(timezone=True), default=lambda: dt.datetime.now(tz=dt.timezone.utc)
+    )
+    __table_args__ = (
+        db.Index("ix_advice_pool_persona_id_pool_id", "persona_id", "pool_id"),
+    )
+
+
+class DailyRollup(db.Model):
+    __tablename__ = "daily_rollup"
+    # Advice created and engagement per UTC day, persona and tag, maintained by app.rollups.
+    day = db.Column(db.Date, primary_key=True)
+    # 0 for advice without persona
+    persona_id = db.Column(db.Integer, primary_key=True)
+    # 0 for all advice of the persona, tagged or not
+    tag_id = db.Column(db.Integer, primary_key=True)
+    advice = db.Column(db.Integer, nullable=False, default=0)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.Index("ix_daily_rollup_tag_id_day", "tag_id", "day"),
+    )
+
+
+class DailyRollupDelta(db.Model):
+    __tablename__ = "daily_rollup_delta"
+    # Counts of single events appended by the write handlers, folded into daily_rollup by
+    # app.rollups.fold_rollups(), so concurrent events never wait on the same rollup row.
+    delta_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    persona_id = db.Column(db.Integer, nullable=False)
+    tag_id = db.Column(db.Integer, nullable=False)
+    advice = db.Column(db.Integer, nullable=False, default=0)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
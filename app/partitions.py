@@ -0,0 +1,235 @@
+"""
+Monthly range partitions of advice, on Postgres.
+
+With PARTITIONING_ENABLED, migration 9b2d6f4e8a13 turns the tables of PARTITIONED_TABLES into
+tables partitioned by RANGE (created_on): one partition per month named <table>_pYYYYMM, plus
+<table>_default for rows no month covers yet. Queries filtering on created_on, like the date
+filter of the advice listing or the trending rebuild, only scan the months they need.
+
+- create_partitions() adds the partitions of the coming months and moves rows that landed in
+  the default partition into their own month. Run `flask partitions create` daily.
+- detach_partitions() detaches the months past the retention period and moves them to an
+  archive schema. Nothing is copied or deleted, so it is cheap however large the month is.
+
+On other databases (SQLite in development) the tables stay plain tables, the same queries work
+unchanged and these functions do nothing.
+"""
+import datetime as dt
+import re
+from sqlalchemy import text
+
+# A unique constraint on a partitioned table has to include created_on. entity_comment is not
+# partitioned as entity_comment_like needs a foreign key to it, nor are entity_view and
+# entity_like, whose primary keys keep one view and one like per user and entity. advice keeps
+# one advice per entity with a trigger instead (see the migration).
+PARTITIONED_TABLES = ["advice"]
+
+PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def month_start(datetime) -> dt.datetime:
+    """Returns midnight UTC of the first day of the month of datetime"""
+    if datetime.tzinfo is not None:
+        datetime = datetime.astimezone(dt.timezone.utc)
+    return dt.datetime(datetime.year, datetime.month, 1, tzinfo=dt.timezone.utc)
+
+
+def add_months(month, months) -> dt.datetime:
+    """Returns the first day of the month months after month (before if negative)"""
+    index = month.year * 12 + month.month - 1 + months
+    return dt.datetime(index // 12, index % 12 + 1, 1, tzinfo=dt.timezone.utc)
+
+
+def partition_name(table, month) -> str:
+    """Returns the name of the partition of table holding month. Example: advice_p202610"""
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(connection, table) -> bool:
+    """
+    Checks if table is a partitioned table.
+
+    :param connection: connection to use
+    :type connection: sqlalchemy.engine.Connection
+    :param table: table name
+    :type table: str
+    :return: True on Postgres when the table is partitioned, False otherwise
+    :rtype: bool
+    """
+
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass(:table))"
+        ),
+        {"table": f'"{table}"'},
+    ).scalar()
+
+
+def monthly_partitions(connection, table) -> dict:
+    """
+    Returns the monthly partitions attached to table.
+
+    :param connection: connection to use
+    :type connection: sqlalchemy.engine.Connection
+    :param table: partitioned table name
+    :type table: str
+    :return: partition name by first day of its month
+    :rtype: dict
+    """
+
+    names = connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ),
+        {"table": f'"{table}"'},
+    ).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            month = dt.datetime(int(match[1]), int(match[2]), 1, tzinfo=dt.timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(connection, table, month) -> int:
+    """
+    Creates and attaches the partition of table for month. Rows of that month waiting in the
+    default partition are moved into it first, as Postgres refuses to attach a partition
+    whose rows are also covered by the default partition.
+
+    :param connection: connection to use. The caller owns the transaction.
+    :type connection: sqlalchemy.engine.Connection
+    :param table: partitioned table name
+    :type table: str
+    :param month: first day of the month, UTC
+    :type month: datetime.datetime
+    :return: number of rows moved out of the default partition
+    :rtype: int
+    """
+
+    name = partition_name(table, month)
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    connection.execute(
+        text(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    )
+    moved = connection.execute(
+        text(
+            f'WITH moved AS (DELETE FROM "{table}_default" '
+            f"WHERE created_on >= :start AND created_on < :end RETURNING *) "
+            f'INSERT INTO "{name}" SELECT * FROM moved'
+        ),
+        {"start": start, "end": end},
+    ).rowcount
+    connection.execute(
+        text(
+            f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" '
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    )
+    return moved
+
+
+def create_partitions(connection, months_ahead=3, now=None) -> dict:
+    """
+    Creates the partitions of the current month and of the next months_ahead months, and those
+    of months that have rows in the default partition, for every partitioned table.
+
+    :param connection: connection to use. The caller owns the transaction.
+    :type connection: sqlalchemy.engine.Connection
+    :param months_ahead: months to create in advance
+    :type months_ahead: int
+    :param now: defaults to the current time
+    :type now: datetime.datetime
+    :return: rows moved out of the default partition by created partition name, per table
+    :rtype: dict
+    """
+
+    current = month_start(now or dt.datetime.now(tz=dt.timezone.utc))
+    created = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        existing = monthly_partitions(connection, table)
+        months = {add_months(current, i) for i in range(months_ahead + 1)}
+        months.update(
+            month_start(row.month.replace(tzinfo=dt.timezone.utc))
+            for row in connection.execute(
+                text(
+                    "SELECT DISTINCT date_trunc('month', created_on AT TIME ZONE 'UTC') AS month "
+                    f'FROM "{table}_default"'
+                )
+            )
+        )
+        created[table] = {
+            partition_name(table, month): create_partition(connection, table, month)
+            for month in sorted(months)
+            if month not in existing
+        }
+    return created
+
+
+def detach_partitions(connection, retention_months, archive_schema="archive", now=None) -> dict:
+    """
+    Detaches the monthly partitions that end more than retention_months months ago and moves
+    them to archive_schema, where they can be dumped or dropped. Their rows disappear from the
+    partitioned tables at once, without a DELETE.
+
+    :param connection: connection to use. The caller owns the transaction.
+    :type connection: sqlalchemy.engine.Connection
+    :param retention_months: full months to keep besides the current one
+    :type retention_months: int
+    :param archive_schema: schema receiving the detached partitions
+    :type archive_schema: str
+    :param now: defaults to the current time
+    :type now: datetime.datetime
+    :return: detached partition names, per table
+    :rtype: dict
+    """
+
+    current = month_start(now or dt.datetime.now(tz=dt.timezone.utc))
+    cutoff = add_months(current, -retention_months)
+    detached = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        detached[table] = []
+        for month, name in sorted(monthly_partitions(connection, table).items()):
+            if month >= cutoff:
+                continue
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"'))
+            connection.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+            connection.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{archive_schema}"'))
+            detached[table].append(name)
+    return detached
+
+
+def partition_status(connection) -> dict:
+    """
+    Returns the rows of every partition of the partitioned tables. Estimates from the
+    planner statistics, so it is cheap on large tables.
+
+    :param connection: connection to use
+    :type connection: sqlalchemy.engine.Connection
+    :return: {table: {partition name: estimated rows}}, empty on other databases
+    :rtype: dict
+    """
+
+    status = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        rows = connection.execute(
+            text(
+                "SELECT c.relname, c.reltuples FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+            ),
+            {"table": f'"{table}"'},
+        )
+        status[table] = {row.relname: max(int(row.reltuples), 0) for row in rows}
+    return status
@@ -0,0 +1,85 @@
+"""
+Generation settings of the personas.
+
+Each persona may use its own model, temperature, max_tokens and prompt suffix (the separator
+its fine-tuned model was trained with). NULL columns fall back to the OPENAI_* defaults of the
+config, so a persona without settings generates as before. render_advice() reads the settings
+of every generation, so each worker keeps the persona table in PERSONA_SETTINGS the same way
+ROLES keeps the roles: ORM changes in this process invalidate it at once, changes made
+elsewhere are picked up after PERSONA_SETTINGS_CACHE_TTL seconds.
+"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, select
+from app import db
+from app.models import Persona
+
+# setting -> config key of its default
+SETTING_DEFAULTS = {
+    "model": "OPENAI_MODEL",
+    "temperature": "OPENAI_TEMPERATURE",
+    "max_tokens": "OPENAI_MAX_TOKENS",
+    "prompt_suffix": "OPENAI_PROMPT_SUFFIX",
+}
+
+
+class PersonaSettingsCache:
+    """Per-worker cache of the generation settings of every persona"""
+
+    def __init__(self):
+        self._settings = {}
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        columns = [getattr(Persona, setting) for setting in SETTING_DEFAULTS]
+        rows = db.session.execute(select(Persona.persona_id, Persona.name, *columns)).all()
+        with self._lock:
+            self._settings = {row.persona_id: row._asdict() for row in rows}
+            self._expires = time.monotonic() + current_app.config["PERSONA_SETTINGS_CACHE_TTL"]
+
+    def get(self, persona_id) -> dict:
+        """
+        Returns the generation settings of persona_id, with the defaults of the config for the
+        settings the persona does not set.
+
+        :param persona_id: persona id
+        :type persona_id: int
+        :return: {"persona_id", "name", "model", "temperature", "max_tokens", "prompt_suffix"}.
+            name is "unknown" and every setting the default if there is no such persona.
+        :rtype: dict
+        """
+
+        with self._lock:
+            fresh = self._expires > time.monotonic()
+            row = self._settings.get(persona_id)
+        if not (fresh and row):
+            self._load()
+            with self._lock:
+                row = self._settings.get(persona_id)
+        row = row or {"persona_id": persona_id, "name": "unknown"}
+        config = current_app.config
+        return {
+            "persona_id": persona_id,
+            "name": row["name"],
+            **{
+                setting: config[default] if row.get(setting) is None else row[setting]
+                for setting, default in SETTING_DEFAULTS.items()
+            },
+        }
+
+    def invalidate(self) -> None:
+        """Forgets the cached settings, the next lookup reloads them"""
+        with self._lock:
+            self._expires = 0.0
+
+
+PERSONA_SETTINGS = PersonaSettingsCache()
+
+
+@event.listens_for(Persona, "after_insert")
+@event.listens_for(Persona, "after_update")
+@event.listens_for(Persona, "after_delete")
+def _invalidate_persona_settings(mapper, connection, target) -> None:
+    PERSONA_SETTINGS.invalidate()
@@ -0,0 +1,238 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+_local = threading.local()
+
+
+class QueryRecorder:
+    """Collects the SQL statements executed by the current thread while it is active"""
+
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def duration(self) -> float:
+        return sum(query["duration"] for query in self.queries)
+
+    def repeated_shapes(self, threshold) -> list:
+        """
+        Returns statements executed at least threshold times with the same shape (same SQL once
+        literals and IN lists are normalized), the usual signature of an N+1 query pattern.
+
+        :param threshold: minimum number of executions
+        :type threshold: int
+        :return: list of dicts with shape, count and the call sites it was executed from
+        :rtype: list
+        """
+
+        counts = Counter(query["shape"] for query in self.queries)
+        repeated = []
+        for shape, count in counts.most_common():
+            if count < threshold:
+                break
+            call_sites = sorted(
+                {q["call_site"] for q in self.queries if q["shape"] == shape}
+            )
+            repeated.append({"shape": shape, "count": count, "call_sites": call_sites})
+        return repeated
+
+    def summary(self, threshold) -> str:
+        return (
+            f"queries={self.count}; duration_ms={self.duration * 1000:.1f}; "
+            f"nplusone={len(self.repeated_shapes(threshold))}"
+        )
+
+
+def statement_shape(statement) -> str:
+    """
+    Normalizes a SQL statement so executions that only differ by parameters compare equal.
+
+    :param statement: SQL statement
+    :type statement: str
+    :return: normalized statement
+    :rtype: str
+    """
+
+    shape = re.sub(r"\s+", " ", statement.strip())
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"\b\d+(\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\bIN \([^)]*\)", "IN (...)", shape, flags=re.IGNORECASE)
+    return shape
+
+
+def _call_site() -> str:
+    """Returns file:line of the innermost frame in application code outside this module"""
+    frame = sys._getframe(2)
+    while frame:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_ROOT) and filename != __file__:
+            return f"{os.path.relpath(filename, os.path.dirname(APP_ROOT))}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _active_recorders() -> list:
+    return getattr(_local, "recorders", None)
+
+
+def _push_recorder(recorder) -> None:
+    if not hasattr(_local, "recorders"):
+        _local.recorders = []
+    _local.recorders.append(recorder)
+
+
+def _pop_recorder(recorder) -> None:
+    if recorder in _local.recorders:
+        _local.recorders.remove(recorder)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_recording(conn, cursor, statement, parameters, context, executemany):
+    if _active_recorders():
+        conn.info.setdefault("profiler_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record(conn, cursor, statement, parameters, context, executemany):
+    recorders = _active_recorders()
+    starts = conn.info.get("profiler_query_start")
+    if not recorders or not starts:
+        return None
+    query = {
+        "statement": statement,
+        "shape": statement_shape(statement),
+        "duration": time.perf_counter() - starts.pop(),
+        "call_site": _call_site(),
+    }
+    for recorder in recorders:
+        recorder.queries.append(query)
+
+
+@event.listens_for(Engine, "handle_error")
+def _discard_failed(exception_context):
+    connection = exception_context.connection
+    starts = connection.info.get("profiler_query_start") if connection else None
+    if starts:
+        starts.pop()
+
+
+@contextmanager
+def record_queries():
+    """
+    Context manager that records every statement executed by this thread inside its block.
+    Recorders can be nested; each sees the statements executed while it is active.
+
+    :return: QueryRecorder
+    :rtype: QueryRecorder
+    """
+
+    recorder = QueryRecorder()
+    _push_recorder(recorder)
+    try:
+        yield recorder
+    finally:
+        _pop_recorder(recorder)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """
+    Test helper that fails if its block executes more than max_queries statements.
+
+        with assert_max_queries(3):
+            client.get("/api/advice/")
+
+    :param max_queries: maximum number of statements allowed
+    :type max_queries: int
+    :raises AssertionError: listing the executed statements and their call sites
+    """
+
+    with record_queries() as recorder:
+        yield recorder
+    if recorder.count > max_queries:
+        details = "\n".join(
+            f"  {q['call_site']}: {q['shape']}" for q in recorder.queries
+        )
+        raise AssertionError(
+            f"Expected at most {max_queries} queries, executed {recorder.count}:\n{details}"
+        )
+
+
+def _start_request_profile():
+    if not current_app.config["SQL_PROFILER_ENABLED"]:
+        return None
+    g.sql_profile_start = time.perf_counter()
+    g.sql_profile = QueryRecorder()
+    _push_recorder(g.sql_profile)
+
+
+def _finish_request_profile(response):
+    recorder = g.pop("sql_profile", None)
+    if recorder is None:
+        return response
+    _pop_recorder(recorder)
+    elapsed = time.perf_counter() - g.pop("sql_profile_start")
+
+    config = current_app.config
+    threshold = config["SQL_PROFILER_NPLUSONE_THRESHOLD"]
+    repeated = recorder.repeated_shapes(threshold)
+    response.headers["X-SQL-Profile"] = recorder.summary(threshold)
+    if repeated:
+        worst = repeated[0]
+        response.headers["X-SQL-Profile-NPlusOne"] = (
+            f"{worst['count']}x at {', '.join(worst['call_sites'])}: {worst['shape'][:200]}"
+        )
+
+    if elapsed * 1000 >= config["SQL_PROFILER_SLOW_REQUEST_MS"] or repeated:
+        slowest = sorted(recorder.queries, key=lambda q: q["duration"], reverse=True)
+        current_app.logger.warning(
+            "SQL profile %s %s: %.1fms total, %s\n%s%s",
+            request.method,
+            request.path,
+            elapsed * 1000,
+            recorder.summary(threshold),
+            "".join(
+                f"  top {q['duration'] * 1000:.1f}ms {q['call_site']}: {q['shape'][:200]}\n"
+                for q in slowest[:5]
+            ),
+            "".join(
+                f"  N+1 {r['count']}x {', '.join(r['call_sites'])}: {r['shape'][:200]}\n"
+                for r in repeated
+            ),
+        )
+    return response
+
+
+def _teardown_request_profile(exception):
+    recorder = g.pop("sql_profile", None)
+    if recorder is not None:
+        _pop_recorder(recorder)
+
+
+def init_app(app) -> None:
+    """
+    Registers the request profiler. It only records when SQL_PROFILER_ENABLED is set; profiled
+    responses get an X-SQL-Profile summary header, plus X-SQL-Profile-NPlusOne when a statement
+    shape repeats SQL_PROFILER_NPLUSONE_THRESHOLD times or more. Requests slower than
+    SQL_PROFILER_SLOW_REQUEST_MS or with an N+1 pattern are logged with their worst statements.
+
+    :param app: Flask app
+    :type app: flask.Flask
+    """
+
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_teardown_request_profile)
@@ -0,0 +1,142 @@
+"""
+Asynchronous purge of deleted user accounts.
+
+Deleting an account only sets User.deleted_on, which hides the user from ORM queries at once.
+purge_deleted_users() then removes the rows that depend on the user in batches of batch_size,
+one short transaction per batch with a pause in between, so a user with millions of views never
+holds locks for long or blows a request timeout. Progress is committed with every batch in
+user_purge; a purge interrupted by a crash resumes at the step it was in. Every step only
+touches rows that are still there, so redoing part of a step is harmless.
+"""
+import datetime as dt
+import time
+from flask import current_app
+from sqlalchemy import select, tuple_
+from app import db
+from app.models import (
+    EntityComment,
+    EntityCommentLike,
+    EntityLike,
+    EntityTag,
+    EntityView,
+    User,
+    UserPurge,
+    UserRole,
+)
+
+# (step, model, nullify). Comments outlive their author, like with ON DELETE SET NULL.
+PURGE_STEPS = [
+    ("entity_view", EntityView, False),
+    ("entity_like", EntityLike, False),
+    ("entity_comment_like", EntityCommentLike, False),
+    ("entity_tag", EntityTag, False),
+    ("entity_comment", EntityComment, True),
+    ("user_role", UserRole, False),
+]
+
+
+def _purge_batch(model, user_id, batch_size, nullify=False) -> int:
+    """Deletes (or detaches) up to batch_size rows of model belonging to user_id"""
+    table = model.__table__
+    primary_key = list(table.primary_key.columns)
+    batch = select(*primary_key).where(table.c.user_id == user_id).limit(batch_size)
+    if len(primary_key) == 1:
+        in_batch = primary_key[0].in_(batch)
+    else:
+        in_batch = tuple_(*primary_key).in_(batch)
+    if nullify:
+        statement = table.update().where(in_batch).values(user_id=None)
+    else:
+        statement = table.delete().where(in_batch)
+    return db.session.execute(statement).rowcount
+
+
+def purge_user(user_id, batch_size=5000, pause=0.0, progress=None) -> int:
+    """
+    Removes the rows depending on user_id, then the user itself, resuming a previous
+    interrupted purge of the same user.
+
+    :param user_id: id of a deleted user
+    :type user_id: int
+    :param batch_size: rows deleted per transaction
+    :type batch_size: int
+    :param pause: seconds to sleep between batches, to leave room for other traffic
+    :type pause: float
+    :param progress: called with (user_id, step, rows deleted so far)
+    :type progress: function
+    :return: number of rows deleted or detached, the user row included
+    :rtype: int
+    """
+
+    job = db.session.get(UserPurge, user_id)
+    if job is None:
+        job = UserPurge(user_id=user_id, rows_deleted=0)
+        db.session.add(job)
+    elif job.finished_on:
+        return job.rows_deleted
+    steps = [step for step, _, _ in PURGE_STEPS]
+    start = steps.index(job.step) if job.step in steps else 0
+
+    for step, model, nullify in PURGE_STEPS[start:]:
+        job.step = step
+        while True:
+            purged = _purge_batch(model, user_id, batch_size, nullify=nullify)
+            job.rows_deleted += purged
+            job.updated_on = dt.datetime.now(tz=dt.timezone.utc)
+            db.session.commit()
+            if progress:
+                progress(user_id, step, job.rows_deleted)
+            if purged < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+
+    user = User.__table__
+    job.rows_deleted += db.session.execute(
+        user.delete().where(user.c.user_id == user_id, user.c.deleted_on.isnot(None))
+    ).rowcount
+    job.step = "user"
+    job.finished_on = job.updated_on = dt.datetime.now(tz=dt.timezone.utc)
+    db.session.commit()
+    if progress:
+        progress(user_id, job.step, job.rows_deleted)
+    return job.rows_deleted
+
+
+def purge_deleted_users(batch_size=None, pause=None, limit=None, progress=None) -> dict:
+    """
+    Purges deleted users, the longest deleted first. Run it from a single scheduled job.
+
+    :param batch_size: rows deleted per transaction. Defaults to USER_PURGE_BATCH_SIZE.
+    :type batch_size: int
+    :param pause: seconds between batches. Defaults to USER_PURGE_PAUSE.
+    :type pause: float
+    :param limit: purge at most this many users
+    :type limit: int
+    :param progress: called with (user_id, step, rows deleted so far)
+    :type progress: function
+    :return: rows deleted per purged user_id
+    :rtype: dict
+    """
+
+    config = current_app.config
+    if batch_size is None:
+        batch_size = config["USER_PURGE_BATCH_SIZE"]
+    if pause is None:
+        pause = config["USER_PURGE_PAUSE"]
+
+    query = (
+        User.query.execution_options(include_deleted=True)
+        .with_entities(User.user_id)
+        .filter(User.deleted_on.isnot(None))
+        .order_by(User.deleted_on, User.user_id)
+    )
+    if limit:
+        query = query.limit(limit)
+    user_ids = [user.user_id for user in query]
+    db.session.commit()
+
+    return {
+        user_id: purge_user(user_id, batch_size=batch_size, pause=pause, progress=progress)
+        for user_id in user_ids
+    }
@@ -0,0 +1,142 @@
+"""
+Role lookups without queries.
+
+Roles are a handful of rows that almost never change, so each worker keeps the whole table in
+ROLES and resolves names and ids from memory. Changes made through the ORM in this process
+invalidate it at once; changes made elsewhere are picked up after ROLE_CACHE_TTL seconds, or
+at the first lookup of a role name the registry does not know yet.
+"""
+import datetime as dt
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, select
+from app import db
+from app.models import Role, User, UserRole
+from app.utils import dialect_insert
+
+# Rows per INSERT of assign_roles, well under SQLite's limit of 32766 bound parameters
+ASSIGN_ROLES_BATCH_SIZE = 1000
+
+
+class RoleRegistry:
+    """Per-worker cache of the role table, mapping role names to role ids and back"""
+
+    def __init__(self):
+        self._ids = {}
+        self._names = {}
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        rows = db.session.execute(select(Role.role_id, Role.name)).all()
+        with self._lock:
+            self._ids = {row.name: row.role_id for row in rows}
+            self._names = {row.role_id: row.name for row in rows}
+            self._expires = time.monotonic() + current_app.config["ROLE_CACHE_TTL"]
+
+    def get_id(self, role_name):
+        """
+        Returns the id of the role named role_name.
+
+        :param role_name: role name. Example: "admin"
+        :type role_name: str
+        :return: role id, None if there is no such role
+        :rtype: int
+        """
+
+        with self._lock:
+            fresh = self._expires > time.monotonic()
+            role_id = self._ids.get(role_name)
+        if fresh and role_id is not None:
+            return role_id
+        self._load()
+        with self._lock:
+            return self._ids.get(role_name)
+
+    def names(self, role_ids) -> list:
+        """
+        Returns the names of the roles in role_ids. Unknown ids are left out.
+
+        :param role_ids: role ids
+        :type role_ids: iterable
+        :return: role names
+        :rtype: list
+        """
+
+        role_ids = list(role_ids)
+        with self._lock:
+            fresh = self._expires > time.monotonic()
+            known = all(role_id in self._names for role_id in role_ids)
+        if not (fresh and known):
+            self._load()
+        with self._lock:
+            return [self._names[role_id] for role_id in role_ids if role_id in self._names]
+
+    def invalidate(self) -> None:
+        """Forgets the cached roles, the next lookup reloads them"""
+        with self._lock:
+            self._expires = 0.0
+
+
+ROLES = RoleRegistry()
+
+
+@event.listens_for(Role, "after_insert")
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+def _invalidate_roles(mapper, connection, target) -> None:
+    ROLES.invalidate()
+
+
+def user_role_names(user) -> list:
+    """
+    Returns the names of the roles of user. Needs no query when user.role_association is
+    loaded, as it is for the authenticated user in g.user.
+
+    :param user: user
+    :type user: User
+    :return: role names
+    :rtype: list
+    """
+
+    return ROLES.names(association.role_id for association in user.role_association)
+
+
+def assign_roles(users, role_name) -> int:
+    """
+    Gives role_name to many users with one INSERT per ASSIGN_ROLES_BATCH_SIZE users, all in
+    the current transaction. Users that already have the role are skipped. Rows are not
+    committed, commit_to_db has to be called afterwards, and the role_association of users
+    already loaded in the session is not refreshed.
+
+    :param users: users or user ids
+    :type users: iterable
+    :param role_name: role name. Example: "user"
+    :type role_name: str
+    :return: number of roles assigned, None if there is no role named role_name
+    :rtype: int
+    """
+
+    role_id = ROLES.get_id(role_name)
+    if role_id is None:
+        return None
+    user_ids = {user.user_id if isinstance(user, User) else user for user in users}
+    if not user_ids:
+        return 0
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    user_ids = sorted(user_ids)
+    assigned = 0
+    for start in range(0, len(user_ids), ASSIGN_ROLES_BATCH_SIZE):
+        statement = (
+            dialect_insert(UserRole)
+            .values(
+                [
+                    {"user_id": user_id, "role_id": role_id, "created_on": now}
+                    for user_id in user_ids[start : start + ASSIGN_ROLES_BATCH_SIZE]
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "role_id"])
+        )
+        assigned += db.session.execute(statement).rowcount
+    return assigned
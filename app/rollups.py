@@ -0,0 +1,277 @@
+"""
+Daily rollups of advice and engagement.
+
+daily_rollup holds one row per UTC day, persona and tag with the advice created and the views,
+likes and comments received that day. tag_id 0 is the row of all the persona's advice, tagged
+or not, so per persona and overall figures never double count advice with several tags.
+
+Write handlers call record_rollup() inside their own transaction. It appends the counts of
+the event to daily_rollup_delta instead of updating daily_rollup, so engagement with one
+persona on one day never queues on the same row lock. fold_rollups() moves the deltas into
+daily_rollup; run `flask rollups fold` every minute or so. Reads add the deltas not folded
+yet, so they are always current. Engagement is attributed to the tags the advice has when it
+happens; tagging advice moves its "advice created" count, not its past engagement.
+rebuild_rollups() recomputes a range of days from the raw rows, e.g. nightly for the last
+days or after a bulk import, and is the reference the incremental counts converge to.
+
+Reading a period costs one row per day, persona and tag, plus the deltas not folded yet,
+instead of one per event.
+"""
+import datetime as dt
+from sqlalchemy import func, literal, select, union_all
+from app import db
+from app.models import (
+    Advice,
+    DailyRollup,
+    DailyRollupDelta,
+    EntityComment,
+    EntityLike,
+    EntityTag,
+    EntityView,
+)
+from app.utils import as_utc, dialect_insert
+
+# event kind -> counter column
+ROLLUP_COLUMNS = {
+    "advice": "advice",
+    "view": "views",
+    "like": "likes",
+    "comment": "comments",
+}
+
+# deltas folded per transaction by fold_rollups
+FOLD_BATCH_SIZE = 10000
+
+# event kind -> model whose created_on rows are counted by rebuild_rollups
+ROLLUP_MODELS = {
+    "advice": Advice,
+    "view": EntityView,
+    "like": EntityLike,
+    "comment": EntityComment,
+}
+
+
+def _day(column):
+    """SQL expression of the UTC day of a timestamp column"""
+    if db.engine.dialect.name == "postgresql":
+        return func.date(func.timezone("UTC", column))
+    # SQLite stores the UTC datetime as text
+    return func.date(column)
+
+
+def _as_date(day) -> dt.date:
+    return day if isinstance(day, dt.date) else dt.date.fromisoformat(day)
+
+
+def record_rollup(entity_id, kind, occurred_on=None, undo=False, tag_id=None) -> None:
+    """
+    Counts an event of advice entity_id in the rollup of its day, persona and tags, as rows of
+    daily_rollup_delta. Runs inside the caller's transaction, in a single INSERT.
+
+    :param entity_id: advice the event is about
+    :type entity_id: int
+    :param kind: key of ROLLUP_COLUMNS
+    :type kind: str
+    :param occurred_on: time of the event. Defaults to now.
+    :type occurred_on: datetime.datetime
+    :param undo: subtract a previously recorded event instead (e.g. unlike)
+    :type undo: bool
+    :param tag_id: only count the event in the rows of this tag, e.g. when advice is tagged.
+        By default the event is counted in the persona row and in the row of each tag of the
+        advice.
+    :type tag_id: int
+    """
+
+    column = ROLLUP_COLUMNS[kind]
+    day = as_utc(occurred_on or dt.datetime.now(tz=dt.timezone.utc)).date()
+    day = literal(day, db.Date)
+    persona_id = func.coalesce(Advice.persona_id, 0)
+    counts = [
+        literal((-1 if undo else 1) if counter == column else 0)
+        for counter in ROLLUP_COLUMNS.values()
+    ]
+
+    if tag_id is not None:
+        rows = select(day, persona_id, literal(tag_id), *counts).where(
+            Advice.entity_id == entity_id
+        )
+    else:
+        rows = union_all(
+            select(day, persona_id, literal(0), *counts).where(Advice.entity_id == entity_id),
+            select(day, persona_id, EntityTag.tag_id, *counts)
+            .join(EntityTag, EntityTag.entity_id == Advice.entity_id)
+            .where(Advice.entity_id == entity_id),
+        )
+
+    db.session.execute(
+        DailyRollupDelta.__table__.insert().from_select(
+            ["day", "persona_id", "tag_id", *ROLLUP_COLUMNS.values()], rows
+        )
+    )
+    return None
+
+
+def fold_rollups(batch_size=FOLD_BATCH_SIZE) -> int:
+    """
+    Adds the rows of daily_rollup_delta to daily_rollup and deletes them, batch_size deltas
+    per transaction. Only the deltas read are deleted, so events committed meanwhile wait for
+    the next run. Commits its own transactions.
+
+    :param batch_size: deltas folded per transaction
+    :type batch_size: int
+    :return: number of deltas folded
+    :rtype: int
+    """
+
+    columns = list(ROLLUP_COLUMNS.values())
+    folded = 0
+    while True:
+        deltas = db.session.execute(
+            select(DailyRollupDelta).order_by(DailyRollupDelta.delta_id).limit(batch_size)
+        ).scalars().all()
+        if not deltas:
+            return folded
+        sums = {}
+        for delta in deltas:
+            key = (delta.day, delta.persona_id, delta.tag_id)
+            counts = sums.setdefault(key, dict.fromkeys(columns, 0))
+            for column in columns:
+                counts[column] += getattr(delta, column)
+        # sorted, so concurrent folds lock the rollup rows in the same order
+        rows = [
+            dict(day=day, persona_id=persona_id, tag_id=tag_id, **counts)
+            for (day, persona_id, tag_id), counts in sorted(sums.items())
+        ]
+        statement = dialect_insert(DailyRollup).values(rows)
+        db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["day", "persona_id", "tag_id"],
+                set_={
+                    column: getattr(DailyRollup, column) + statement.excluded[column]
+                    for column in columns
+                },
+            )
+        )
+        db.session.execute(
+            DailyRollupDelta.__table__.delete().where(
+                DailyRollupDelta.delta_id.in_([delta.delta_id for delta in deltas])
+            )
+        )
+        db.session.commit()
+        folded += len(deltas)
+        if len(deltas) < batch_size:
+            return folded
+
+
+def _daily_counts(kind, start, end) -> list:
+    """Returns (day, persona_id, tag_id, count) of kind between start and end, per tag too"""
+    model = ROLLUP_MODELS[kind]
+    day = _day(model.created_on)
+    persona_id = func.coalesce(Advice.persona_id, 0)
+    query = select(day.label("day"), persona_id.label("persona_id"))
+    if model is not Advice:
+        query = query.join(Advice, Advice.entity_id == model.entity_id)
+    query = query.where(
+        model.created_on >= dt.datetime.combine(start, dt.time(), tzinfo=dt.timezone.utc),
+        model.created_on
+        < dt.datetime.combine(end + dt.timedelta(days=1), dt.time(), tzinfo=dt.timezone.utc),
+    )
+    totals = query.add_columns(literal(0).label("tag_id"), func.count().label("count"))
+    per_tag = query.join(EntityTag, EntityTag.entity_id == model.entity_id).add_columns(
+        EntityTag.tag_id, func.count()
+    )
+    return [
+        row
+        for statement in (
+            totals.group_by(day, persona_id),
+            per_tag.group_by(day, persona_id, EntityTag.tag_id),
+        )
+        for row in db.session.execute(statement)
+    ]
+
+
+def rebuild_rollups(start=None, end=None) -> int:
+    """
+    Recomputes the rollups of the days from start to end from the raw advice, view, like and
+    comment rows, with the tags the advice has now. Commits its own transaction.
+
+    :param start: first day. Defaults to the day of the oldest advice.
+    :type start: datetime.date
+    :param end: last day, included. Defaults to today (UTC).
+    :type end: datetime.date
+    :return: number of rollup rows written
+    :rtype: int
+    """
+
+    end = end or dt.datetime.now(tz=dt.timezone.utc).date()
+    if start is None:
+        oldest = db.session.execute(select(func.min(Advice.created_on))).scalar()
+        start = as_utc(oldest).date() if oldest else end
+
+    rollups = {}
+    for kind, column in ROLLUP_COLUMNS.items():
+        for day, persona_id, tag_id, count in _daily_counts(kind, start, end):
+            key = (_as_date(day), persona_id, tag_id)
+            rollups.setdefault(key, dict.fromkeys(ROLLUP_COLUMNS.values(), 0))[column] = count
+
+    db.session.execute(
+        DailyRollup.__table__.delete().where(DailyRollup.day >= start, DailyRollup.day <= end)
+    )
+    # the raw rows already count the events of these deltas
+    db.session.execute(
+        DailyRollupDelta.__table__.delete().where(
+            DailyRollupDelta.day >= start, DailyRollupDelta.day <= end
+        )
+    )
+    rows = [
+        dict(day=day, persona_id=persona_id, tag_id=tag_id, **counts)
+        for (day, persona_id, tag_id), counts in rollups.items()
+    ]
+    if rows:
+        db.session.execute(DailyRollup.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def get_daily_stats(start, end, persona_id=None, tag_id=None) -> list:
+    """
+    Returns the advice created, views, likes and comments of every day from start to end, read
+    from the rollups and the deltas not folded yet. Days without activity are included with
+    zeros.
+
+    :param start: first day
+    :type start: datetime.date
+    :param end: last day, included
+    :type end: datetime.date
+    :param persona_id: only count this persona's advice. Defaults to all personas.
+    :type persona_id: int
+    :param tag_id: only count advice with this tag. Defaults to all advice.
+    :type tag_id: int
+    :return: [{"day", "advice", "views", "likes", "comments"}], one per day in order
+    :rtype: list
+    """
+
+    columns = list(ROLLUP_COLUMNS.values())
+    parts = []
+    for model in (DailyRollup, DailyRollupDelta):
+        part = select(model.day, *[getattr(model, column) for column in columns]).where(
+            model.day >= start, model.day <= end, model.tag_id == (tag_id or 0)
+        )
+        if persona_id is not None:
+            part = part.where(model.persona_id == persona_id)
+        parts.append(part)
+    rows = union_all(*parts).subquery()
+    query = select(
+        rows.c.day, *[func.sum(rows.c[column]).label(column) for column in columns]
+    ).group_by(rows.c.day)
+    found = {_as_date(row.day): row for row in db.session.execute(query)}
+
+    stats = []
+    day = start
+    while day <= end:
+        row = found.get(day)
+        stats.append(
+            {"day": day, **{column: int(getattr(row, column)) if row else 0 for column in columns}}
+        )
+        day += dt.timedelta(days=1)
+    return stats
@@ -0,0 +1,194 @@
+"""
+Read replica routing.
+
+SELECTs issued while handling a GET, HEAD or OPTIONS request go to one of the replica binds of
+DATABASE_REPLICA_URIS, chosen once per request; everything else goes to the primary. A client
+reads from the primary for REPLICA_STICKY_SECONDS after its last write (a cookie), so it always
+reads its own writes. Replicas are checked at most every REPLICA_CHECK_INTERVAL seconds; a
+replica lagging more than REPLICA_MAX_LAG_SECONDS or failing is skipped until its next check,
+and when no replica is usable reads fall back to the primary.
+
+This module must not import app: RoutingSession is needed to create db itself.
+"""
+import random
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.selectable import CompoundSelect, Select
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+STICKY_COOKIE = "db_primary_until"
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs of read-only requests to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _is_read(clause, mapper):
+            router = current_app.extensions.get("replica_router")
+            engine = router.engine_for_read() if router else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_read(clause, mapper) -> bool:
+    if clause is None and mapper is not None:
+        # Query.get() style lookups pass the mapper only.
+        return True
+    return isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_to_primary(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+class ReplicaRouter:
+    """Tracks the health and lag of the replica binds and picks one for each read request"""
+
+    def __init__(self, bind_keys, max_lag, check_interval, sticky_seconds):
+        self.bind_keys = list(bind_keys)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.state = {
+            key: {"healthy": False, "lag": None, "checked_at": 0.0, "error": None}
+            for key in self.bind_keys
+        }
+        self._lock = threading.Lock()
+        self._checking = set()
+
+    def _engines(self):
+        return current_app.extensions["sqlalchemy"].engines
+
+    def check(self, key) -> None:
+        """Measures the replication lag of bind key and updates its health"""
+        engine = self._engines()[key]
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    lag = connection.execute(
+                        text(
+                            "SELECT CASE WHEN pg_is_in_recovery() THEN coalesce("
+                            "extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                            "ELSE 0 END"
+                        )
+                    ).scalar()
+                else:
+                    connection.execute(text("SELECT 1"))
+                    lag = 0.0
+            self.state[key].update(
+                healthy=float(lag) <= self.max_lag, lag=float(lag), error=None
+            )
+        except Exception as e:
+            self.state[key].update(healthy=False, error=f"{type(e).__name__}: {e}")
+            current_app.logger.warning("Replica %s unavailable: %s", key, e)
+        self.state[key]["checked_at"] = time.monotonic()
+
+    def mark_failed(self, key, error) -> None:
+        """Takes bind key out of rotation until its next check"""
+        self.state[key].update(
+            healthy=False, error=f"{type(error).__name__}: {error}", checked_at=time.monotonic()
+        )
+
+    def healthy(self) -> list:
+        """
+        Returns the bind keys of usable replicas. Stale health is refreshed by the first
+        request that notices, other requests meanwhile use the last known state.
+        """
+
+        now = time.monotonic()
+        for key in self.bind_keys:
+            if now - self.state[key]["checked_at"] < self.check_interval:
+                continue
+            with self._lock:
+                if key in self._checking:
+                    continue
+                self._checking.add(key)
+            try:
+                self.check(key)
+            finally:
+                with self._lock:
+                    self._checking.discard(key)
+        return [key for key in self.bind_keys if self.state[key]["healthy"]]
+
+    def engine_for_read(self):
+        """
+        Returns the replica engine of the current request, or None to use the primary.
+        Decided once per request and kept for its other reads, so they see one snapshot.
+        """
+
+        if not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if g.get("db_wrote"):
+            return None
+        if "db_replica" not in g:
+            g.db_replica = None
+            try:
+                sticky = float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+            except ValueError:
+                sticky = False
+            if not sticky:
+                healthy = self.healthy()
+                if healthy:
+                    g.db_replica = random.choice(healthy)
+        if g.db_replica is None:
+            return None
+        return self._engines()[g.db_replica]
+
+
+def _set_sticky_cookie(response):
+    router = current_app.extensions.get("replica_router")
+    if router and (g.get("db_wrote") or request.method not in READ_METHODS):
+        response.set_cookie(
+            STICKY_COOKIE,
+            str(time.time() + router.sticky_seconds),
+            max_age=router.sticky_seconds,
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+def init_app(app) -> None:
+    """
+    Enables routing when SQLALCHEMY_BINDS has replica binds (keys starting with "replica").
+    Must run inside an app context, after db.init_app.
+
+    :param app: Flask app
+    :type app: flask.Flask
+    """
+
+    from app.metrics.instruments import DB_READ_ROUTING
+
+    bind_keys = sorted(
+        key for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith("replica")
+    )
+    if not bind_keys:
+        return None
+    router = ReplicaRouter(
+        bind_keys,
+        max_lag=app.config["REPLICA_MAX_LAG_SECONDS"],
+        check_interval=app.config["REPLICA_CHECK_INTERVAL"],
+        sticky_seconds=app.config["REPLICA_STICKY_SECONDS"],
+    )
+    app.extensions["replica_router"] = router
+
+    engines = app.extensions["sqlalchemy"].engines
+    for key in bind_keys:
+
+        def replica_error(exception_context, key=key):
+            if exception_context.is_disconnect:
+                router.mark_failed(key, exception_context.original_exception)
+
+        event.listen(engines[key], "handle_error", replica_error)
+
+    @app.after_request
+    def route_metrics(response):
+        if request.method in READ_METHODS and "db_replica" in g:
+            DB_READ_ROUTING.inc(g.db_replica or "primary")
+        return _set_sticky_cookie(response)
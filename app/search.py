@@ -0,0 +1,204 @@
+import re
+from sqlalchemy import DDL, event, func, literal_column, select, table, union_all, and_, or_
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Advice, EntityComment, EntityTag
+
+# Postgres: expression GIN indexes, maintained by the database on every insert/update.
+TS_CONFIG = literal_column("'english'::regconfig")
+POSTGRES_SEARCH_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_advice_content_fts ON advice "
+    "USING gin (to_tsvector('english'::regconfig, content))",
+    "CREATE INDEX IF NOT EXISTS ix_entity_comment_content_fts ON entity_comment "
+    "USING gin (to_tsvector('english'::regconfig, content))",
+]
+
+# SQLite: FTS5 tables keyed by rowid and kept in sync with triggers.
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS advice_fts USING fts5(content, tokenize='porter')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entity_comment_fts "
+    "USING fts5(content, entity_id UNINDEXED, tokenize='porter')",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ai AFTER INSERT ON advice BEGIN "
+    "INSERT INTO advice_fts(rowid, content) VALUES (new.entity_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ad AFTER DELETE ON advice BEGIN "
+    "DELETE FROM advice_fts WHERE rowid = old.entity_id; END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_au AFTER UPDATE OF content ON advice BEGIN "
+    "UPDATE advice_fts SET content = new.content WHERE rowid = old.entity_id; END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ai AFTER INSERT ON entity_comment BEGIN "
+    "INSERT INTO entity_comment_fts(rowid, content, entity_id) "
+    "VALUES (new.comment_id, new.content, new.entity_id); END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ad AFTER DELETE ON entity_comment BEGIN "
+    "DELETE FROM entity_comment_fts WHERE rowid = old.comment_id; END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_au AFTER UPDATE OF content ON entity_comment BEGIN "
+    "UPDATE entity_comment_fts SET content = new.content WHERE rowid = old.comment_id; END",
+]
+SQLITE_SEARCH_DROP_DDL = [
+    "DROP TABLE IF EXISTS advice_fts",
+    "DROP TABLE IF EXISTS entity_comment_fts",
+]
+
+# Comment matches count for less than matches on the advice text itself.
+COMMENT_RANK_WEIGHT = 0.5
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(
+        db.metadata, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in SQLITE_SEARCH_DROP_DDL:
+    event.listen(db.metadata, "before_drop", DDL(statement).execute_if(dialect="sqlite"))
+
+
+def _postgres_matches(search_text):
+    """
+    Builds a subquery of (entity_id, rank) for advice whose content or comments match search_text.
+    Uses the same to_tsvector expression as the GIN indexes so Postgres can serve it from them.
+    """
+
+    tsquery = func.websearch_to_tsquery(TS_CONFIG, search_text)
+    advice_document = func.to_tsvector(TS_CONFIG, Advice.content)
+    comment_document = func.to_tsvector(TS_CONFIG, EntityComment.content)
+
+    hits = union_all(
+        select(
+            Advice.entity_id.label("entity_id"),
+            func.ts_rank(advice_document, tsquery).label("rank"),
+        ).where(advice_document.op("@@")(tsquery)),
+        select(
+            EntityComment.entity_id.label("entity_id"),
+            (func.ts_rank(comment_document, tsquery) * COMMENT_RANK_WEIGHT).label(
+                "rank"
+            ),
+        ).where(comment_document.op("@@")(tsquery)),
+    ).subquery()
+
+    return (
+        select(hits.c.entity_id, func.sum(hits.c.rank).label("rank"))
+        .group_by(hits.c.entity_id)
+        .subquery()
+    )
+
+
+def _sqlite_matches(search_text):
+    """
+    Builds a subquery of (entity_id, rank) for advice whose content or comments match search_text.
+    Words are quoted so user input can never be parsed as FTS5 query syntax.
+    """
+
+    terms = re.findall(r"\w+", search_text)
+    fts_query = " ".join(f'"{term}"' for term in terms)
+
+    advice_fts = literal_column("advice_fts")
+    comment_fts = literal_column("entity_comment_fts")
+    hits = union_all(
+        select(
+            literal_column("rowid").label("entity_id"),
+            (-func.bm25(advice_fts)).label("rank"),
+        )
+        .select_from(table("advice_fts"))
+        .where(advice_fts.op("MATCH")(fts_query)),
+        select(
+            literal_column("entity_id").label("entity_id"),
+            (-func.bm25(comment_fts) * COMMENT_RANK_WEIGHT).label("rank"),
+        )
+        .select_from(table("entity_comment_fts"))
+        .where(comment_fts.op("MATCH")(fts_query)),
+    ).subquery()
+
+    return (
+        select(hits.c.entity_id, func.sum(hits.c.rank).label("rank"))
+        .group_by(hits.c.entity_id)
+        .subquery()
+    )
+
+
+SEARCH_BACKENDS = {
+    "postgresql": _postgres_matches,
+    "sqlite": _sqlite_matches,
+}
+
+
+def encode_search_cursor(rank, entity_id) -> str:
+    """Encodes the sort key of the last returned result as an opaque keyset cursor"""
+    return f"{float(rank)!r}:{entity_id}"
+
+
+def decode_search_cursor(cursor) -> tuple:
+    """
+    Decodes a cursor produced by encode_search_cursor().
+
+    :param cursor: cursor string
+    :type cursor: str
+    :return: (rank, entity_id)
+    :rtype: tuple
+    :raises ValueError: if the cursor is malformed
+    """
+
+    rank, entity_id = cursor.rsplit(":", 1)
+    return float(rank), int(entity_id)
+
+
+def search_advice(search_text, persona_id=None, tag_id=None, after=None, limit=10) -> tuple:
+    """
+    Full-text search over advice content and the comments left on it.
+    Results are ordered by relevance and paginated with a keyset cursor on (rank, entity_id),
+    so deep pages cost the same as the first one.
+
+    :param search_text: text to search for
+    :type search_text: str
+    :param persona_id: only return advice given by this persona
+    :type persona_id: int
+    :param tag_id: only return advice tagged with this tag
+    :type tag_id: int
+    :param after: cursor returned as next_cursor by a previous call
+    :type after: str
+    :param limit: maximum number of results
+    :type limit: int
+    :return: list of (Advice, rank) tuples and the cursor for the next page (None on the last page)
+    :rtype: list, str
+    :raises NotImplementedError: if the database dialect has no search backend
+    """
+
+    dialect = db.engine.dialect.name
+    if dialect not in SEARCH_BACKENDS:
+        raise NotImplementedError(f"Full-text search is not available on {dialect}")
+    if not re.search(r"\w", search_text):
+        return [], None
+    matches = SEARCH_BACKENDS[dialect](search_text)
+
+    query = (
+        db.session.query(Advice, matches.c.rank)
+        .join(matches, matches.c.entity_id == Advice.entity_id)
+        .options(joinedload(Advice.persona))
+    )
+    if persona_id:
+        query = query.filter(Advice.persona_id == persona_id)
+    if tag_id:
+        query = query.filter(
+            Advice.entity_id.in_(
+                db.session.query(EntityTag.entity_id).filter_by(tag_id=tag_id)
+            )
+        )
+    if after:
+        after_rank, after_entity_id = decode_search_cursor(after)
+        query = query.filter(
+            or_(
+                matches.c.rank < after_rank,
+                and_(matches.c.rank == after_rank, Advice.entity_id < after_entity_id),
+            )
+        )
+
+    results = (
+        query.order_by(matches.c.rank.desc(), Advice.entity_id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        advice, rank = results[-1]
+        next_cursor = encode_search_cursor(rank, advice.entity_id)
+
+    return results, next_cursor
@@ -0,0 +1,206 @@
+"""
+Database snapshots: every table of the schema as one gzip compressed, newline delimited JSON
+stream.
+
+The first line describes the snapshot, then each table starts with a header line followed by
+one JSON array per row:
+
+    {"format": "advice-gpt-snapshot", "version": 1, "alembic_revision": "a82d4c6b19f3", ...}
+    {"table": "persona", "columns": ["persona_id", "name", "created_on"]}
+    [1, "Unknown", "2023-01-25T18:02:54.126488+00:00"]
+    ...
+
+Tables are written in foreign key dependency order, so an import can load them in file order.
+Both directions stream in batches and never hold more than one batch in memory.
+"""
+import datetime as dt
+import json
+from sqlalchemy import select
+from app import db
+from app.utils import bulk_insert, reset_sequences
+
+SNAPSHOT_FORMAT = "advice-gpt-snapshot"
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _encode(value):
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decoder(column):
+    """Returns a function converting the JSON value of column back to its Python type"""
+    python_type = None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        pass
+    if python_type is dt.datetime:
+        return lambda value: None if value is None else dt.datetime.fromisoformat(value)
+    if python_type is dt.date:
+        return lambda value: None if value is None else dt.date.fromisoformat(value)
+    return None
+
+
+def _alembic_revision(connection):
+    if not db.inspect(connection).has_table("alembic_version"):
+        return None
+    return connection.execute(db.text("SELECT version_num FROM alembic_version")).scalar()
+
+
+def export_snapshot(file, batch_size=10000, progress=None) -> dict:
+    """
+    Writes all tables to file. Rows are read with a server side cursor on Postgres, in one
+    read only REPEATABLE READ transaction, so every table comes from the same snapshot of the
+    database and rows never reference rows written after their table was exported.
+
+    :param file: text file to write the snapshot to, e.g. gzip.open(path, "wt")
+    :type file: io.TextIOBase
+    :param batch_size: rows fetched per round trip
+    :type batch_size: int
+    :param progress: called with (table name, rows written so far)
+    :type progress: function
+    :return: number of rows written per table
+    :rtype: dict
+    """
+
+    tables = db.metadata.sorted_tables
+    counts = {}
+    with db.engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            connection = connection.execution_options(
+                isolation_level="REPEATABLE READ", postgresql_readonly=True
+            )
+        transaction = connection.begin()
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "alembic_revision": _alembic_revision(connection),
+            "created_on": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            "tables": [table.name for table in tables],
+        }
+        file.write(json.dumps(header) + "\n")
+        for table in tables:
+            columns = [column.name for column in table.columns]
+            file.write(json.dumps({"table": table.name, "columns": columns}) + "\n")
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=batch_size
+            ).execute(select(table).order_by(*table.primary_key.columns))
+            counts[table.name] = 0
+            for rows in result.partitions(batch_size):
+                file.write(
+                    "".join(
+                        json.dumps(list(row), default=_encode, separators=(",", ":")) + "\n"
+                        for row in rows
+                    )
+                )
+                counts[table.name] += len(rows)
+                if progress:
+                    progress(table.name, counts[table.name])
+        transaction.commit()
+    return counts
+
+
+def _truncate(connection, tables):
+    if connection.dialect.name == "postgresql":
+        names = ", ".join(f'"{table.name}"' for table in tables)
+        connection.execute(db.text(f"TRUNCATE {names} RESTART IDENTITY CASCADE"))
+    else:
+        for table in reversed(tables):
+            connection.execute(table.delete())
+
+
+def import_snapshot(
+    file, truncate=False, disable_triggers=False, batch_size=10000, progress=None
+) -> dict:
+    """
+    Loads a snapshot written by export_snapshot in a single transaction, with bulk_insert (COPY
+    on Postgres). Tables are loaded in file order, which is foreign key dependency order.
+    Foreign key checks are deferred to commit on SQLite. On Postgres they run as rows are
+    loaded, which dependency order satisfies, and disable_triggers skips them altogether (like
+    pg_restore --disable-triggers, requires superuser). Sequences are moved past the loaded
+    ids afterwards.
+
+    :param file: text file to read the snapshot from, e.g. gzip.open(path, "rt")
+    :type file: io.TextIOBase
+    :param truncate: empty all tables of the snapshot before loading
+    :type truncate: bool
+    :param disable_triggers: Postgres only, skip foreign key and trigger checks while loading
+    :type disable_triggers: bool
+    :param batch_size: rows per insert statement
+    :type batch_size: int
+    :param progress: called with (table name, rows loaded so far)
+    :type progress: function
+    :raises SnapshotError: the file is not a snapshot of this schema
+    :return: number of rows loaded per table
+    :rtype: dict
+    """
+
+    header = json.loads(file.readline() or "{}")
+    if header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError("Not a snapshot file, or written by an incompatible version.")
+    tables = db.metadata.tables
+    unknown = [name for name in header["tables"] if name not in tables]
+    if unknown:
+        raise SnapshotError(f"Tables not in the schema: {', '.join(unknown)}")
+
+    counts = {}
+    with db.engine.begin() as connection:
+        revision = _alembic_revision(connection)
+        if header["alembic_revision"] and revision and revision != header["alembic_revision"]:
+            raise SnapshotError(
+                f"Snapshot of schema revision {header['alembic_revision']}, "
+                f"database is at {revision}. Run flask db upgrade/downgrade first."
+            )
+        if connection.dialect.name == "postgresql" and disable_triggers:
+            connection.execute(db.text("SET LOCAL session_replication_role = replica"))
+        elif connection.dialect.name == "sqlite":
+            connection.execute(db.text("PRAGMA defer_foreign_keys = ON"))
+        if truncate:
+            _truncate(connection, [tables[name] for name in header["tables"]])
+
+        table = columns = decoders = None
+        batch = []
+
+        def flush():
+            loaded = bulk_insert(connection, table, columns, batch)
+            counts[table.name] = counts.get(table.name, 0) + loaded
+            if progress:
+                progress(table.name, counts[table.name])
+            batch.clear()
+
+        for line in file:
+            record = json.loads(line)
+            if isinstance(record, list):
+                if decoders:
+                    for i, decode in decoders:
+                        record[i] = decode(record[i])
+                batch.append(tuple(record))
+                if len(batch) >= batch_size:
+                    flush()
+                continue
+            if table is not None:
+                flush()
+            table = tables[record["table"]]
+            columns = record["columns"]
+            missing = [name for name in columns if name not in table.columns]
+            if missing:
+                raise SnapshotError(
+                    f"Columns not in table {table.name}: {', '.join(missing)}"
+                )
+            decoders = [
+                (i, decode)
+                for i, decode in enumerate(_decoder(table.columns[name]) for name in columns)
+                if decode
+            ]
+            counts[table.name] = 0
+        if table is not None:
+            flush()
+
+        reset_sequences(connection, [tables[name] for name in header["tables"]])
+    return counts
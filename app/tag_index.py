@@ -0,0 +1,243 @@
+"""
+In-memory index of the advice carrying each tag, for multi-tag filters.
+
+Each worker keeps, per tag, the sorted NumPy uint32 array of the entity ids tagged with it.
+tags_all, tags_any and tags_none filters become intersections, unions and differences of those
+arrays, and only the matching ids reach the advice query, as an IN list. The index takes 4 bytes
+per row of entity_tag, whatever the number of tags or the largest entity id.
+
+The index is loaded when the app starts, updated by the tag endpoints of this worker after
+they commit, and reloaded in a background thread after TAG_INDEX_TTL seconds to pick up tags
+written by other workers or jobs. It may therefore miss those tags for up to TAG_INDEX_TTL
+seconds, which is fine for the tags_* filters but not for tagged_with_tag_id, which stays in
+SQL. A filter matching more than TAG_INDEX_MAX_IDS advice is left to SQL subqueries, as a
+huge IN list would cost more than it saves.
+"""
+import threading
+import time
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+from app.models import Advice, EntityTag
+
+NO_IDS = np.empty(0, dtype=np.uint32)
+
+# entity_tag rows fetched per round trip when loading the index
+LOAD_BATCH_SIZE = 100000
+
+
+class TagIndex:
+    """
+    Per-worker map of tag id to the sorted array of entity ids tagged with it. The arrays are
+    never modified in place, changes replace them, so readers may use them outside the lock.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._loaded = False
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._building = False
+        # changes made while a reload runs, replayed on the reloaded arrays
+        self._journal = []
+
+    def load(self) -> int:
+        """
+        Reads every tag of entity_tag and replaces the index.
+
+        :return: number of tags indexed
+        :rtype: int
+        """
+
+        with self._load_lock:
+            return self._load()
+
+    def _load(self) -> int:
+        with self._lock:
+            self._building = True
+            self._journal = []
+        try:
+            result = db.session.execute(
+                select(EntityTag.tag_id, EntityTag.entity_id)
+                .order_by(EntityTag.tag_id, EntityTag.entity_id)
+                .execution_options(yield_per=LOAD_BATCH_SIZE)
+            )
+            # streamed into arrays, LOAD_BATCH_SIZE rows at a time, not kept as Python rows
+            tag_chunks, entity_chunks = [NO_IDS], [NO_IDS]
+            for rows in result.partitions():
+                pairs = np.array(rows, dtype=np.int64)
+                tag_chunks.append(pairs[:, 0].astype(np.uint32))
+                entity_chunks.append(pairs[:, 1].astype(np.uint32))
+            tags = np.concatenate(tag_chunks)
+            # rows are sorted by tag then entity, so each tag is a run of sorted entity ids
+            starts = np.flatnonzero(np.diff(tags)) + 1
+            tag_ids = tags[np.r_[0, starts]] if len(tags) else []
+            entity_ids = np.split(np.concatenate(entity_chunks), starts)
+            index = {int(tag_id): ids for tag_id, ids in zip(tag_ids, entity_ids)}
+        except Exception:
+            with self._lock:
+                self._building = False
+            raise
+        with self._lock:
+            for tag_id, entity_id, tagged in self._journal:
+                self._apply(index, tag_id, entity_id, tagged)
+            self._ids = index
+            self._building = False
+            self._journal = []
+            self._loaded = True
+            self._expires = time.monotonic() + current_app.config["TAG_INDEX_TTL"]
+        return len(index)
+
+    def _refresh(self) -> None:
+        """
+        Reloads the index when it expired. Requests keep using the expired index while a
+        background thread reloads it, except before the first load, which they wait for.
+        """
+
+        with self._lock:
+            if self._expires > time.monotonic():
+                return None
+            loaded = self._loaded
+        if not self._load_lock.acquire(blocking=not loaded):
+            return None
+        with self._lock:
+            expired = self._expires <= time.monotonic()
+        if not expired:
+            self._load_lock.release()
+        elif not loaded:
+            try:
+                self._load()
+            finally:
+                self._load_lock.release()
+        else:
+            app = current_app._get_current_object()
+            threading.Thread(
+                target=self._reload, args=(app,), name="tag-index-reload", daemon=True
+            ).start()
+
+    def _reload(self, app) -> None:
+        # runs with _load_lock held by _refresh
+        try:
+            with app.app_context():
+                self._load()
+        except Exception:
+            app.logger.exception("Tag index reload failed")
+        finally:
+            self._load_lock.release()
+
+    @staticmethod
+    def _apply(index, tag_id, entity_id, tagged) -> None:
+        ids = index.get(tag_id, NO_IDS)
+        position = int(np.searchsorted(ids, entity_id))
+        present = position < len(ids) and ids[position] == entity_id
+        if tagged and not present:
+            index[tag_id] = np.insert(ids, position, entity_id)
+        elif present and not tagged:
+            index[tag_id] = np.delete(ids, position)
+
+    def _update(self, tag_id, entity_id, tagged) -> None:
+        with self._lock:
+            self._apply(self._ids, tag_id, entity_id, tagged)
+            if self._building:
+                self._journal.append((tag_id, entity_id, tagged))
+
+    def add(self, tag_id, entity_id) -> None:
+        """Records that entity_id was tagged with tag_id. Call after the tag is committed."""
+        self._update(tag_id, entity_id, True)
+
+    def discard(self, tag_id, entity_id) -> None:
+        """Records that tag_id was removed from entity_id. Call after the delete is committed."""
+        self._update(tag_id, entity_id, False)
+
+    @staticmethod
+    def _union(arrays) -> np.ndarray:
+        if len(arrays) <= 1:
+            return arrays[0] if arrays else NO_IDS
+        # sort and drop repeats, much faster than np.unique on large integer arrays
+        ids = np.sort(np.concatenate(arrays))
+        return ids[np.r_[True, ids[1:] != ids[:-1]]]
+
+    def match(self, tags_all=(), tags_any=(), tags_none=()):
+        """
+        Combines the entity ids of the tags: entities with every tag of tags_all, at least one
+        tag of tags_any and none of tags_none.
+
+        :param tags_all: tag ids the entities must all have
+        :type tags_all: list
+        :param tags_any: tag ids the entities must have at least one of
+        :type tags_any: list
+        :param tags_none: tag ids the entities must not have
+        :type tags_none: list
+        :return: (sorted ids, True) of the matching entities, or, with only tags_none, (sorted
+            ids, False) of the entities to exclude
+        :rtype: tuple
+        """
+
+        self._refresh()
+        with self._lock:
+            index = self._ids
+        excluded = self._union([index.get(tag_id, NO_IDS) for tag_id in set(tags_none)])
+        if not (tags_all or tags_any):
+            return excluded, False
+        matched = (
+            self._union([index.get(tag_id, NO_IDS) for tag_id in set(tags_any)])
+            if tags_any
+            else None
+        )
+        # smallest first, so every intersection is at most that size
+        for tagged in sorted((index.get(tag_id, NO_IDS) for tag_id in set(tags_all)), key=len):
+            if matched is None:
+                matched = tagged
+            else:
+                matched = np.intersect1d(matched, tagged, assume_unique=True)
+        return np.setdiff1d(matched, excluded, assume_unique=True), True
+
+
+TAG_INDEX = TagIndex()
+
+
+def _tagged_with(tag_ids):
+    return select(EntityTag.entity_id).where(EntityTag.tag_id.in_(tag_ids))
+
+
+def tag_filters(tags_all=(), tags_any=(), tags_none=()) -> list:
+    """
+    Builds the filters of an Advice query keeping advice with every tag of tags_all, at least
+    one of tags_any and none of tags_none, resolved with TAG_INDEX.
+
+    :param tags_all: tag ids the advice must all have
+    :type tags_all: list
+    :param tags_any: tag ids the advice must have at least one of
+    :type tags_any: list
+    :param tags_none: tag ids the advice must not have
+    :type tags_none: list
+    :return: filters to apply on an Advice query
+    :rtype: list
+    """
+
+    if not (tags_all or tags_any or tags_none):
+        return []
+    entity_ids, matching = TAG_INDEX.match(tags_all, tags_any, tags_none)
+    if len(entity_ids) <= current_app.config["TAG_INDEX_MAX_IDS"]:
+        entity_ids = entity_ids.tolist()
+        if matching:
+            return [Advice.entity_id.in_(entity_ids)]
+        return [Advice.entity_id.notin_(entity_ids)] if entity_ids else []
+
+    # Too many ids for an IN list, let the database intersect the tags
+    filters = []
+    if tags_all:
+        filters.append(
+            Advice.entity_id.in_(
+                _tagged_with(tags_all)
+                .group_by(EntityTag.entity_id)
+                .having(func.count(EntityTag.tag_id.distinct()) == len(set(tags_all)))
+            )
+        )
+    if tags_any:
+        filters.append(Advice.entity_id.in_(_tagged_with(tags_any)))
+    if tags_none:
+        filters.append(Advice.entity_id.notin_(_tagged_with(tags_none)))
+    return filters
@@ -0,0 +1,277 @@
+"""
+Trending advice rankings.
+
+Scores use forward decay: an engagement at time t adds weight * 2 ** ((t - epoch) / half_life)
+to the advice's score, where epoch is a fixed landmark per window. Older events are never
+touched again, yet ordering by the stored score is the same as ordering by the time-decayed
+score at any moment, so every engagement write is a single upsert and every read is a range
+scan over (time_window, score). compact_trending() periodically moves the epoch forward to keep
+scores in float range and drops advice without engagement inside the window.
+"""
+import datetime as dt
+from app import db
+from app.models import (
+    Advice,
+    EntityComment,
+    EntityLike,
+    EntityView,
+    TrendingAdvice,
+    TrendingEpoch,
+)
+from app.utils import as_utc, dialect_insert
+
+TRENDING_WINDOWS = {
+    "24h": dt.timedelta(hours=24),
+    "7d": dt.timedelta(days=7),
+}
+
+ENGAGEMENT_WEIGHTS = {
+    "view": 1.0,
+    "like": 3.0,
+    "comment": 5.0,
+}
+
+ENGAGEMENT_MODELS = {
+    "view": EntityView,
+    "like": EntityLike,
+    "comment": EntityComment,
+}
+
+# An event one full window old weighs 1/16 of a fresh one.
+HALF_LIVES_PER_WINDOW = 4
+
+# Rebase once scores have grown by 2**32; float64 overflows after 2**1024.
+REBASE_AFTER_HALF_LIVES = 32
+
+
+def half_life(time_window) -> float:
+    """Returns the half-life of time_window in seconds"""
+    return TRENDING_WINDOWS[time_window].total_seconds() / HALF_LIVES_PER_WINDOW
+
+
+def forward_decay(time_window, epoch, occurred_on) -> float:
+    """
+    Returns the growth factor 2 ** ((occurred_on - epoch) / half_life) of time_window.
+
+    :param time_window: key of TRENDING_WINDOWS
+    :type time_window: str
+    :param epoch: landmark of the window
+    :type epoch: datetime.datetime
+    :param occurred_on: time of the engagement
+    :type occurred_on: datetime.datetime
+    :return: weight multiplier
+    :rtype: float
+    """
+
+    elapsed = (as_utc(occurred_on) - as_utc(epoch)).total_seconds()
+    return 2 ** (elapsed / half_life(time_window))
+
+
+def get_epochs(lock=False) -> dict:
+    """
+    Returns the epoch of every trending window. Request paths read them without a lock; the
+    epochs are created by migration 1d6e8f3a5c27, and only compact_trending and
+    rebuild_trending lock them and create the missing ones.
+
+    :param lock: lock the epochs (FOR UPDATE) and create missing ones at the current time, used
+        when rebasing or rebuilding.
+    :type lock: bool
+    :return: {time_window: epoch}, without the windows that have no epoch yet unless lock
+    :rtype: dict
+    """
+
+    query = TrendingEpoch.query
+    if lock:
+        query = query.with_for_update()
+    epochs = {row.time_window: row.epoch for row in query}
+
+    missing = [w for w in TRENDING_WINDOWS if w not in epochs]
+    if lock and missing:
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        db.session.execute(
+            dialect_insert(TrendingEpoch)
+            .values([{"time_window": w, "epoch": now} for w in missing])
+            .on_conflict_do_nothing(index_elements=["time_window"])
+        )
+        epochs = {row.time_window: row.epoch for row in query}
+
+    return epochs
+
+
+def record_engagement(entity_id, kind, occurred_on=None, undo=False) -> None:
+    """
+    Adds an engagement event to the trending score of an entity in every window.
+    Runs inside the caller's transaction, so the score commits or rolls back with the event itself.
+    Windows without an epoch yet are skipped until compact_trending or rebuild_trending runs.
+
+    :param entity_id: entity that received the engagement
+    :type entity_id: int
+    :param kind: key of ENGAGEMENT_WEIGHTS
+    :type kind: str
+    :param occurred_on: time of the event. Defaults to now.
+    :type occurred_on: datetime.datetime
+    :param undo: subtract a previously recorded event instead (e.g. unlike)
+    :type undo: bool
+    """
+
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    occurred_on = as_utc(occurred_on) if occurred_on else now
+    epochs = get_epochs()
+
+    rows = []
+    for time_window, window_length in TRENDING_WINDOWS.items():
+        if occurred_on < now - window_length or time_window not in epochs:
+            # already decayed out of the window (see compact_trending()), or no epoch yet
+            continue
+        score = ENGAGEMENT_WEIGHTS[kind] * forward_decay(
+            time_window, epochs[time_window], occurred_on
+        )
+        rows.append(
+            {
+                "time_window": time_window,
+                "entity_id": entity_id,
+                "score": -score if undo else score,
+                "last_event_on": occurred_on,
+            }
+        )
+    if not rows:
+        return None
+
+    statement = dialect_insert(TrendingAdvice).values(rows)
+    set_ = {"score": TrendingAdvice.score + statement.excluded.score}
+    if not undo:
+        set_["last_event_on"] = statement.excluded.last_event_on
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["time_window", "entity_id"], set_=set_
+        )
+    )
+    return None
+
+
+def get_trending(time_window, limit=10) -> list:
+    """
+    Returns the top advice of time_window, highest score first.
+
+    :param time_window: key of TRENDING_WINDOWS
+    :type time_window: str
+    :param limit: number of advice to return
+    :type limit: int
+    :return: list of (Advice, current decayed score) tuples
+    :rtype: list
+    """
+
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    # The epoch is read in the same query as the scores, so both come from the same database
+    # (primary or replica) and a rebase is never seen by one and not the other.
+    rows = (
+        db.session.query(Advice, TrendingAdvice.score, TrendingEpoch.epoch)
+        .join(TrendingAdvice, TrendingAdvice.entity_id == Advice.entity_id)
+        .join(TrendingEpoch, TrendingEpoch.time_window == TrendingAdvice.time_window)
+        .filter(TrendingAdvice.time_window == time_window)
+        .order_by(TrendingAdvice.score.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        (advice, score / forward_decay(time_window, epoch, now))
+        for advice, score, epoch in rows
+    ]
+
+
+def compact_trending(now=None) -> dict:
+    """
+    Periodic maintenance for every window: rebases the epoch to now once scores have grown by
+    2**REBASE_AFTER_HALF_LIVES, and deletes advice without engagement inside the window.
+    Commits its own transaction. Engagement writers read the epoch without a lock, so one that
+    commits while a rebase runs may be scaled by the previous epoch; rebuild_trending()
+    recomputes exact scores.
+
+    :param now: current time, for testing
+    :type now: datetime.datetime
+    :return: {time_window: {"rebased": bool, "deleted": int}}
+    :rtype: dict
+    """
+
+    now = as_utc(now) if now else dt.datetime.now(tz=dt.timezone.utc)
+    epochs = get_epochs(lock=True)
+
+    summary = {}
+    for time_window, window_length in TRENDING_WINDOWS.items():
+        epoch = epochs[time_window]
+        rebased = False
+        elapsed = (now - as_utc(epoch)).total_seconds()
+        if elapsed / half_life(time_window) > REBASE_AFTER_HALF_LIVES:
+            factor = 1 / forward_decay(time_window, epoch, now)
+            TrendingAdvice.query.filter_by(time_window=time_window).update(
+                {"score": TrendingAdvice.score * factor}, synchronize_session=False
+            )
+            db.session.query(TrendingEpoch).filter_by(time_window=time_window).update(
+                {"epoch": now}, synchronize_session=False
+            )
+            rebased = True
+
+        deleted = TrendingAdvice.query.filter(
+            TrendingAdvice.time_window == time_window,
+            TrendingAdvice.last_event_on < now - window_length,
+        ).delete(synchronize_session=False)
+        summary[time_window] = {"rebased": rebased, "deleted": deleted}
+
+    db.session.commit()
+    return summary
+
+
+def rebuild_trending(batch_size=10000) -> dict:
+    """
+    Recomputes every window from the raw view, like and comment rows, e.g. after a bulk import.
+    Events are streamed and aggregated in memory per entity. Commits its own transaction.
+
+    :param batch_size: number of event rows fetched per round trip
+    :type batch_size: int
+    :return: {time_window: number of ranked entities}
+    :rtype: dict
+    """
+
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    longest = max(TRENDING_WINDOWS.values())
+    TrendingAdvice.query.delete(synchronize_session=False)
+    db.session.query(TrendingEpoch).delete(synchronize_session=False)
+    epochs = get_epochs(lock=True)
+
+    scores = {time_window: {} for time_window in TRENDING_WINDOWS}
+    for kind, model in ENGAGEMENT_MODELS.items():
+        events = (
+            db.session.query(model.entity_id, model.created_on)
+            .filter(model.created_on >= now - longest)
+            .yield_per(batch_size)
+        )
+        for entity_id, created_on in events:
+            created_on = as_utc(created_on)
+            for time_window, window_length in TRENDING_WINDOWS.items():
+                if created_on < now - window_length:
+                    continue
+                score, last_event_on = scores[time_window].get(entity_id, (0, created_on))
+                score += ENGAGEMENT_WEIGHTS[kind] * forward_decay(
+                    time_window, epochs[time_window], created_on
+                )
+                scores[time_window][entity_id] = (score, max(last_event_on, created_on))
+
+    summary = {}
+    for time_window, window_scores in scores.items():
+        rows = [
+            {
+                "time_window": time_window,
+                "entity_id": entity_id,
+                "score": score,
+                "last_event_on": last_event_on,
+            }
+            for entity_id, (score, last_event_on) in window_scores.items()
+        ]
+        for i in range(0, len(rows), batch_size):
+            db.session.execute(
+                TrendingAdvice.__table__.insert(), rows[i : i + batch_size]
+            )
+        summary[time_window] = len(rows)
+
+    db.session.commit()
+    return summary
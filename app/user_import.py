@@ -0,0 +1,371 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows are read as a stream and handled in batches. For each batch:
+- the rows are validated against the registration rules;
+- username and email uniqueness is checked in one query, against the database (deleted
+  users included) and against the other rows of the import;
+- the passwords are hashed in a process pool kept for the whole import;
+- the valid rows are inserted with bulk_insert (COPY on Postgres) and committed. If a
+  concurrent registration still takes a name, the batch is inserted row by row and the
+  conflicting rows are reported.
+Hashing dominates the cost, so throughput scales with the number of processes. Invalid rows
+are skipped and reported with their line number; they never fail the rest of the import.
+
+Imports sent to POST /api/users/import take minutes, so the request only stores the rows and
+a user_import job; IMPORT_RUNNER imports them in a background thread of the worker, hashing in
+a pool shared by the worker's imports (see hashing_executor), and records the progress and
+report in the job.
+"""
+import csv
+import datetime as dt
+import json
+import multiprocessing
+import queue
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from flask import current_app
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import User, UserImport
+from app.utils import (
+    EMAIL_PATTERN,
+    PASSWORD_PATTERN,
+    USERNAME_PATTERN,
+    USER_ATTRIBUTE_LABELS,
+    bulk_insert,
+    hash_passwords,
+    unique_violation_columns,
+)
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_COLUMNS = ("username", "email", "password")
+VALIDATION = {
+    "username": (re.compile(USERNAME_PATTERN), "Username"),
+    "email": (re.compile(EMAIL_PATTERN), "Email"),
+    "password": (re.compile(PASSWORD_PATTERN), "Password"),
+}
+
+
+def read_user_rows(file, format="csv"):
+    """
+    Yields (line number, row) from a CSV file with a header line, or from NDJSON with one
+    object per line. Lines that cannot be parsed yield the error message instead of a row.
+
+    :param file: text file to read
+    :type file: io.TextIOBase
+    :param format: "csv" or "ndjson"
+    :type format: str
+    """
+
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return None
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"ERROR: Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, "ERROR: Expected a JSON object"
+            continue
+        yield line_number, row
+
+
+def _validate(row) -> list:
+    errors = []
+    for column in IMPORT_COLUMNS:
+        pattern, label = VALIDATION[column]
+        value = row.get(column)
+        if value in (None, ""):
+            errors.append(f"ERROR: {label} attribute provided but is empty")
+        elif not isinstance(value, str) or not pattern.match(value):
+            errors.append(f"ERROR: {label} does not follow the required format")
+    return errors
+
+
+def _existing(usernames, emails) -> tuple:
+    """Returns the usernames and emails already taken, by deleted users too, in one query"""
+    user = User.__table__
+    taken = db.session.execute(
+        select(user.c.username, user.c.email).where(
+            or_(user.c.username.in_(usernames), user.c.email.in_(emails))
+        ),
+        execution_options={"include_deleted": True},
+    ).all()
+    return {row.username for row in taken}, {row.email for row in taken}
+
+
+def _conflicts(candidates) -> tuple:
+    """Splits candidates into rows whose username and email are free, and conflict errors"""
+    taken_usernames, taken_emails = _existing(
+        [row["username"] for _, row in candidates], [row["email"] for _, row in candidates]
+    )
+    valid, errors = [], []
+    for line_number, row in candidates:
+        row_errors = []
+        if row["username"] in taken_usernames:
+            row_errors.append("CONFLICT: Username already exists")
+        if row["email"] in taken_emails:
+            row_errors.append("CONFLICT: Email already exists")
+        if row_errors:
+            errors.append(
+                {"line": line_number, "username": row["username"], "errors": row_errors}
+            )
+            continue
+        # Later rows of the batch conflict with this one.
+        taken_usernames.add(row["username"])
+        taken_emails.add(row["email"])
+        valid.append((line_number, row))
+    return valid, errors
+
+
+def _insert_rows(rows, hashes, now) -> tuple:
+    """
+    Inserts rows one at a time, each in its own savepoint, and commits. Returns (created,
+    errors) where errors are the rows that conflict with existing users.
+    """
+
+    created, errors = 0, []
+    for line_number, row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(
+                    User.__table__.insert().values(
+                        username=row["username"],
+                        email=row["email"],
+                        password_hash=hashes[line_number],
+                        created_on=now,
+                    )
+                )
+        except IntegrityError as e:
+            violated = unique_violation_columns(e, ["username", "email"])
+            errors.append(
+                {
+                    "line": line_number,
+                    "username": row["username"],
+                    "errors": [
+                        f"CONFLICT: {USER_ATTRIBUTE_LABELS[column]} already exists"
+                        for column in violated
+                    ]
+                    or [f"ERROR: {e.orig}"],
+                }
+            )
+            continue
+        created += 1
+    db.session.commit()
+    return created, errors
+
+
+def _import_batch(batch, executor) -> tuple:
+    """Imports one batch of (line number, row). Returns (created, errors)."""
+    errors = []
+    candidates = []
+    for line_number, row in batch:
+        if isinstance(row, str):
+            errors.append({"line": line_number, "errors": [row]})
+            continue
+        row_errors = _validate(row)
+        if row_errors:
+            errors.append(
+                {"line": line_number, "username": row.get("username"), "errors": row_errors}
+            )
+        else:
+            candidates.append((line_number, row))
+
+    hashes = {}
+    for attempt in range(2):
+        valid, conflicts = _conflicts(candidates)
+        missing = [(n, row) for n, row in valid if n not in hashes]
+        hashes.update(
+            zip(
+                [n for n, _ in missing],
+                hash_passwords([row["password"] for _, row in missing], executor=executor),
+            )
+        )
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        try:
+            created = bulk_insert(
+                db.session.connection(),
+                User.__table__,
+                ["username", "email", "password_hash", "created_on"],
+                [
+                    (row["username"], row["email"], hashes[line_number], now)
+                    for line_number, row in valid
+                ],
+            )
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent registration took a name after the check: check again, once,
+            # then insert row by row to skip the rows that still conflict.
+            db.session.rollback()
+            if attempt:
+                created, insert_conflicts = _insert_rows(valid, hashes, now)
+                return created, errors + conflicts + insert_conflicts
+            continue
+        return created, errors + conflicts
+
+
+def import_users(rows, batch_size=1000, processes=None, progress=None, executor=None) -> dict:
+    """
+    Creates users from rows in batches, skipping and reporting invalid rows.
+
+    :param rows: (line number, row) pairs, e.g. from read_user_rows. A row is a dict with
+        username, email and password, or the error message of a line that could not be read.
+    :type rows: iterable
+    :param batch_size: rows per uniqueness query, insert and commit
+    :type batch_size: int
+    :param processes: hashing processes. Defaults to the number of CPUs.
+    :type processes: int
+    :param progress: called with (rows read, users created) after every batch
+    :type progress: function
+    :param executor: hashing pool to use instead of starting one for this import
+    :type executor: concurrent.futures.ProcessPoolExecutor
+    :return: {"created": int, "failed": int, "errors": [{"line", "username", "errors"}]}
+    :rtype: dict
+    """
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return import_users(rows, batch_size, progress=progress, executor=executor)
+
+    rows = iter(rows)
+    report = {"created": 0, "failed": 0, "errors": []}
+    read = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        read += len(batch)
+        created, errors = _import_batch(batch, executor)
+        report["created"] += created
+        report["failed"] += len(errors)
+        report["errors"].extend(errors)
+        if progress:
+            progress(read, report["created"])
+    report["errors"].sort(key=lambda error: error["line"])
+    return report
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hashing_executor(processes=None) -> ProcessPoolExecutor:
+    """
+    Returns the hashing pool of this worker, started on first use and shared by its imports.
+    Its processes are started by a forkserver (spawn where there is none), never forked from
+    the web worker with its threads and open database connections.
+
+    :param processes: pool size. Defaults to the number of CPUs.
+    :type processes: int
+    :return: process pool
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["werkzeug.security"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+        return _executor
+
+
+def run_import(import_id, rows) -> None:
+    """
+    Runs the user_import job import_id on rows and records its progress and report.
+
+    :param import_id: job to run
+    :type import_id: int
+    :param rows: (line number, row) pairs read from the request
+    :type rows: list
+    """
+
+    config = current_app.config
+    job = db.session.get(UserImport, import_id)
+    job.status = "running"
+    job.updated_on = dt.datetime.now(tz=dt.timezone.utc)
+    db.session.commit()
+
+    def progress(read, created):
+        job.rows_read, job.created = read, created
+        job.updated_on = dt.datetime.now(tz=dt.timezone.utc)
+        db.session.commit()
+
+    try:
+        report = import_users(
+            rows,
+            batch_size=config["USER_IMPORT_BATCH_SIZE"],
+            progress=progress,
+            executor=hashing_executor(config["USER_IMPORT_PROCESSES"]),
+        )
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("User import %s failed", import_id)
+        job = db.session.get(UserImport, import_id)
+        job.status, job.message = "failed", f"{type(e).__name__}: {e}"
+    else:
+        job.status = "finished"
+        job.rows_read = len(rows)
+        job.created, job.failed, job.errors = (
+            report["created"],
+            report["failed"],
+            report["errors"],
+        )
+    job.updated_on = job.finished_on = dt.datetime.now(tz=dt.timezone.utc)
+    db.session.commit()
+
+
+class ImportRunner:
+    """
+    Background thread of a worker that runs the imports it is given, one at a time. Jobs
+    queued in a worker that stops are left queued or running in user_import.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._thread = None
+
+    def submit(self, import_id, rows) -> None:
+        """
+        Queues the user_import job import_id. Starts the thread on first use.
+
+        :param import_id: committed user_import job
+        :type import_id: int
+        :param rows: (line number, row) pairs to import
+        :type rows: list
+        """
+
+        app = current_app._get_current_object()
+        self._jobs.put((import_id, rows))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, args=(app,), name="user-importer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self, app):
+        while True:
+            import_id, rows = self._jobs.get()
+            with app.app_context():
+                try:
+                    run_import(import_id, rows)
+                except Exception:
+                    app.logger.exception("User import %s failed", import_id)
+
+
+IMPORT_RUNNER = ImportRunner()
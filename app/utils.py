@@ -1,8 +1,24 @@
 import flask_restx
-from app.models import User, Entity, Advice
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Entity, Advice
+from app.metrics.instruments import timed_upstream, UPSTREAM_ERRORS
 import datetime as dt
+import csv
+import io
+import os
+import re
 import requests
 
+# Validation patterns of user attributes, shared by the API models and bulk imports.
+USERNAME_PATTERN = "^[A-Za-z][A-Za-z0-9_-]{2,15}$"
+EMAIL_PATTERN = "^[a-zA-Z0-9.!#$%&’*+\\/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\\.[a-zA-Z0-9-]+)*$"
+PASSWORD_PATTERN = "^(?=.*[A-Za-z])(?=.*\\d)(?=.*[@$!%*#?&])[A-Za-z\\d@$!%*#?&]{8,20}$"
+# Labels of user attributes in validation messages, in the order the messages are listed.
+USER_ATTRIBUTE_LABELS = {"username": "Username", "password": "Password", "email": "Email"}
+
 def create_from_entity(type, **kwargs) -> object:
     '''
     Creates an Entity dependent object. These objects are not committed so they have to be saved manually.
@@ -52,31 +68,41 @@ def get_adviceslip_by_id(adviceslip_id) -> tuple:
             }
         }
 
+    The API base url and timeout are read from ADVICESLIP_API_BASE and ADVICESLIP_TIMEOUT. Timeouts,
+    connection errors, error statuses and malformed bodies are returned as a failed outcome.
+
     :param id: The id of the advice slip.
     :type id: int
     :return: request outcome, content 
     :rtype: bool, string
     '''
 
-    url = f'https://api.adviceslip.com/advice/{adviceslip_id}'
-
-    response = requests.get(url)
+    url = f"{current_app.config['ADVICESLIP_API_BASE']}/advice/{adviceslip_id}"
 
-    if "slip" in response.json():
-        return True, response.json()['slip']['advice']
+    try:
+        with timed_upstream("adviceslip"):
+            response = requests.get(url, timeout=current_app.config['ADVICESLIP_TIMEOUT'])
+            response.raise_for_status()
+            slip = response.json()
+    except (requests.RequestException, ValueError) as e:
+        return False, f"{type(e).__name__}: {e}"
+
+    if "slip" in slip:
+        return True, slip['slip']['advice']
     else:
-        return False, response.json()['text']
+        UPSTREAM_ERRORS.inc("adviceslip", "NotFound")
+        return False, slip['message']['text']
 
 
-def user_attr_unique_notempty_check(attributes_to_check, user_to_update=None) -> tuple:
+def user_attr_notempty_check(attributes_to_check) -> tuple:
     """
-    description
+    Checks that the user attributes provided are not empty. Uniqueness is left to the unique
+    indexes on username and email: write first, then translate an IntegrityError with
+    user_conflict_check.
 
     :param attributes_to_check: dictionary of attributes to in User Object
     :type attributes_to_check: dict
-    :param user: required for update check otherwise function will always return False.
-    :type user: User
-    :return: tuple with status, status code and a message. If there is an error, the tuple will be (False, msg)
+    :return: tuple with status, status code and a message. If there is an error, the tuple will be (False, status_code, msg)
     :rtype: tuple
     """
 
@@ -84,60 +110,77 @@ def user_attr_unique_notempty_check(attributes_to_check, user_to_update=None) ->
     status_code = 200
     msg = []
 
-    if user_to_update:
-        username_to_update = user_to_update.username
-        email_to_update = user_to_update.email
-    else:
-        username_to_update = None
-        email_to_update = None
-
-    empty_checks = [None, ""]
-
-    if "username" in attributes_to_check.keys():
-        new_username = attributes_to_check["username"]
-        if new_username in empty_checks:
-            msg.append("ERROR: Username attribute provided but is empty")
-            status = False
-            status_code = 409
-        elif User.query.filter(
-            User.username == new_username, User.username != username_to_update
-        ).first():
-            msg.append("CONFLICT: Username already exists")
+    for attribute, label in USER_ATTRIBUTE_LABELS.items():
+        if attribute not in attributes_to_check.keys():
+            continue
+        if attributes_to_check[attribute] in [None, ""]:
+            msg.append(f"ERROR: {label} attribute provided but is empty")
             status = False
             status_code = 409
         else:
-            msg.append("Username is valid for update/create")
-    else:
-        pass
+            msg.append(f"{label} is valid for update/create")
 
-    if "password" in attributes_to_check.keys():
-        new_password = attributes_to_check["password"]
-        if new_password in empty_checks:
-            msg.append("ERROR: Password attribute provided but is empty")
-            status = False
-            status_code = 409
-        else:
-            msg.append("Password is valid for update/create")
+    return status, status_code, msg
 
-    if "email" in attributes_to_check.keys():
-        new_email = attributes_to_check["email"]
-        if new_email in empty_checks:
-            msg.append("ERROR: Email attribute provided but is empty")
-            status = False
-            status_code = 409
-        elif User.query.filter(
-            User.email == new_email, User.email != email_to_update
-        ).first():
-            msg.append("CONFLICT: Email already exists")
-            status = False
-            status_code = 409
-        else:
-            msg.append("Email is valid for update/create")
-    else:
-        pass
 
-    # If all checks pass, return success
-    return status, status_code, msg
+def unique_violation_columns(error, columns) -> list:
+    """
+    Finds which of columns a unique constraint violation is about. Postgres names the
+    constraint (ix_user_username) and the key ("Key (username)=..."), SQLite the column
+    ("UNIQUE constraint failed: user.username").
+
+    :param error: error raised by the INSERT or UPDATE
+    :type error: sqlalchemy.exc.IntegrityError
+    :param columns: candidate column names
+    :type columns: list
+    :return: the violated columns, empty if the error is not a unique violation on them
+    :rtype: list
+    """
+
+    orig = getattr(error, "orig", error)
+    diag = getattr(orig, "diag", None)
+    constraint = getattr(diag, "constraint_name", None) or ""
+    text = str(orig)
+    violated = []
+    for column in columns:
+        if (
+            constraint.endswith(f"_{column}")
+            or f"({column})=" in text
+            or re.search(rf"UNIQUE constraint failed: [^\n]*\.{column}\b", text)
+        ):
+            violated.append(column)
+    return violated
+
+
+def user_conflict_check(error, attributes) -> tuple:
+    """
+    Translates the IntegrityError of a user INSERT or UPDATE into the 409 of a username or
+    email that already exists. The session must have been rolled back (commit_to_db does).
+
+    :param error: error returned by commit_to_db
+    :type error: Exception
+    :param attributes: attributes that were written, as checked by user_attr_notempty_check
+    :type attributes: dict
+    :return: tuple with status, status code and a message, like user_attr_notempty_check.
+        (True, 200, []) if the error is not a username or email conflict.
+    :rtype: tuple
+    """
+
+    if not isinstance(error, IntegrityError):
+        return True, 200, []
+    violated = unique_violation_columns(error, ["username", "email"])
+    if not violated:
+        return True, 200, []
+
+    msg = []
+    for attribute, label in USER_ATTRIBUTE_LABELS.items():
+        if attribute not in attributes.keys():
+            continue
+        if attribute in violated:
+            msg.append(f"CONFLICT: {label} already exists")
+        else:
+            msg.append(f"{label} is valid for update/create")
+    return False, 409, msg
 
 
 def commit_to_db(db) -> tuple:
@@ -209,3 +252,144 @@ def validate_date_format(str_date) -> bool:
         return True
     except ValueError:
         return False
+
+
+def dialect_insert(table):
+    """
+    Returns an INSERT construct for the current database that supports ON CONFLICT clauses
+    (on_conflict_do_update / on_conflict_do_nothing). Postgres and SQLite share the same API.
+
+    :param table: table or model to insert into
+    :type table: sqlalchemy.Table or db.Model
+    :return: dialect specific insert statement
+    :rtype: sqlalchemy.sql.dml.Insert
+    """
+
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def as_utc(datetime) -> dt.datetime:
+    """
+    Returns datetime as a timezone aware UTC datetime.
+    SQLite returns naive datetimes for DateTime(timezone=True) columns; those are assumed to be UTC.
+
+    :param datetime: datetime to convert
+    :type datetime: datetime.datetime
+    :return: aware datetime in UTC
+    :rtype: datetime.datetime
+    """
+
+    if datetime.tzinfo is None:
+        return datetime.replace(tzinfo=dt.timezone.utc)
+    return datetime.astimezone(dt.timezone.utc)
+
+
+def parse_id_list(str_ids) -> list:
+    """
+    Parses a comma separated list of ids from a query string argument. Example: "1,2,3"
+
+    :param str_ids: comma separated ids, or None
+    :type str_ids: str
+    :return: list of ids, empty if str_ids is None or empty
+    :rtype: list
+    :raises ValueError: if an element is not an integer
+    """
+
+    if not str_ids:
+        return []
+    return [int(i) for i in str_ids.split(",") if i.strip()]
+
+
+def hash_passwords(passwords, processes=None, executor=None) -> list:
+    """
+    Hashes passwords with generate_password_hash in a pool of worker processes.
+    Hashing is deliberately slow (PBKDF2) and CPU bound, so threads would not help.
+
+    :param passwords: plain text passwords
+    :type passwords: list
+    :param processes: number of worker processes. Defaults to the number of CPUs.
+    :type processes: int
+    :param executor: pool to reuse across calls instead of starting one per call
+    :type executor: concurrent.futures.ProcessPoolExecutor
+    :return: password hashes, in the order of passwords
+    :rtype: list
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+    from werkzeug.security import generate_password_hash
+
+    if len(passwords) < 2 or processes == 1:
+        return [generate_password_hash(password) for password in passwords]
+    workers = processes or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+    chunksize = max(1, len(passwords) // (workers * 4))
+    if executor is not None:
+        return list(executor.map(generate_password_hash, passwords, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+def bulk_insert(connection, table, columns, rows) -> int:
+    """
+    Loads rows into table in a single statement: COPY on Postgres, a multi-row executemany
+    elsewhere. Bypasses the ORM, so Python side defaults and events do not run.
+
+    :param connection: connection to load with. The caller owns the transaction.
+    :type connection: sqlalchemy.engine.Connection
+    :param table: table to load
+    :type table: sqlalchemy.Table
+    :param columns: names of the columns in each row
+    :type columns: list
+    :param rows: tuples of column values
+    :type rows: list
+    :return: number of rows loaded
+    :rtype: int
+    """
+
+    if not rows:
+        return 0
+    if connection.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        # Strings are quoted, so "" is an empty string and an unquoted empty field is NULL.
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer
+            )
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+    return len(rows)
+
+
+def reset_sequences(connection, tables) -> None:
+    """
+    Moves the Postgres sequence of each table's integer primary key past its largest value,
+    after rows were loaded with explicit ids. Does nothing on other databases.
+
+    :param connection: connection to use
+    :type connection: sqlalchemy.engine.Connection
+    :param tables: tables that were loaded
+    :type tables: list
+    """
+
+    if connection.dialect.name != "postgresql":
+        return None
+    for table in tables:
+        for column in table.primary_key.columns:
+            if column.autoincrement is False or not isinstance(column.type, db.Integer):
+                continue
+            sequence = connection.execute(
+                db.text("SELECT pg_get_serial_sequence(:table, :column)"),
+                {"table": f'"{table.name}"', "column": column.name},
+            ).scalar()
+            if sequence:
+                connection.execute(
+                    db.text(
+                        f'SELECT setval(:sequence, coalesce((SELECT max("{column.name}") '
+                        f'FROM "{table.name}"), 0) + 1, false)'
+                    ),
+                    {"sequence": sequence},
+                )
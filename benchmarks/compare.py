@@ -0,0 +1,94 @@
+"""
+Compares two benchmarks.run reports and flags routes whose latency or throughput regressed.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Exits with status 1 when a regression above --threshold percent is found.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def load(path) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {(r["size"], r["route"]): r for r in report["results"]}
+
+
+def change(before, after):
+    """Percent change from before to after, None when either side is missing"""
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline, candidate, threshold) -> list:
+    """
+    :return: one row per (size, route) present in both reports, with percent changes and
+        the list of metrics that regressed by more than threshold percent
+    :rtype: list
+    """
+
+    rows = []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key], candidate[key]
+        changes = {m: change(before[m], after[m]) for m in LATENCY_METRICS}
+        changes["throughput_rps"] = change(before["throughput_rps"], after["throughput_rps"])
+        regressions = [
+            m for m in LATENCY_METRICS if changes[m] is not None and changes[m] > threshold
+        ]
+        if changes["throughput_rps"] is not None and changes["throughput_rps"] < -threshold:
+            regressions.append("throughput_rps")
+        if after["errors"] > before["errors"]:
+            regressions.append("errors")
+        rows.append(
+            {"size": key[0], "route": key[1], "changes": changes, "regressions": regressions}
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Percent change of p50/p95/p99 or throughput counted as a regression.",
+    )
+    args = parser.parse_args(argv)
+
+    baseline_meta, baseline = load(args.baseline)
+    candidate_meta, candidate = load(args.candidate)
+    for field in ("database", "requests", "concurrency", "upstream_latency_ms"):
+        if baseline_meta.get(field) != candidate_meta.get(field):
+            print(
+                f"warning: {field} differs ({baseline_meta.get(field)} vs "
+                f"{candidate_meta.get(field)}), results may not be comparable",
+                file=sys.stderr,
+            )
+
+    fmt = lambda value: "     n/a" if value is None else f"{value:+7.1f}%"
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{'size':>7}  {'route':<34} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8}")
+    for row in rows:
+        c = row["changes"]
+        flag = "  REGRESSION: " + ", ".join(row["regressions"]) if row["regressions"] else ""
+        print(
+            f"{row['size']:>7}  {row['route']:<34} {fmt(c['p50_ms'])} {fmt(c['p95_ms'])} "
+            f"{fmt(c['p99_ms'])} {fmt(c['throughput_rps'])}{flag}"
+        )
+
+    missing = sorted(baseline.keys() ^ candidate.keys())
+    for size, route in missing:
+        print(f"{size:>7}  {route:<34} only in one report", file=sys.stderr)
+
+    return 1 if any(row["regressions"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,590 @@
+"""
+Endpoint benchmarks with stubbed upstreams.
+
+Boots create_app() against a throwaway SQLite file (default) or the database given with
+--database-uri, seeds a synthetic dataset for each --sizes value, and measures throughput and
+p50/p95/p99 latency of every route in app/api/advice.py, users.py and auth.py through the Flask
+test client. openai.Completion.create and get_adviceslip_by_id are replaced by local stubs, so
+no network access is needed. With --upstream-url the app calls the simulated upstreams of
+benchmarks/upstreams.py instead, to measure the generation path under injected faults.
+
+    python -m benchmarks.run --sizes 100,1000 --requests 200 --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+
+WARNING: the target database is dropped and recreated for every dataset size.
+"""
+import argparse
+import base64
+import contextlib
+import datetime as dt
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD = "a234567!"
+# Comment ids handed out on SQLite, above the ids of the seeded comments.
+COMMENT_IDS = itertools.count(1_000_000_000)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-uri",
+        help="SQLAlchemy URI of the benchmark database. Defaults to a temporary SQLite file.",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="100,1000",
+        help="Comma separated number of advice rows to seed, one run per size.",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Measured requests per route."
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="Unmeasured requests per route."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Client threads per route."
+    )
+    parser.add_argument(
+        "--routes", help="Comma separated substrings; only matching routes run."
+    )
+    parser.add_argument(
+        "--upstream-latency-ms",
+        type=float,
+        default=0.0,
+        help="Simulated latency of the stubbed OpenAI and Advice Slip calls.",
+    )
+    parser.add_argument(
+        "--upstream-url",
+        help="Send upstream calls to this simulator (python -m benchmarks.upstreams) "
+        "instead of the in-process stubs.",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    parser.add_argument("--output", default="-", help="JSON output file, - for stdout.")
+    return parser.parse_args(argv)
+
+
+def configure_environment(database_uri, upstream_url):
+    """config.py reads the environment at import, so it has to be set before importing app"""
+    os.environ.setdefault("APP_ENVIRONMENT", "DEV")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["DATABASE_URI"] = database_uri
+    if upstream_url:
+        os.environ["UPSTREAM_SIMULATOR_URL"] = upstream_url
+        os.environ.setdefault("OPENAI_API_KEY", "simulator")
+        os.environ.setdefault("OPENAI_FINETUNED_MODEL", "simulator")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_config(database_uri):
+    from config import Config
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        GENERATION_MAX_CONCURRENCY = 1024
+        GENERATION_MAX_CONCURRENCY_PER_USER = 1024
+        GENERATION_MAX_QUEUE = 1024
+
+    return BenchmarkConfig
+
+
+def allow_sqlite_comments():
+    """
+    SQLite cannot autoincrement a column of a composite primary key, which entity_comment
+    uses. Assign comment ids in Python when benchmarking against SQLite.
+    """
+
+    from sqlalchemy import event
+    from app.models import EntityComment
+
+    EntityComment.__table__.c.comment_id.autoincrement = False
+
+    @event.listens_for(EntityComment, "before_insert")
+    def assign_comment_id(mapper, connection, target):
+        if target.comment_id is None:
+            target.comment_id = next(COMMENT_IDS)
+
+
+def install_stubs(latency):
+    """Replaces the external API calls with local stubs that sleep latency seconds"""
+
+    import openai
+    import app.api.advice
+
+    def completion_create(**kwargs):
+        time.sleep(latency)
+        text = f"{kwargs.get('prompt', '').rstrip(':')} (as told by a benchmark persona)"
+        return {
+            "choices": [{"text": text}],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 20, "total_tokens": 40},
+        }
+
+    def get_adviceslip_by_id(adviceslip_id):
+        time.sleep(latency)
+        return True, f"Benchmark advice slip {adviceslip_id}."
+
+    openai.Completion.create = completion_create
+    app.api.advice.get_adviceslip_by_id = get_adviceslip_by_id
+
+
+def seed_dataset(db, size, rng):
+    """
+    Recreates the schema and bulk inserts a dataset with size advice rows.
+    Every user shares one password hash, so seeding does not spend minutes in PBKDF2.
+
+    :return: dataset description used to build requests
+    :rtype: dict
+    """
+
+    from werkzeug.security import generate_password_hash
+    from app.models import (
+        Advice,
+        Entity,
+        EntityComment,
+        EntityLike,
+        EntityTag,
+        EntityView,
+        Persona,
+        Tag,
+        User,
+    )
+
+    db.drop_all()
+    db.create_all()
+    now = dt.datetime.now(tz=dt.timezone.utc)
+
+    # Persona "Unknown" must be persona_id 1, app.api.advice cached its id at import.
+    personas = ["Unknown", "Yoda", "Pirate", "Shakespeare", "Coach"]
+    n_users = max(10, size // 10)
+    n_tags = 20
+    password_hash = generate_password_hash(PASSWORD)
+
+    def insert(model, rows):
+        for i in range(0, len(rows), 5000):
+            db.session.execute(model.__table__.insert(), rows[i : i + 5000])
+
+    insert(Persona, [{"persona_id": i + 1, "name": n, "created_on": now} for i, n in enumerate(personas)])
+    insert(Tag, [{"tag_id": i, "name": f"tag{i}", "created_on": now} for i in range(1, n_tags + 1)])
+    insert(
+        User,
+        [
+            {
+                "user_id": i,
+                "username": f"user{i}",
+                "email": f"user{i}@example.com",
+                "password_hash": password_hash,
+                "created_on": now,
+            }
+            for i in range(1, n_users + 1)
+        ],
+    )
+    insert(Entity, [{"entity_id": i, "type": "advice", "created_on": now} for i in range(1, size + 1)])
+    insert(
+        Advice,
+        [
+            {
+                "entity_id": i,
+                "persona_id": rng.randint(1, len(personas)),
+                "content": f"Benchmark advice {i}: {rng.choice(['save', 'smile', 'rest', 'learn'])} more often.",
+                "adviceslip_id": rng.randint(1, 224),
+                "created_on": now - dt.timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            }
+            for i in range(1, size + 1)
+        ],
+    )
+
+    pairs = {(rng.randint(1, n_users), rng.randint(1, size)) for _ in range(size * 3)}
+    insert(EntityView, [{"user_id": u, "entity_id": e, "created_on": now} for u, e in pairs])
+    liked = [p for p in pairs if rng.random() < 0.3]
+    insert(EntityLike, [{"user_id": u, "entity_id": e, "created_on": now} for u, e in liked])
+    insert(
+        EntityComment,
+        [
+            {"comment_id": i, "user_id": u, "entity_id": e, "content": f"comment {i}", "created_on": now}
+            for i, (u, e) in enumerate(liked[: size // 2], start=1)
+        ],
+    )
+    tagged = {(rng.randint(1, n_tags), rng.randint(1, size)) for _ in range(size)}
+    insert(
+        EntityTag,
+        [{"tag_id": t, "entity_id": e, "user_id": rng.randint(1, n_users), "created_on": now} for t, e in tagged],
+    )
+    db.session.commit()
+
+    if db.engine.dialect.name == "postgresql":
+        for table, column in [("user", "user_id"), ("entity", "entity_id"), ("persona", "persona_id"),
+                              ("tag", "tag_id"), ("entity_comment", "comment_id")]:
+            db.session.execute(
+                db.text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', '{column}'), "
+                    f"(SELECT max({column}) FROM \"{table}\"))"
+                )
+            )
+        db.session.commit()
+
+    return {
+        "size": size,
+        "users": n_users,
+        "tags": n_tags,
+        "personas": len(personas),
+        "new_users": itertools.count(1),
+        "lock": threading.Lock(),
+    }
+
+
+def basic_auth(username):
+    token = base64.b64encode(f"{username}:{PASSWORD}".encode()).decode()
+    return {"Authorization": f"Basic {token}"}
+
+
+class Route:
+    """
+    A benchmarked route. request(client, data, rng) sends one request; prepare(app, data, n)
+    optionally creates, outside of the measurement, the n objects a destructive route consumes.
+    """
+
+    def __init__(self, name, request, prepare=None, expected=(200, 201)):
+        self.name = name
+        self.request = request
+        self.prepare = prepare
+        self.expected = expected
+
+
+def create_user(client, data):
+    with data["lock"]:
+        i = next(data["new_users"])
+    return client.post(
+        "/api/users/",
+        json={"username": f"new{i}", "email": f"new{i}@example.com", "password": PASSWORD},
+    )
+
+
+def next_ids(app, n, *columns):
+    """
+    Returns n ids above the current maximum of columns. Routes under test insert rows too, and
+    without enforced foreign keys (SQLite) deleted entities can leave advice rows behind.
+    """
+    from app import db
+
+    with app.app_context():
+        start = max(db.session.query(db.func.max(c)).scalar() or 0 for c in columns)
+    return list(range(start + 1, start + n + 1))
+
+
+def build_routes():
+    """Returns the benchmark scenario of every route in advice.py, users.py and auth.py"""
+
+    def unique_pair(data, rng):
+        # Likes and views are unique per (user, entity): use a fresh user for each request.
+        return create_user_id(data), rng.randint(1, data["size"])
+
+    def create_user_id(data):
+        with data["lock"]:
+            return next(data["fresh_users"])
+
+    def prepare_fresh_users(app, data, n):
+        from app import db
+        from app.models import User
+        from werkzeug.security import generate_password_hash
+
+        password_hash = generate_password_hash(PASSWORD)
+        ids = next_ids(app, n, User.user_id)
+        with app.app_context():
+            db.session.execute(
+                User.__table__.insert(),
+                [
+                    {"user_id": i, "username": f"bench{i}", "email": f"bench{i}@example.com",
+                     "password_hash": password_hash}
+                    for i in ids
+                ],
+            )
+            db.session.commit()
+        data["fresh_users"] = iter(ids)
+
+    def prepare_fresh_advice(app, data, n):
+        from app import db
+        from app.models import Advice, Entity
+
+        ids = next_ids(app, n, Entity.entity_id, Advice.entity_id)
+        with app.app_context():
+            db.session.execute(Entity.__table__.insert(), [{"entity_id": i, "type": "advice"} for i in ids])
+            db.session.execute(
+                Advice.__table__.insert(),
+                [{"entity_id": i, "persona_id": 1, "content": f"disposable {i}", "adviceslip_id": 1} for i in ids],
+            )
+            db.session.commit()
+        data["fresh_advice"] = iter(ids)
+
+    def prepare_likes(app, data, n):
+        from app import db
+        from app.models import EntityLike
+
+        prepare_fresh_users(app, data, n)
+        ids = list(data["fresh_users"])
+        with app.app_context():
+            db.session.execute(
+                EntityLike.__table__.insert(),
+                [{"user_id": i, "entity_id": 1, "created_on": dt.datetime.now(tz=dt.timezone.utc)} for i in ids],
+            )
+            db.session.commit()
+        data["fresh_users"] = iter(ids)
+
+    def prepare_comments(app, data, n):
+        from app import db
+        from app.models import EntityComment
+
+        ids = [next(COMMENT_IDS) for _ in range(n)]
+        with app.app_context():
+            db.session.execute(
+                EntityComment.__table__.insert(),
+                [{"comment_id": i, "entity_id": 1, "user_id": 1, "content": "disposable",
+                  "created_on": dt.datetime.now(tz=dt.timezone.utc)} for i in ids],
+            )
+            db.session.commit()
+        data["fresh_comments"] = iter(ids)
+
+    def prepare_tags(app, data, n):
+        prepare_fresh_advice(app, data, n)
+        from app import db
+        from app.models import EntityTag
+
+        ids = list(data["fresh_advice"])
+        with app.app_context():
+            db.session.execute(EntityTag.__table__.insert(), [{"tag_id": 1, "entity_id": i, "user_id": 1} for i in ids])
+            db.session.commit()
+        data["fresh_advice"] = iter(ids)
+
+    def next_of(data, key):
+        with data["lock"]:
+            return next(data[key])
+
+    def user_id(data, rng):
+        return rng.randint(1, data["users"])
+
+    return [
+        # app/api/advice.py
+        Route("GET /api/advice/", lambda c, d, r: c.get("/api/advice/", query_string={"page": r.randint(1, 5), "per_page": 10})),
+        Route("GET /api/advice/ filtered", lambda c, d, r: c.get(
+            "/api/advice/",
+            query_string={"filter_by_persona_id": r.randint(1, d["personas"]), "viewed_by_user_id": user_id(d, r),
+                          "per_page": 10},
+        )),
+        Route("POST /api/advice/", lambda c, d, r: c.post("/api/advice/", json={"persona_id": r.randint(1, d["personas"])})),
+        Route("POST /api/advice/ new slip", lambda c, d, r: c.post("/api/advice/", json={"persona_id": 1, "get_new_advice": True}),
+              expected=(201, 409)),
+        Route("GET /api/advice/export", lambda c, d, r: c.get("/api/advice/export", query_string={"filter_by_persona_id": 2})),
+        Route("GET /api/advice/search", lambda c, d, r: c.get(
+            "/api/advice/search", query_string={"q": r.choice(["save", "smile", "rest", "learn"]), "per_page": 10})),
+        Route("GET /api/advice/trending", lambda c, d, r: c.get("/api/advice/trending", query_string={"window": "7d"})),
+        Route("GET /api/advice/<id>", lambda c, d, r: c.get(f"/api/advice/{r.randint(1, d['size'])}")),
+        Route("DELETE /api/advice/<id>", lambda c, d, r: c.delete(f"/api/advice/{next_of(d, 'fresh_advice')}"),
+              prepare=prepare_fresh_advice),
+        Route("GET /api/advice/personas", lambda c, d, r: c.get("/api/advice/personas")),
+        Route("POST /api/advice/views", lambda c, d, r: c.post(
+            "/api/advice/views", json=dict(zip(("user_id", "entity_id"), unique_pair(d, r)))),
+            prepare=prepare_fresh_users),
+        Route("POST /api/advice/likes", lambda c, d, r: c.post(
+            "/api/advice/likes", json=dict(zip(("user_id", "entity_id"), unique_pair(d, r)))),
+            prepare=prepare_fresh_users),
+        Route("DELETE /api/advice/likes", lambda c, d, r: c.delete(
+            "/api/advice/likes", json={"user_id": next_of(d, "fresh_users"), "entity_id": 1}),
+            prepare=prepare_likes),
+        Route("POST /api/advice/comment", lambda c, d, r: c.post(
+            "/api/advice/comment", json={"user_id": user_id(d, r), "entity_id": r.randint(1, d["size"]), "content": "bench"})),
+        Route("DELETE /api/advice/comment", lambda c, d, r: c.delete(
+            "/api/advice/comment", json={"comment_id": next_of(d, "fresh_comments"), "entity_id": 1}),
+            prepare=prepare_comments),
+        Route("POST /api/advice/tag", lambda c, d, r: c.post(
+            "/api/advice/tag", json={"user_id": 1, "entity_id": next_of(d, "fresh_advice"), "tag_id": 1}),
+            prepare=prepare_fresh_advice),
+        Route("DELETE /api/advice/tag", lambda c, d, r: c.delete(
+            "/api/advice/tag", json={"tag_id": 1, "entity_id": next_of(d, "fresh_advice")}),
+            prepare=prepare_tags),
+        # app/api/users.py
+        Route("GET /api/users/", lambda c, d, r: c.get("/api/users/", query_string={"page": r.randint(1, 5), "per_page": 10})),
+        Route("POST /api/users/", lambda c, d, r: create_user(c, d)),
+        Route("GET /api/users/<username>", lambda c, d, r: c.get(f"/api/users/user{user_id(d, r)}")),
+        Route("GET /api/users/<id>", lambda c, d, r: c.get(f"/api/users/{user_id(d, r)}")),
+        Route("PUT /api/users/<id>", lambda c, d, r: (lambda i: c.put(
+            f"/api/users/{i}", json={"email": f"updated{i}@example.com"}, headers=basic_auth(f"bench{i}")))(
+            next_of(d, "fresh_users")), prepare=prepare_fresh_users),
+        Route("DELETE /api/users/<id>", lambda c, d, r: (lambda i: c.delete(
+            f"/api/users/{i}", headers=basic_auth(f"bench{i}")))(next_of(d, "fresh_users")),
+            prepare=prepare_fresh_users),
+        Route("GET /api/users/<id>/feed", lambda c, d, r: c.get(f"/api/users/{user_id(d, r)}/feed", query_string={"per_page": 10})),
+        # app/api/auth.py
+        Route("POST /api/auth/", lambda c, d, r: c.post("/api/auth/", headers=basic_auth(f"user{user_id(d, r)}"))),
+    ]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_route(app, route, data, args, rng):
+    """Sends warmup + measured requests for one route and returns its statistics"""
+
+    total = args.warmup + args.requests
+    if route.prepare:
+        route.prepare(app, data, total)
+
+    seeds = [rng.random() for _ in range(args.concurrency)]
+    latencies = []
+    errors = []
+    latencies_lock = threading.Lock()
+
+    def worker(index, count, measure):
+        client = app.test_client()
+        worker_rng = random.Random(seeds[index])
+        for _ in range(count):
+            start = time.perf_counter()
+            response = route.request(client, data, worker_rng)
+            elapsed = time.perf_counter() - start
+            if hasattr(response, "close"):
+                response.close()
+            if measure:
+                with latencies_lock:
+                    latencies.append(elapsed)
+                    if response.status_code not in route.expected:
+                        errors.append(response.status_code)
+
+    worker(0, args.warmup, measure=False)
+
+    per_worker = [args.requests // args.concurrency] * args.concurrency
+    for i in range(args.requests % args.concurrency):
+        per_worker[i] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(worker, i, n, True) for i, n in enumerate(per_worker)]:
+            future.result()
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+    to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return {
+        "route": route.name,
+        "size": data["size"],
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1]) if latencies else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    temp_dir = None
+    database_uri = args.database_uri
+    if not database_uri:
+        temp_dir = tempfile.TemporaryDirectory()
+        database_uri = f"sqlite:///{os.path.join(temp_dir.name, 'benchmark.db')}"
+    configure_environment(database_uri, args.upstream_url)
+
+    from flask import Flask
+    from app import db
+
+    config = make_config(database_uri)
+    if database_uri.startswith("sqlite"):
+        allow_sqlite_comments()
+
+    # app.api.advice looks up the default persona at import, so the schema and seed data have
+    # to exist before create_app() registers the blueprints.
+    sizes = [int(size) for size in args.sizes.split(",")]
+    bootstrap = Flask(__name__)
+    bootstrap.config.from_object(config)
+    db.init_app(bootstrap)
+    with bootstrap.app_context():
+        seed_dataset(db, sizes[0], random.Random(args.seed))
+
+    from app import create_app
+
+    app = create_app(config)
+    if not args.upstream_url:
+        install_stubs(args.upstream_latency_ms / 1000)
+
+    routes = build_routes()
+    if args.routes:
+        wanted = [r.strip() for r in args.routes.split(",")]
+        routes = [route for route in routes if any(w in route.name for w in wanted)]
+
+    results = []
+    for size in sizes:
+        with app.app_context():
+            data = seed_dataset(db, size, random.Random(args.seed))
+        for route in routes:
+            # Keep debug prints of the views out of the report when it is written to stdout.
+            with contextlib.redirect_stdout(sys.stderr):
+                result = run_route(app, route, data, args, rng)
+            results.append(result)
+            print(
+                f"[{size}] {route.name}: p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+                f"rps={result['throughput_rps']} errors={result['errors']}",
+                file=sys.stderr,
+            )
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_on": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": dialect,
+            "sizes": sizes,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "upstream_latency_ms": args.upstream_latency_ms,
+            "upstream_url": args.upstream_url,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if temp_dir:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        temp_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
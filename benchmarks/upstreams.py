@@ -0,0 +1,316 @@
+"""
+Local stand-ins for the Advice Slip API and the OpenAI Completions API, with latency and
+failure injection, for load tests without network access.
+
+    python -m benchmarks.upstreams --port 8099 --latency lognormal:200,0.6 --error-rate 0.02
+    UPSTREAM_SIMULATOR_URL=http://127.0.0.1:8099 flask run
+
+Routes:
+    GET  /adviceslip/advice/<slip_id>     Advice Slip "advice by id"
+    POST /openai/v1/completions           OpenAI completions, with or without "stream"
+    GET  /_simulator/config               current fault profile of each upstream
+    POST /_simulator/config               update it: {"openai": {"rate_limit_rate": 0.5}}
+    GET  /_simulator/stats                responses sent by upstream and outcome
+
+Every request draws its outcome from the upstream's profile, in this order: hang (sleep
+hang_seconds before answering, to trip client timeouts), rate_limit (429 with Retry-After),
+error (500), otherwise success. Successful responses are delayed by the latency distribution,
+and with slow_stream_rate the body is trickled in chunks over slow_stream_seconds.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+UPSTREAMS = ("adviceslip", "openai")
+ADVICESLIP_MAX_ID = 224
+ADVICE_WORDS = (
+    "smile", "save", "listen", "rest", "forgive", "learn", "walk", "plan", "laugh", "wait",
+)
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution in milliseconds into a function returning seconds.
+
+        fixed:MS | uniform:LOW,HIGH | exponential:MEAN | lognormal:MEDIAN,SIGMA
+
+    :param spec: distribution spec. Example: lognormal:200,0.5
+    :type spec: str
+    :rtype: function
+    """
+
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    try:
+        if name == "fixed":
+            (ms,) = values
+            return lambda: ms / 1000
+        if name == "uniform":
+            low, high = values
+            return lambda: random.uniform(low, high) / 1000
+        if name == "exponential":
+            (mean,) = values
+            return lambda: random.expovariate(1 / mean) / 1000 if mean else 0.0
+        if name == "lognormal":
+            median, sigma = values
+            return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class Profile:
+    """Fault profile of one upstream. All rates are probabilities per request."""
+
+    FIELDS = {
+        "latency": str,
+        "error_rate": float,
+        "rate_limit_rate": float,
+        "retry_after": int,
+        "hang_rate": float,
+        "hang_seconds": float,
+        "slow_stream_rate": float,
+        "slow_stream_seconds": float,
+        "not_found_rate": float,
+    }
+
+    def __init__(self, **settings):
+        self.latency = "fixed:0"
+        self.error_rate = 0.0
+        self.rate_limit_rate = 0.0
+        self.retry_after = 1
+        self.hang_rate = 0.0
+        self.hang_seconds = 30.0
+        self.slow_stream_rate = 0.0
+        self.slow_stream_seconds = 5.0
+        self.not_found_rate = 0.0
+        self.update(settings)
+
+    def update(self, settings):
+        for key, value in settings.items():
+            if key not in self.FIELDS:
+                raise ValueError(f"Unknown setting: {key}")
+            setattr(self, key, self.FIELDS[key](value))
+        self.sample_latency = parse_latency(self.latency)
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def outcome(self) -> str:
+        draw = random.random()
+        for outcome, rate in (
+            ("hang", self.hang_rate),
+            ("rate_limit", self.rate_limit_rate),
+            ("error", self.error_rate),
+        ):
+            if draw < rate:
+                return outcome
+            draw -= rate
+        return "ok"
+
+
+class Simulator:
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, upstream, outcome):
+        with self.lock:
+            self.stats[f"{upstream}:{outcome}"] += 1
+
+
+def advice_text(slip_id) -> str:
+    rng = random.Random(slip_id)
+    return f"{rng.choice(ADVICE_WORDS).capitalize()} more, {rng.choice(ADVICE_WORDS)} less."
+
+
+def completion(model, prompt) -> dict:
+    text = f" {prompt.rstrip(':').strip()} Trust the simulator, you must."
+    prompt_tokens = len(prompt.split())
+    completion_tokens = len(text.split())
+    return {
+        "id": f"cmpl-{uuid.uuid4().hex[:24]}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    simulator = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None, slow=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not slow:
+            self.wfile.write(data)
+            return None
+        chunks = [data[i : i + 16] for i in range(0, len(data), 16)] or [data]
+        for chunk in chunks:
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(slow / len(chunks))
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def inject(self, upstream, error_body):
+        """
+        Applies the fault profile: sends the failure response, or sleeps the sampled latency.
+        Returns None when a failure was sent, otherwise the seconds over which to trickle the
+        body (0 for a normal response).
+        """
+
+        profile = self.simulator.profiles[upstream]
+        outcome = profile.outcome()
+        self.simulator.count(upstream, outcome)
+        if outcome == "hang":
+            time.sleep(profile.hang_seconds)
+            self.send_body(504, error_body("Simulated upstream timeout."))
+            return None
+        if outcome == "rate_limit":
+            self.send_body(
+                429,
+                error_body("Rate limit reached. Simulated."),
+                headers={"Retry-After": str(profile.retry_after)},
+            )
+            return None
+        if outcome == "error":
+            self.send_body(500, error_body("Simulated server error."))
+            return None
+        slow = profile.slow_stream_seconds if random.random() < profile.slow_stream_rate else 0.0
+        time.sleep(profile.sample_latency())
+        return slow
+
+    def do_GET(self):
+        match = re.fullmatch(r"/adviceslip/advice/(\d+)", self.path)
+        if match:
+            return self.adviceslip(int(match.group(1)))
+        if self.path == "/_simulator/config":
+            return self.send_body(
+                200, {name: p.to_dict() for name, p in self.simulator.profiles.items()}
+            )
+        if self.path == "/_simulator/stats":
+            with self.simulator.lock:
+                return self.send_body(200, dict(self.simulator.stats))
+        self.send_body(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path == "/openai/v1/completions":
+            return self.openai_completions()
+        if self.path == "/_simulator/config":
+            try:
+                for upstream, settings in self.read_json().items():
+                    self.simulator.profiles[upstream].update(settings)
+            except (KeyError, ValueError, TypeError) as e:
+                return self.send_body(400, {"error": str(e)})
+            return self.send_body(
+                200, {name: p.to_dict() for name, p in self.simulator.profiles.items()}
+            )
+        self.send_body(404, {"error": "Not found"})
+
+    def adviceslip(self, slip_id):
+        error_body = lambda text: {"message": {"type": "error", "text": text}}
+        slow = self.inject("adviceslip", error_body)
+        if slow is None:
+            return None
+        profile = self.simulator.profiles["adviceslip"]
+        if slip_id > ADVICESLIP_MAX_ID or random.random() < profile.not_found_rate:
+            body = {"message": {"type": "notice", "text": "Advice slip not found."}}
+        else:
+            body = {"slip": {"id": slip_id, "advice": advice_text(slip_id)}}
+        # The real API answers with text/html, the client parses the body as JSON anyway.
+        self.send_body(200, body, content_type="text/html; charset=utf-8", slow=slow)
+
+    def openai_completions(self):
+        payload = self.read_json()
+        error_body = lambda message: {
+            "error": {"message": message, "type": "server_error", "param": None, "code": None}
+        }
+        slow = self.inject("openai", error_body)
+        if slow is None:
+            return None
+        response = completion(payload.get("model"), payload.get("prompt") or "")
+        if not payload.get("stream"):
+            return self.send_body(200, response, slow=slow)
+
+        # Server-sent events, one token per event, as the API streams completions.
+        tokens = re.findall(r"\s*\S+", response["choices"][0]["text"])
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            event = dict(response, choices=[dict(response["choices"][0], text=token)])
+            self.write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+            if slow:
+                time.sleep(slow / len(tokens))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--seed", type=int, help="Random seed of the fault injection.")
+    defaults = Profile()
+    for name, kind in Profile.FIELDS.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=kind,
+            default=getattr(defaults, name),
+            help=f"Applies to both upstreams (default: {getattr(defaults, name)}).",
+        )
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    settings = {name: getattr(args, name) for name in Profile.FIELDS}
+    Handler.simulator = Simulator({name: Profile(**settings) for name in UPSTREAMS})
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"Upstream simulator listening on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
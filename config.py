@@ -13,6 +13,116 @@ class Config():
     SESSION_TYPE = 'filesystem'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     PAGINATION_ITEMS_PER_PAGE = 3
+    EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', 1000))
+    FEED_SEEN_CACHE_MAX_USERS = int(os.environ.get('FEED_SEEN_CACHE_MAX_USERS', 10000))
+    FEED_SEEN_CACHE_MAX_ITEMS = int(os.environ.get('FEED_SEEN_CACHE_MAX_ITEMS', 50000))
+    FEED_SEEN_CACHE_TTL = int(os.environ.get('FEED_SEEN_CACHE_TTL', 60))
+    ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL', 300))
+    # tags_all/tags_any/tags_none advice filters: seconds before a worker reloads its tag index,
+    # and matches above which the database intersects the tags instead of an IN list of ids.
+    TAG_INDEX_TTL = int(os.environ.get('TAG_INDEX_TTL', 300))
+    TAG_INDEX_MAX_IDS = int(os.environ.get('TAG_INDEX_MAX_IDS', 10000))
+    # GET /api/advice/analytics: seconds a window's result is reused and event rows per fetch.
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 300))
+    ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 100000))
+    GENERATION_MAX_CONCURRENCY = int(os.environ.get('GENERATION_MAX_CONCURRENCY', 8))
+    GENERATION_MAX_CONCURRENCY_PER_USER = int(os.environ.get('GENERATION_MAX_CONCURRENCY_PER_USER', 2))
+    GENERATION_MAX_QUEUE = int(os.environ.get('GENERATION_MAX_QUEUE', 16))
+    GENERATION_QUEUE_TIMEOUT = float(os.environ.get('GENERATION_QUEUE_TIMEOUT', 5))
+    GENERATION_RETRY_AFTER = int(os.environ.get('GENERATION_RETRY_AFTER', 5))
+    # Concurrent OpenAI calls per model in this worker, so a slow model cannot take every slot
+    # from the others, and seconds a call waits for one. MODEL_POOL_LIMITS overrides the limit
+    # per model: "davinci:ft-yoda=2,davinci:ft-pirate=6".
+    MODEL_POOL_MAX_CONCURRENCY = int(os.environ.get('MODEL_POOL_MAX_CONCURRENCY', 4))
+    MODEL_POOL_QUEUE_TIMEOUT = float(os.environ.get('MODEL_POOL_QUEUE_TIMEOUT', 5))
+    MODEL_POOL_LIMITS = {
+        model.strip(): int(limit)
+        for model, _, limit in (
+            item.rpartition('=')
+            for item in os.environ.get('MODEL_POOL_LIMITS', '').split(',')
+            if item.strip()
+        )
+    }
+    PERSONA_SETTINGS_CACHE_TTL = int(os.environ.get('PERSONA_SETTINGS_CACHE_TTL', 300))
+    # Pre-generated advice kept ready per persona for POST /api/advice/. 0 disables the pool.
+    ADVICE_POOL_SIZE = int(os.environ.get('ADVICE_POOL_SIZE', 3))
+    ADVICE_POOL_REFILL_ENABLED = os.environ.get('ADVICE_POOL_REFILL_ENABLED', 'true').lower() == 'true'
+    # `flask users purge`: rows deleted per transaction and seconds to pause between batches.
+    USER_PURGE_BATCH_SIZE = int(os.environ.get('USER_PURGE_BATCH_SIZE', 5000))
+    USER_PURGE_PAUSE = float(os.environ.get('USER_PURGE_PAUSE', 0.1))
+    # POST /api/users/import: rows accepted per request (imported in the background), rows per
+    # batch and processes of the worker's shared hashing pool (0 for one per CPU).
+    USER_IMPORT_MAX_ROWS = int(os.environ.get('USER_IMPORT_MAX_ROWS', 10000))
+    USER_IMPORT_BATCH_SIZE = int(os.environ.get('USER_IMPORT_BATCH_SIZE', 1000))
+    USER_IMPORT_PROCESSES = int(os.environ.get('USER_IMPORT_PROCESSES', 0)) or None
+    # Postgres only: partition advice by month of created_on
+    # (read by the migration), months created ahead by `flask partitions create`, and full
+    # months kept by `flask partitions detach` before moving older ones to the archive schema
+    # (0 keeps everything).
+    PARTITIONING_ENABLED = os.environ.get('PARTITIONING_ENABLED', 'false').lower() == 'true'
+    PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+    PARTITION_RETENTION_MONTHS = int(os.environ.get('PARTITION_RETENTION_MONTHS', 0))
+    PARTITION_ARCHIVE_SCHEMA = os.environ.get('PARTITION_ARCHIVE_SCHEMA', 'archive')
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+    SQL_PROFILER_ENABLED = os.environ.get('SQL_PROFILER_ENABLED', 'false').lower() == 'true'
+    SQL_PROFILER_NPLUSONE_THRESHOLD = int(os.environ.get('SQL_PROFILER_NPLUSONE_THRESHOLD', 5))
+    SQL_PROFILER_SLOW_REQUEST_MS = float(os.environ.get('SQL_PROFILER_SLOW_REQUEST_MS', 500))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_RETRY_AFTER = int(os.environ.get('DB_RETRY_AFTER', 2))
+    # Reaction to upstream calls made while holding a DB connection: warn, raise or off.
+    DB_IO_GUARD = os.environ.get('DB_IO_GUARD', 'warn')
+    # Postgres statement_timeout of request transactions, set with SET LOCAL so it is safe behind
+    # pgbouncer in transaction pooling mode. 0 disables it. DB_STATEMENT_TIMEOUTS overrides it per
+    # endpoint: "api.advice_advice_export=300000,api.users_user_feed=2000".
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+    DB_STATEMENT_TIMEOUTS = {
+        'api.advice_advice_export': 300000,
+        **{
+            endpoint.strip(): int(ms)
+            for endpoint, _, ms in (
+                item.partition('=')
+                for item in os.environ.get('DB_STATEMENT_TIMEOUTS', '').split(',')
+                if item.strip()
+            )
+        },
+    }
+    # SQLite uses a NullPool/StaticPool that takes none of the pool options.
+    SQLALCHEMY_ENGINE_OPTIONS = {} if os.environ.get('DATABASE_URI', '').startswith('sqlite') else {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    # Read replicas: GET requests read from these binds, see app/routing.py.
+    SQLALCHEMY_BINDS = {
+        f'replica_{i}': uri.strip()
+        for i, uri in enumerate(os.environ.get('DATABASE_REPLICA_URIS', '').split(','))
+        if uri.strip()
+    }
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    # Point both upstreams at a local simulator (python -m benchmarks.upstreams) when set.
+    UPSTREAM_SIMULATOR_URL = os.environ.get('UPSTREAM_SIMULATOR_URL', '').rstrip('/')
+    ADVICESLIP_API_BASE = os.environ.get(
+        'ADVICESLIP_API_BASE',
+        f'{UPSTREAM_SIMULATOR_URL}/adviceslip' if UPSTREAM_SIMULATOR_URL else 'https://api.adviceslip.com')
+    ADVICESLIP_TIMEOUT = float(os.environ.get('ADVICESLIP_TIMEOUT', 10))
+    OPENAI_API_BASE = os.environ.get(
+        'OPENAI_API_BASE',
+        f'{UPSTREAM_SIMULATOR_URL}/openai/v1' if UPSTREAM_SIMULATOR_URL else None)
+    OPENAI_REQUEST_TIMEOUT = float(os.environ.get('OPENAI_REQUEST_TIMEOUT', 60))
+    # Generation settings of personas that do not set their own (persona table columns).
+    OPENAI_MODEL = os.environ.get('OPENAI_FINETUNED_MODEL')
+    OPENAI_TEMPERATURE = float(os.environ.get('OPENAI_TEMPERATURE', 0.2))
+    OPENAI_MAX_TOKENS = int(os.environ.get('OPENAI_MAX_TOKENS', 1024))
+    OPENAI_PROMPT_SUFFIX = os.environ.get('OPENAI_PROMPT_SUFFIX', ':::')
     if APP_ENVIRONMENT == "DEV":
         SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI', '')
     elif APP_ENVIRONMENT == "PROD":
@@ -0,0 +1,37 @@
+"""seed trending epochs
+
+Revision ID: 1d6e8f3a5c27
+Revises: 7e3b5a9c2d48
+Create Date: 2026-10-19 22:14:05.371846
+
+"""
+import datetime as dt
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d6e8f3a5c27'
+down_revision = '7e3b5a9c2d48'
+branch_labels = None
+depends_on = None
+
+# TRENDING_WINDOWS of app/trending.py. Engagement requests only read the epochs, so they have
+# to exist before the first one; compact and rebuild add epochs of windows added later.
+TIME_WINDOWS = ['24h', '7d']
+
+
+def upgrade():
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    for time_window in TIME_WINDOWS:
+        op.execute(
+            sa.text(
+                "INSERT INTO trending_epoch (time_window, epoch) SELECT :time_window, :epoch "
+                "WHERE NOT EXISTS (SELECT 1 FROM trending_epoch WHERE time_window = :time_window)"
+            ).bindparams(time_window=time_window, epoch=now)
+        )
+
+
+def downgrade():
+    # The epochs are recreated on demand by compact and rebuild, keeping them is harmless.
+    pass
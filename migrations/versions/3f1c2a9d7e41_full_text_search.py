@@ -0,0 +1,68 @@
+"""full text search
+
+Revision ID: 3f1c2a9d7e41
+Revises: 6974a5459bf5
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e41'
+down_revision = '6974a5459bf5'
+branch_labels = None
+depends_on = None
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS advice_fts USING fts5(content, tokenize='porter')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entity_comment_fts "
+    "USING fts5(content, entity_id UNINDEXED, tokenize='porter')",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ai AFTER INSERT ON advice BEGIN "
+    "INSERT INTO advice_fts(rowid, content) VALUES (new.entity_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ad AFTER DELETE ON advice BEGIN "
+    "DELETE FROM advice_fts WHERE rowid = old.entity_id; END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_au AFTER UPDATE OF content ON advice BEGIN "
+    "UPDATE advice_fts SET content = new.content WHERE rowid = old.entity_id; END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ai AFTER INSERT ON entity_comment BEGIN "
+    "INSERT INTO entity_comment_fts(rowid, content, entity_id) "
+    "VALUES (new.comment_id, new.content, new.entity_id); END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ad AFTER DELETE ON entity_comment BEGIN "
+    "DELETE FROM entity_comment_fts WHERE rowid = old.comment_id; END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_au AFTER UPDATE OF content ON entity_comment BEGIN "
+    "UPDATE entity_comment_fts SET content = new.content WHERE rowid = old.comment_id; END",
+]
+
+
+def upgrade():
+    # Expression indexes and FTS5 tables are not picked up by autogenerate.
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.create_index('ix_advice_content_fts', 'advice',
+                        [sa.text("to_tsvector('english'::regconfig, content)")],
+                        postgresql_using='gin')
+        op.create_index('ix_entity_comment_content_fts', 'entity_comment',
+                        [sa.text("to_tsvector('english'::regconfig, content)")],
+                        postgresql_using='gin')
+
+    elif bind.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO advice_fts(rowid, content) SELECT entity_id, content FROM advice")
+        op.execute("INSERT INTO entity_comment_fts(rowid, content, entity_id) "
+                   "SELECT comment_id, content, entity_id FROM entity_comment")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_entity_comment_content_fts', table_name='entity_comment')
+        op.drop_index('ix_advice_content_fts', table_name='advice')
+
+    elif bind.dialect.name == 'sqlite':
+        for trigger in ['advice_fts_ai', 'advice_fts_ad', 'advice_fts_au',
+                        'entity_comment_fts_ai', 'entity_comment_fts_ad', 'entity_comment_fts_au']:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS entity_comment_fts")
+        op.execute("DROP TABLE IF EXISTS advice_fts")
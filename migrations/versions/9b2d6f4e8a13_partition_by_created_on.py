@@ -0,0 +1,158 @@
+"""partition advice by created_on
+
+Revision ID: 9b2d6f4e8a13
+Revises: e7a3c95d04b1
+Create Date: 2026-10-19 17:21:36.204815
+
+"""
+import datetime as dt
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d6f4e8a13'
+down_revision = 'e7a3c95d04b1'
+branch_labels = None
+depends_on = None
+
+# Only on Postgres, and only with PARTITIONING_ENABLED. A partitioned table's primary key must
+# include the partition key, so created_on joins the primary key of advice. entity_view and
+# entity_like stay unpartitioned: their primary keys are what keeps one view and one like per
+# user and entity, and a unique constraint on a partitioned table has to include created_on.
+# (table, primary key, foreign keys (name, columns, referred table, referred columns, ondelete),
+# indexes (name, definition))
+TABLES = [
+    ('advice', ['entity_id'],
+     [('advice_entity_id_fkey', ['entity_id'], 'entity', ['entity_id'], 'CASCADE'),
+      ('advice_persona_id_fkey', ['persona_id'], 'persona', ['persona_id'], None)],
+     [('ix_advice_content_fts', "USING gin (to_tsvector('english'::regconfig, content))")]),
+]
+
+# (entity_id, created_on) no longer stops a second advice for an entity, so a trigger does. It
+# locks the entity row first, so concurrent inserts for one entity queue up and the second one
+# sees the first. Row triggers on a partitioned table need Postgres 13.
+ADVICE_UNIQUE_DDL = [
+    """CREATE FUNCTION advice_unique_entity_id() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM entity WHERE entity_id = NEW.entity_id FOR NO KEY UPDATE;
+    IF EXISTS (SELECT 1 FROM advice WHERE entity_id = NEW.entity_id) THEN
+        RAISE EXCEPTION 'duplicate key value violates unique constraint "advice_pkey"'
+            USING ERRCODE = 'unique_violation', CONSTRAINT = 'advice_pkey',
+                  DETAIL = format('Key (entity_id)=(%s) already exists.', NEW.entity_id);
+    END IF;
+    RETURN NEW;
+END
+$$""",
+    "CREATE TRIGGER advice_unique_entity_id_insert BEFORE INSERT ON advice "
+    "FOR EACH ROW EXECUTE FUNCTION advice_unique_entity_id()",
+    "CREATE TRIGGER advice_unique_entity_id_update BEFORE UPDATE OF entity_id ON advice "
+    "FOR EACH ROW WHEN (NEW.entity_id IS DISTINCT FROM OLD.entity_id) "
+    "EXECUTE FUNCTION advice_unique_entity_id()",
+]
+
+# SQLite batch mode recreates advice, which drops its full text search triggers.
+SQLITE_ADVICE_FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ai AFTER INSERT ON advice BEGIN "
+    "INSERT INTO advice_fts(rowid, content) VALUES (new.entity_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_ad AFTER DELETE ON advice BEGIN "
+    "DELETE FROM advice_fts WHERE rowid = old.entity_id; END",
+    "CREATE TRIGGER IF NOT EXISTS advice_fts_au AFTER UPDATE OF content ON advice BEGIN "
+    "UPDATE advice_fts SET content = new.content WHERE rowid = old.entity_id; END",
+]
+
+
+def _enabled():
+    return (op.get_bind().dialect.name == 'postgresql'
+            and current_app.config.get('PARTITIONING_ENABLED'))
+
+
+def _is_partitioned(table):
+    return op.get_bind().exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        f"WHERE partrelid = to_regclass('\"{table}\"'))"
+    ).scalar()
+
+
+def _months(first, months_ahead):
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    month = (first or now).astimezone(dt.timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    last = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(months_ahead):
+        last = (last + dt.timedelta(days=32)).replace(day=1)
+    while month <= last:
+        following = (month + dt.timedelta(days=32)).replace(day=1)
+        yield month, following
+        month = following
+
+
+def _add_keys(table, primary_key, foreign_keys, indexes):
+    columns = ', '.join(f'"{column}"' for column in primary_key)
+    op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ({columns})')
+    for name, columns, referred_table, referred_columns, ondelete in foreign_keys:
+        op.execute(
+            f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY '
+            f'({", ".join(columns)}) REFERENCES "{referred_table}" ({", ".join(referred_columns)})'
+            + (f' ON DELETE {ondelete}' if ondelete else '')
+        )
+    for name, definition in indexes:
+        op.execute(f'CREATE INDEX "{name}" ON "{table}" {definition}')
+
+
+def _set_advice_created_on_nullable(nullable):
+    # On every database, so the schema matches the model whether or not advice is partitioned
+    if not nullable:
+        op.execute("UPDATE advice SET created_on = CURRENT_TIMESTAMP WHERE created_on IS NULL")
+    with op.batch_alter_table('advice', schema=None) as batch_op:
+        batch_op.alter_column('created_on', existing_type=sa.DateTime(timezone=True),
+                              nullable=nullable)
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_ADVICE_FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    _set_advice_created_on_nullable(False)
+    if not _enabled():
+        return
+    months_ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    for table, primary_key, foreign_keys, indexes in TABLES:
+        if _is_partitioned(table):
+            continue
+        old = f'{table}_unpartitioned'
+        op.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+        op.execute(
+            f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (created_on)'
+        )
+        op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        first = op.get_bind().exec_driver_sql(f'SELECT min(created_on) FROM "{old}"').scalar()
+        for start, end in _months(first, months_ahead):
+            op.execute(
+                f'CREATE TABLE "{table}_p{start:%Y%m}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        op.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+        op.execute(f'DROP TABLE "{old}"')
+        _add_keys(table, primary_key + ['created_on'], foreign_keys, indexes)
+        if table == 'advice':
+            for statement in ADVICE_UNIQUE_DDL:
+                op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, primary_key, foreign_keys, indexes in reversed(TABLES):
+            if not _is_partitioned(table):
+                continue
+            old = f'{table}_partitioned'
+            if table == 'advice':
+                op.execute('DROP FUNCTION advice_unique_entity_id() CASCADE')
+            op.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+            op.execute(f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS)')
+            op.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+            op.execute(f'DROP TABLE "{old}" CASCADE')
+            _add_keys(table, primary_key, foreign_keys, indexes)
+    _set_advice_created_on_nullable(True)
@@ -0,0 +1,81 @@
+"""on delete cascades
+
+Revision ID: c4e91f7a2b58
+Revises: 5d0e7b3c1a62
+Create Date: 2026-10-19 15:08:52.901377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e91f7a2b58'
+down_revision = '5d0e7b3c1a62'
+branch_labels = None
+depends_on = None
+
+# The initial migration created these foreign keys unnamed. Postgres named them
+# <table>_<columns>_fkey; the convention gives reflected SQLite constraints the same names so
+# batch mode can drop them.
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_N_name)s_fkey"}
+
+# (table, columns, referred table, referred columns, old ondelete, new ondelete)
+FOREIGN_KEYS = [
+    ('entity_comment', ['user_id'], 'user', ['user_id'], None, 'SET NULL'),
+    ('entity_tag', ['user_id'], 'user', ['user_id'], None, 'CASCADE'),
+    ('entity_comment_like', ['comment_id', 'entity_id'], 'entity_comment',
+     ['comment_id', 'entity_id'], None, 'CASCADE'),
+]
+
+# Indexes on foreign key columns, so cascades find the child rows without a full scan.
+INDEXES = [
+    ('entity_comment', 'ix_entity_comment_entity_id', ['entity_id']),
+    ('entity_comment', 'ix_entity_comment_user_id', ['user_id']),
+    ('entity_tag', 'ix_entity_tag_entity_id', ['entity_id']),
+    ('entity_tag', 'ix_entity_tag_user_id', ['user_id']),
+    ('entity_view', 'ix_entity_view_entity_id', ['entity_id']),
+    ('entity_like', 'ix_entity_like_entity_id', ['entity_id']),
+    ('entity_comment_like', 'ix_entity_comment_like_comment_id_entity_id', ['comment_id', 'entity_id']),
+]
+
+# SQLite batch mode recreates entity_comment, which drops its full text search triggers.
+SQLITE_COMMENT_FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ai AFTER INSERT ON entity_comment BEGIN "
+    "INSERT INTO entity_comment_fts(rowid, content, entity_id) "
+    "VALUES (new.comment_id, new.content, new.entity_id); END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_ad AFTER DELETE ON entity_comment BEGIN "
+    "DELETE FROM entity_comment_fts WHERE rowid = old.comment_id; END",
+    "CREATE TRIGGER IF NOT EXISTS entity_comment_fts_au AFTER UPDATE OF content ON entity_comment BEGIN "
+    "UPDATE entity_comment_fts SET content = new.content WHERE rowid = old.comment_id; END",
+]
+
+
+def _replace_foreign_keys(new):
+    for table, columns, referred_table, referred_columns, old_ondelete, new_ondelete in FOREIGN_KEYS:
+        name = f"{table}_{'_'.join(columns)}_fkey"
+        with op.batch_alter_table(
+            table, schema=None, naming_convention=NAMING_CONVENTION
+        ) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(
+                name, referred_table, columns, referred_columns,
+                ondelete=new_ondelete if new else old_ondelete,
+            )
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_COMMENT_FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    _replace_foreign_keys(new=True)
+    for table, name, columns in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    for table, name, columns in reversed(INDEXES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(name)
+    _replace_foreign_keys(new=False)